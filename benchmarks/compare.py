@@ -0,0 +1,73 @@
+"""
+Compares two benchmark result files written by benchmarks.run.
+
+Usage:
+	python -m benchmarks.compare BASELINE.json CANDIDATE.json [--threshold 10]
+
+Exits with status 1 if the throughput of any scenario dropped by more than
+threshold percent.
+"""
+
+import argparse
+import json
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+
+COLUMNS = [
+	("messages_per_second", "msg/s", True),
+	("p50_latency", "p50", False),
+	("p99_latency", "p99", False),
+	("peak_rss_mb", "RSS MB", False),
+	("db_queries", "queries", False),
+]
+
+
+def _load(path: str) -> Tuple[Dict[str, Any], Dict[Tuple[str, int], Dict[str, Any]]]:
+	with open(path) as f:
+		report = json.load(f)
+	return report, {(r["platform"], r["recipients"]): r for r in report["results"]}
+
+
+def _change(old: Optional[float], new: Optional[float]) -> Optional[float]:
+	if not old or new is None:
+		return None
+	return (new - old) * 100.0 / old
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+	parser = argparse.ArgumentParser(description="Compare two benchmark result files.")
+	parser.add_argument("baseline")
+	parser.add_argument("candidate")
+	parser.add_argument(
+		"--threshold", type=float, default=10.0,
+		help="maximum tolerated throughput drop, in percent"
+	)
+	args = parser.parse_args(argv)
+
+	old_report, old = _load(args.baseline)
+	new_report, new = _load(args.candidate)
+	print("{} -> {}".format(old_report["version"], new_report["version"]))
+
+	regressions = []
+	for key in sorted(set(old) & set(new)):
+		cells = []
+		for field, label, higher_is_better in COLUMNS:
+			change = _change(old[key].get(field), new[key].get(field))
+			cells.append("{} {}".format(
+				label, "n/a" if change is None else "{:+.1f}%".format(change)
+			))
+			if higher_is_better and change is not None and change < -args.threshold:
+				regressions.append(key)
+		print("{:>4} {:>9}: {}".format(key[0], key[1], ", ".join(cells)))
+
+	if regressions:
+		print("Throughput regressions: {}".format(
+			", ".join("{}:{}".format(*key) for key in regressions)
+		))
+		return 1
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,294 @@
+"""
+Throughput benchmarks for the bulk send paths, against local provider stand-ins.
+
+Usage:
+	python -m benchmarks.run [--platforms fcm,apns,wns,wp] [--sizes 1000,100000,1000000]
+		[--latency SECONDS] [--error-rate RATE] [--output results.json]
+
+Every (platform, size) scenario runs in a fresh interpreter, so that peak RSS
+is measured per scenario. Results are written as JSON, see benchmarks.compare
+to compare two result files.
+"""
+
+import argparse
+import base64
+import json
+import logging
+import os
+import platform as py_platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from typing import Any, Dict, List, Optional
+
+from .servers import Behaviour, FakeAPNsServer, FakeHTTPServer, make_tls_certificate
+
+
+PLATFORMS = ["fcm", "apns", "wns", "wp"]
+DEFAULT_SIZES = [1000]
+BATCH_SIZE = 5000
+
+
+def _percentile(values: List[float], percentile: float) -> Optional[float]:
+	if not values:
+		return None
+	values = sorted(values)
+	index = min(len(values) - 1, int(round(percentile / 100.0 * (len(values) - 1))))
+	return values[index]
+
+
+def _peak_rss_mb() -> float:
+	rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# bytes on macOS, kilobytes elsewhere
+	return rss / (1024.0 * 1024.0) if sys.platform == "darwin" else rss / 1024.0
+
+
+def _write_ec_key(path: str) -> None:
+	from cryptography.hazmat.primitives import serialization
+	from cryptography.hazmat.primitives.asymmetric import ec
+
+	key = ec.generate_private_key(ec.SECP256R1())
+	with open(path, "wb") as f:
+		f.write(key.private_bytes(
+			serialization.Encoding.PEM,
+			serialization.PrivateFormat.PKCS8,
+			serialization.NoEncryption(),
+		))
+
+
+def _subscriber_keys(count: int) -> List[Dict[str, str]]:
+	"""Valid WebPush subscriber keys, a small pool is reused for all devices."""
+	from cryptography.hazmat.primitives import serialization
+	from cryptography.hazmat.primitives.asymmetric import ec
+
+	keys = []
+	for _ in range(count):
+		public = ec.generate_private_key(ec.SECP256R1()).public_key().public_bytes(
+			serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint
+		)
+		keys.append({
+			"p256dh": base64.urlsafe_b64encode(public).decode().rstrip("="),
+			"auth": base64.urlsafe_b64encode(os.urandom(16)).decode().rstrip("="),
+		})
+	return keys
+
+
+def _configure(tmpdir: str, http: FakeHTTPServer, apns: Optional[FakeAPNsServer]) -> None:
+	import django
+	from django.conf import settings
+	from py_vapid import Vapid
+
+	vapid_key_path = os.path.join(tmpdir, "vapid.pem")
+	vapid = Vapid()
+	vapid.generate_keys()
+	vapid.save_key(vapid_key_path)
+
+	apns_key_path = os.path.join(tmpdir, "apns.p8")
+	_write_ec_key(apns_key_path)
+
+	settings.configure(
+		DATABASES={
+			"default": {
+				"ENGINE": "django.db.backends.sqlite3",
+				"NAME": os.path.join(tmpdir, "bench.sqlite3"),
+			}
+		},
+		INSTALLED_APPS=[
+			"django.contrib.auth",
+			"django.contrib.contenttypes",
+			"push_notifications",
+		],
+		USE_TZ=True,
+		PUSH_NOTIFICATIONS_SETTINGS={
+			# firebase-admin's send_each() takes at most 500 messages
+			"FCM_MAX_RECIPIENTS": 500,
+			"APNS_AUTH_KEY_PATH": apns_key_path,
+			"APNS_AUTH_KEY_ID": "BENCHKEYID",
+			"APNS_TEAM_ID": "BENCHTEAM1",
+			"APNS_TOPIC": "com.example.bench",
+			"APNS_USE_SANDBOX": False,
+			"WNS_PACKAGE_SECURITY_ID": "bench",
+			"WNS_SECRET_KEY": "bench",
+			"WNS_ACCESS_URL": http.url + "/wns/token",
+			"WP_PRIVATE_KEY": vapid_key_path,
+			"WP_CLAIMS": {"sub": "mailto:bench@example.com"},
+			"WP_POST_URL": {browser: http.url + "/wp" for browser in (
+				"CHROME", "OPERA", "FIREFOX", "EDGE", "SAFARI"
+			)},
+		},
+	)
+	django.setup()
+
+	from django.core.management import call_command
+	call_command("migrate", verbosity=0)
+
+	# point the provider SDKs at the local stand-ins
+	import firebase_admin
+	import requests
+	from firebase_admin import credentials, messaging
+	from google.auth.credentials import AnonymousCredentials
+
+	class _AnonymousCredential(credentials.Base):
+		def get_credential(self) -> AnonymousCredentials:
+			return AnonymousCredentials()
+
+	app = firebase_admin.initialize_app(_AnonymousCredential(), {"projectId": "bench"})
+	service = messaging._get_messaging_service(app)
+	service._fcm_url = http.url + "/v1/projects/bench/messages:send"
+	service._client.session.mount(
+		http.url, requests.adapters.HTTPAdapter(pool_connections=100, pool_maxsize=100)
+	)
+
+	if apns is not None:
+		from aioapns import connection
+
+		connection.APNsProductionClientProtocol.APNS_SERVER = "127.0.0.1"
+		connection.APNsProductionClientProtocol.APNS_PORT = apns.port
+
+
+def _create_devices(platform: str, size: int, url: str) -> Any:
+	from push_notifications.models import APNSDevice, GCMDevice, WebPushDevice, WNSDevice
+
+	if platform == "fcm":
+		model = GCMDevice
+		make = lambda i: GCMDevice(registration_id="fcm-token-%d" % i, cloud_message_type="FCM")  # noqa: E731
+	elif platform == "apns":
+		model = APNSDevice
+		make = lambda i: APNSDevice(registration_id="%064x" % i)  # noqa: E731
+	elif platform == "wns":
+		model = WNSDevice
+		make = lambda i: WNSDevice(registration_id="%s/wns/%d" % (url, i))  # noqa: E731
+	else:
+		model = WebPushDevice
+		keys = _subscriber_keys(16)
+		make = lambda i: WebPushDevice(registration_id="sub-%d" % i, **keys[i % len(keys)])  # noqa: E731
+
+	for start in range(0, size, BATCH_SIZE):
+		model.objects.bulk_create([make(i) for i in range(start, min(size, start + BATCH_SIZE))])
+	return model
+
+
+def run_scenario(platform: str, size: int, latency: float, error_rate: float) -> Dict[str, Any]:
+	"""Runs one scenario in this process. Django must not be configured yet."""
+	warnings.simplefilter("ignore")
+	# aioapns logs every failed notification
+	logging.getLogger("aioapns").setLevel(logging.CRITICAL)
+	tmpdir = tempfile.mkdtemp(prefix="push-bench-")
+	behaviour = Behaviour(latency=latency, error_rate=error_rate)
+	http = FakeHTTPServer(behaviour).start()
+	apns = None
+	if platform == "apns":
+		cert_path, key_path = make_tls_certificate(tmpdir)
+		# trusted by the default SSL context aioapns creates
+		os.environ["SSL_CERT_FILE"] = cert_path
+		apns = FakeAPNsServer(cert_path, key_path, behaviour).start()
+
+	_configure(tmpdir, http, apns)
+
+	from django.db import connection
+	from django.test.utils import CaptureQueriesContext
+
+	from push_notifications import metrics
+	from push_notifications.exceptions import NotificationError
+
+	model = _create_devices(platform, size, http.url)
+
+	class LatencyBackend(metrics.MetricsBackend):
+		def __init__(self) -> None:
+			super().__init__()
+			self.latencies: List[float] = []
+
+		def observe(self, name: str, value: float, tags: Optional[Dict[str, str]] = None) -> None:
+			if name == "request_latency":
+				self.latencies.append(value)
+
+	backend = LatencyBackend()
+	metrics.set_backend(backend)
+
+	error = None
+	with CaptureQueriesContext(connection) as queries:
+		start = time.perf_counter()
+		try:
+			model.objects.all().send_message("Benchmark notification")
+		except NotificationError as e:
+			# APNs raises once the whole batch is done if any token failed
+			error = e.__class__.__name__
+		elapsed = time.perf_counter() - start
+
+	http.stop()
+	if apns is not None:
+		apns.stop()
+
+	return {
+		"platform": platform,
+		"recipients": size,
+		"seconds": elapsed,
+		"messages_per_second": size / elapsed if elapsed else None,
+		"p50_latency": _percentile(backend.latencies, 50),
+		"p99_latency": _percentile(backend.latencies, 99),
+		"provider_requests": behaviour.requests,
+		"peak_rss_mb": _peak_rss_mb(),
+		"db_queries": len(queries.captured_queries),
+		"deactivated": model.objects.filter(active=False).count(),
+		"error": error,
+	}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument("--platforms", default=",".join(PLATFORMS))
+	parser.add_argument("--sizes", default=",".join(str(s) for s in DEFAULT_SIZES))
+	parser.add_argument("--latency", type=float, default=0.0, help="provider latency, seconds")
+	parser.add_argument("--error-rate", type=float, default=0.0, help="share of failing tokens")
+	parser.add_argument("--output", help="write the results to this JSON file")
+	parser.add_argument("--scenario", help=argparse.SUPPRESS)
+	args = parser.parse_args(argv)
+
+	if args.scenario:
+		platform, size = args.scenario.split(":")
+		result = run_scenario(platform, int(size), args.latency, args.error_rate)
+		print(json.dumps(result))
+		return
+
+	from importlib import metadata
+
+	results = []
+	for platform in args.platforms.split(","):
+		for size in [int(s) for s in args.sizes.split(",")]:
+			proc = subprocess.run(
+				[
+					sys.executable, "-m", "benchmarks.run",
+					"--scenario", "%s:%d" % (platform, size),
+					"--latency", str(args.latency),
+					"--error-rate", str(args.error_rate),
+				],
+				stdout=subprocess.PIPE, universal_newlines=True, check=True,
+			)
+			result = json.loads(proc.stdout.strip().splitlines()[-1])
+			results.append(result)
+			print(
+				"{platform:>4} {recipients:>9} recipients: {messages_per_second:10.1f} msg/s, "
+				"peak RSS {peak_rss_mb:.1f} MB, {db_queries} queries".format(**result),
+				file=sys.stderr,
+			)
+
+	report = {
+		"version": metadata.version("django-push-notifications"),
+		"python": py_platform.python_version(),
+		"date": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+		"latency": args.latency,
+		"error_rate": args.error_rate,
+		"results": results,
+	}
+	if args.output:
+		with open(args.output, "w") as f:
+			json.dump(report, f, indent=2)
+	else:
+		print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+	main()
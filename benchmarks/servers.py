@@ -0,0 +1,239 @@
+"""
+Local stand-ins for the push providers, used by the benchmarks.
+
+FakeHTTPServer serves the FCM v1 send endpoint, the WNS token and notification
+endpoints and WebPush endpoints over HTTP/1.1. FakeAPNsServer speaks HTTP/2
+over TLS like api.push.apple.com. Both can add latency and answer a fraction
+of the requests with a device level error (unregistered token / expired
+subscription).
+"""
+
+import asyncio
+import datetime
+import ipaddress
+import json
+import os
+import random
+import ssl
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from h2.config import H2Configuration
+from h2.connection import H2Connection
+from h2.events import ConnectionTerminated, DataReceived, RequestReceived, StreamEnded
+
+
+FCM_UNREGISTERED = json.dumps({
+	"error": {
+		"code": 404,
+		"message": "Requested entity was not found.",
+		"status": "NOT_FOUND",
+		"details": [{
+			"@type": "type.googleapis.com/google.firebase.fcm.v1.FcmError",
+			"errorCode": "UNREGISTERED",
+		}],
+	}
+}).encode()
+
+
+class Behaviour:
+	"""Latency (seconds) and error rate (0..1) of a fake provider."""
+
+	def __init__(self, latency: float = 0.0, error_rate: float = 0.0, seed: int = 0) -> None:
+		self.latency = latency
+		self.error_rate = error_rate
+		self._random = random.Random(seed)
+		self._lock = threading.Lock()
+		self.requests = 0
+
+	def next(self, sleep: bool = True) -> bool:
+		"""Waits for the configured latency, returns True if the request should fail."""
+		with self._lock:
+			self.requests += 1
+			failed = self._random.random() < self.error_rate
+		if sleep and self.latency:
+			time.sleep(self.latency)
+		return failed
+
+
+class _Handler(BaseHTTPRequestHandler):
+	protocol_version = "HTTP/1.1"
+
+	def log_message(self, format: str, *args: Any) -> None:
+		pass
+
+	def _reply(self, status: int, body: bytes = b"", content_type: str = "application/json") -> None:
+		self.send_response(status)
+		self.send_header("Content-Type", content_type)
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def do_POST(self) -> None:
+		self.rfile.read(int(self.headers.get("Content-Length") or 0))
+		behaviour = self.server.behaviour
+
+		if self.path == "/wns/token":
+			body = {"access_token": "token", "token_type": "bearer", "expires_in": 86400}
+			return self._reply(200, json.dumps(body).encode())
+
+		failed = behaviour.next()
+		if self.path.startswith("/v1/projects/"):
+			if failed:
+				return self._reply(404, FCM_UNREGISTERED)
+			body = {"name": "projects/bench/messages/%d" % behaviour.requests}
+			return self._reply(200, json.dumps(body).encode())
+		elif self.path.startswith("/wns/"):
+			# WNS errors raise in the library, so the WNS stand-in always succeeds
+			return self._reply(200, content_type="text/plain")
+		elif self.path.startswith("/wp/"):
+			return self._reply(410 if failed else 201, content_type="text/plain")
+		self._reply(404)
+
+
+class _ThreadingHTTPServer(ThreadingHTTPServer):
+	daemon_threads = True
+	# the bulk senders open many connections at once
+	request_queue_size = 1024
+
+
+class FakeHTTPServer:
+	"""
+	Threaded HTTP/1.1 server on 127.0.0.1 for FCM, WNS and WebPush:
+
+		POST /v1/projects/<project>/messages:send   FCM v1
+		POST /wns/token                             WNS OAuth token
+		POST /wns/<channel>                         WNS notification
+		POST /wp/<subscription>                     WebPush
+	"""
+
+	def __init__(self, behaviour: Optional[Behaviour] = None) -> None:
+		self.behaviour = behaviour or Behaviour()
+		self._server = _ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+		self._server.behaviour = self.behaviour
+		self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+	@property
+	def url(self) -> str:
+		return "http://127.0.0.1:%d" % self._server.server_address[1]
+
+	def start(self) -> "FakeHTTPServer":
+		self._thread.start()
+		return self
+
+	def stop(self) -> None:
+		self._server.shutdown()
+		self._server.server_close()
+
+
+class _APNsProtocol(asyncio.Protocol):
+	def __init__(self, behaviour: Behaviour) -> None:
+		self.behaviour = behaviour
+		self.conn = H2Connection(config=H2Configuration(client_side=False))
+		self.apns_ids: Dict[int, str] = {}
+
+	def connection_made(self, transport: asyncio.BaseTransport) -> None:
+		self.transport = transport
+		self.conn.local_settings.max_concurrent_streams = 1000
+		self.conn.initiate_connection()
+		self.transport.write(self.conn.data_to_send())
+
+	def data_received(self, data: bytes) -> None:
+		for event in self.conn.receive_data(data):
+			if isinstance(event, RequestReceived):
+				headers = dict(
+					(k.decode() if isinstance(k, bytes) else k, v.decode() if isinstance(v, bytes) else v)
+					for k, v in event.headers
+				)
+				self.apns_ids[event.stream_id] = headers.get("apns-id", str(event.stream_id))
+			elif isinstance(event, DataReceived):
+				self.conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+			elif isinstance(event, StreamEnded):
+				asyncio.get_event_loop().create_task(self._respond(event.stream_id))
+			elif isinstance(event, ConnectionTerminated):
+				self.transport.close()
+		self.transport.write(self.conn.data_to_send())
+
+	async def _respond(self, stream_id: int) -> None:
+		failed = self.behaviour.next(sleep=False)
+		if self.behaviour.latency:
+			await asyncio.sleep(self.behaviour.latency)
+
+		apns_id = [("apns-id", self.apns_ids.pop(stream_id))]
+		if failed:
+			body = json.dumps({"reason": "Unregistered", "timestamp": int(time.time())}).encode()
+			self.conn.send_headers(stream_id, [(":status", "410")] + apns_id)
+			self.conn.send_data(stream_id, body, end_stream=True)
+		else:
+			self.conn.send_headers(stream_id, [(":status", "200")] + apns_id, end_stream=True)
+		self.transport.write(self.conn.data_to_send())
+
+
+def make_tls_certificate(directory: str) -> Tuple[str, str]:
+	"""
+	Writes a self-signed certificate for 127.0.0.1 and its key to directory.
+
+	:return: (certificate path, key path)
+	"""
+	key = ec.generate_private_key(ec.SECP256R1())
+	name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "127.0.0.1")])
+	now = datetime.datetime.now(datetime.timezone.utc)
+	cert = (
+		x509.CertificateBuilder()
+		.subject_name(name)
+		.issuer_name(name)
+		.public_key(key.public_key())
+		.serial_number(x509.random_serial_number())
+		.not_valid_before(now - datetime.timedelta(days=1))
+		.not_valid_after(now + datetime.timedelta(days=1))
+		.add_extension(
+			x509.SubjectAlternativeName([x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]),
+			critical=False,
+		)
+		.add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+		.sign(key, hashes.SHA256())
+	)
+	cert_path = os.path.join(directory, "server.pem")
+	key_path = os.path.join(directory, "server.key")
+	with open(cert_path, "wb") as f:
+		f.write(cert.public_bytes(serialization.Encoding.PEM))
+	with open(key_path, "wb") as f:
+		f.write(key.private_bytes(
+			serialization.Encoding.PEM,
+			serialization.PrivateFormat.PKCS8,
+			serialization.NoEncryption(),
+		))
+	return cert_path, key_path
+
+
+class FakeAPNsServer:
+	"""HTTP/2 over TLS APNs stand-in, running its own event loop in a thread."""
+
+	def __init__(self, cert_path: str, key_path: str, behaviour: Optional[Behaviour] = None) -> None:
+		self.behaviour = behaviour or Behaviour()
+		self._ssl = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+		self._ssl.load_cert_chain(cert_path, key_path)
+		self._ssl.set_alpn_protocols(["h2"])
+		self._loop = asyncio.new_event_loop()
+		self._server = self._loop.run_until_complete(self._loop.create_server(
+			lambda: _APNsProtocol(self.behaviour), "127.0.0.1", 0, ssl=self._ssl
+		))
+		self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+
+	@property
+	def port(self) -> int:
+		return self._server.sockets[0].getsockname()[1]
+
+	def start(self) -> "FakeAPNsServer":
+		self._thread.start()
+		return self
+
+	def stop(self) -> None:
+		self._loop.call_soon_threadsafe(self._server.close)
+		self._loop.call_soon_threadsafe(self._loop.stop)
@@ -1,13 +1,6 @@
 import sys
 import warnings
 
-try:
-    # Python 3.8+
-    import importlib.metadata as importlib_metadata
-except ImportError:
-    # <Python 3.7 and lower
-    import importlib_metadata
-
 if sys.version_info < (3, 10):
     warnings.warn(
         "Python 3.9 and earlier support is deprecated and will be removed in a future version. "
@@ -16,4 +9,18 @@ if sys.version_info < (3, 10):
         stacklevel=2
     )
 
-__version__ = importlib_metadata.version("django-push-notifications")
+
+def __getattr__(name):
+    # reading the distribution metadata is slow, only do it when asked for
+    if name == "__version__":
+        try:
+            # Python 3.8+
+            import importlib.metadata as importlib_metadata
+        except ImportError:
+            # <Python 3.7 and lower
+            import importlib_metadata
+
+        global __version__
+        __version__ = importlib_metadata.version("django-push-notifications")
+        return __version__
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
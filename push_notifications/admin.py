@@ -1,12 +1,20 @@
+from typing import Any, List, Optional, Tuple, Type
+
 from django.apps import apps
-from django.contrib import admin, messages
-from django.utils.encoding import force_str
+from django.contrib import admin
+from django.shortcuts import get_object_or_404
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
 from django.utils.translation import gettext_lazy as _
-from django.http import HttpRequest
+from django.http import HttpRequest, HttpResponse, HttpResponseRedirect, JsonResponse
 from django.db.models import QuerySet
 
-from .exceptions import APNSServerError, GCMError, WebPushError
-from .models import APNSDevice, GCMDevice, WebPushDevice, WNSDevice
+from .changelist import EstimatedCountPaginator, KeysetChangeList, exact_device_search
+from .jobs import fail_stale_jobs, start_send_job
+from .models import (
+	APNSDevice, Application, GCMDevice, ScheduledPush, ScheduledPushBucket, SendJob,
+	WebPushDevice, WNSDevice
+)
 from .settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
 
 
@@ -18,102 +26,108 @@ class DeviceAdmin(admin.ModelAdmin):
 	list_filter = ("active",)
 	actions = ("send_message", "send_bulk_message", "enable", "disable")
 	raw_id_fields = ("user",)
+	list_select_related = ("user",)
 
 	if hasattr(User, "USERNAME_FIELD"):
 		search_fields = ("name", "device_id", "user__%s" % (User.USERNAME_FIELD))
 	else:
 		search_fields = ("name", "device_id", "")
 
-	def send_messages(self, request: HttpRequest, queryset: QuerySet, bulk: bool = False) -> None:
+	# With ADMIN_LARGE_TABLES, the changelist avoids the queries that scan the
+	# whole table: counts are estimated, searches are exact matches on indexed
+	# fields and pages follow the primary key instead of an OFFSET.
+
+	@property
+	def show_full_result_count(self) -> bool:
+		return not SETTINGS["ADMIN_LARGE_TABLES"]
+
+	@property
+	def change_list_template(self) -> Optional[str]:
+		if SETTINGS["ADMIN_LARGE_TABLES"]:
+			return "admin/push_notifications/change_list.html"
+		return None
+
+	def get_paginator(
+		self, request: HttpRequest, queryset: QuerySet, *args: Any, **kwargs: Any
+	) -> Any:
+		if SETTINGS["ADMIN_LARGE_TABLES"]:
+			return EstimatedCountPaginator(queryset, *args, **kwargs)
+		return super().get_paginator(request, queryset, *args, **kwargs)
+
+	def get_changelist(self, request: HttpRequest, **kwargs: Any) -> Type[Any]:
+		if SETTINGS["ADMIN_LARGE_TABLES"]:
+			return KeysetChangeList
+		return super().get_changelist(request, **kwargs)
+
+	def get_ordering(self, request: HttpRequest) -> Tuple[str, ...]:
+		if SETTINGS["ADMIN_LARGE_TABLES"]:
+			return ("-pk",)
+		return super().get_ordering(request)
+
+	def get_sortable_by(self, request: HttpRequest) -> Tuple[str, ...]:
+		if SETTINGS["ADMIN_LARGE_TABLES"]:
+			return ()
+		return super().get_sortable_by(request)
+
+	def get_search_results(
+		self, request: HttpRequest, queryset: QuerySet, search_term: str
+	) -> Any:
+		if SETTINGS["ADMIN_LARGE_TABLES"]:
+			return exact_device_search(queryset, search_term)
+		return super().get_search_results(request, queryset, search_term)
+
+	def start_send_job(
+		self, request: HttpRequest, queryset: QuerySet, bulk: bool
+	) -> HttpResponse:
 		"""
-		Provides error handling for DeviceAdmin send_message and send_bulk_message methods.
+		Sends the test message in a background job, and redirects to its
+		status page.
 		"""
-		ret = []
-		errors = []
-		r = ""
-
-		for device in queryset:
-			try:
-				if bulk:
-					r = queryset.send_message("Test bulk notification")
-				else:
-					r = device.send_message("Test single notification")
-				if r:
-					ret.append(r)
-			except GCMError as e:
-				errors.append(str(e))
-			except APNSServerError as e:
-				errors.append(e.status)
-			except WebPushError as e:
-				errors.append(force_str(e))
-
-			if bulk:
-				break
-
-		# Because NotRegistered and InvalidRegistration do not throw GCMError
-		# catch them here to display error msg.
-		if not bulk:
-			for r in ret:
-				if "error" in r["results"][0]:
-					errors.append(r["results"][0]["error"])
-		else:
-			if "results" in ret[0][0]:
-				try:
-					errors = [r["error"] for r in ret[0][0]["results"] if "error" in r]
-				except TypeError:
-					for entry in ret[0][0]:
-						errors = errors + [r["error"] for r in entry["results"] if "error" in r]
-				except IndexError:
-					pass
-			else:
-				# different format, e.g.:
-				# [{'some_token1': 'Success',
-				#  'some_token2': 'BadDeviceToken'}]
-				for key, value in ret[0][0].items():
-					if value.lower() != "success":
-						errors.append(value)
-		if errors:
-			self.message_user(
-				request, _("Some messages could not be processed: %r" % (", ".join(errors))),
-				level=messages.ERROR
-			)
-		if ret:
-			if bulk:
-				# When the queryset exceeds the max_recipients value, the
-				# send_message method returns a list of dicts, one per chunk
-				if "results" in ret[0][0]:
-					try:
-						success = ret[0][0]["success"]
-					except TypeError:
-						success = 0
-						for entry in ret[0][0]:
-							success = success + entry["success"]
-					if success == 0:
-						return
-				else:
-					# different format, e.g.:
-					# [{'some_token1': 'Success',
-					#  'some_token2': 'BadDeviceToken'}]
-					success = []
-					for key, value in ret[0][0].items():
-						if value.lower() == "success":
-							success.append(key)
-
-			elif len(errors) == len(ret):
-				return
-			if errors:
-				msg = _("Some messages were sent: %s" % (ret))
-			else:
-				msg = _("All messages were sent: %s" % (ret))
-			self.message_user(request, msg)
-
-	def send_message(self, request: HttpRequest, queryset: QuerySet) -> None:
-		self.send_messages(request, queryset)
+		message = "Test bulk notification" if bulk else "Test single notification"
+		job = start_send_job(queryset, message, bulk)
+		opts = self.model._meta
+		return HttpResponseRedirect(reverse(
+			"admin:%s_%s_send_job" % (opts.app_label, opts.model_name), args=(job.pk,),
+			current_app=self.admin_site.name,
+		))
+
+	def send_job_view(self, request: HttpRequest, job_id: int) -> HttpResponse:
+		fail_stale_jobs()
+		job = get_object_or_404(SendJob, pk=job_id, device_model=self.model._meta.label)
+		if request.GET.get("format") == "json":
+			return JsonResponse({
+				"status": job.status,
+				"total": job.total,
+				"sent": job.sent,
+				"failed": job.failed,
+				"deactivated": job.deactivated,
+				"errors": job.get_errors(),
+			})
+		context = dict(
+			self.admin_site.each_context(request),
+			opts=self.model._meta,
+			job=job,
+			title=_("Sending %(message)r") % {"message": job.message},
+		)
+		return TemplateResponse(request, "admin/push_notifications/send_job.html", context)
+
+	def get_urls(self) -> List[Any]:
+		opts = self.model._meta
+		return [
+			path(
+				"send-job/<int:job_id>/",
+				self.admin_site.admin_view(self.send_job_view),
+				name="%s_%s_send_job" % (opts.app_label, opts.model_name),
+			),
+		] + super().get_urls()
+
+	def send_message(self, request: HttpRequest, queryset: QuerySet) -> HttpResponse:
+		return self.start_send_job(request, queryset, False)
 
 	send_message.short_description = _("Send test message")
 
-	def send_bulk_message(self, request: HttpRequest, queryset: QuerySet) -> None:
-		self.send_messages(request, queryset, True)
+	def send_bulk_message(self, request: HttpRequest, queryset: QuerySet) -> HttpResponse:
+		return self.start_send_job(request, queryset, True)
 
 	send_bulk_message.short_description = _("Send test message in bulk")
 
@@ -134,37 +148,6 @@ class GCMDeviceAdmin(DeviceAdmin):
 	)
 	list_filter = ("active", "cloud_message_type")
 
-	def send_messages(self, request: HttpRequest, queryset: QuerySet, bulk: bool = False) -> None:
-		"""
-		Provides error handling for DeviceAdmin send_message and send_bulk_message methods.
-		"""
-		results = []
-		errors = []
-
-		if bulk:
-			results.append(queryset.send_message("Test bulk notification"))
-		else:
-			for device in queryset:
-				result = device.send_message("Test single notification")
-				if result:
-					results.append(result)
-
-		for batch in results:
-			for response in batch.responses:
-				if response.exception:
-					errors.append(repr(response.exception))
-
-		if errors:
-			self.message_user(
-				request, _("Some messages could not be processed: %s") % (", ".join(errors)),
-				level=messages.ERROR
-			)
-		else:
-			self.message_user(
-				request, _("All messages were sent."),
-				level=messages.SUCCESS
-			)
-
 
 class WebPushDeviceAdmin(DeviceAdmin):
 	list_display = ("__str__", "browser", "user", "active", "date_created")
@@ -176,7 +159,38 @@ class WebPushDeviceAdmin(DeviceAdmin):
 		search_fields = ("name", "registration_id", "")
 
 
+class ApplicationAdmin(admin.ModelAdmin):
+	list_display = ("application_id", "platform", "active", "date_modified")
+	list_filter = ("platform", "active")
+	search_fields = ("application_id",)
+
+
+class ScheduledPushBucketInline(admin.TabularInline):
+	model = ScheduledPushBucket
+	fields = ("utc_offset", "release_at", "slices", "next_slice")
+	readonly_fields = fields
+	extra = 0
+	can_delete = False
+
+
+class ScheduledPushAdmin(admin.ModelAdmin):
+	list_display = ("__str__", "application_id", "local_time", "status", "recipients")
+	list_filter = ("platform", "status")
+	readonly_fields = ("status", "recipients")
+	inlines = (ScheduledPushBucketInline,)
+	actions = ("cancel",)
+
+	def cancel(self, request: HttpRequest, queryset: QuerySet) -> None:
+		queryset.exclude(status=ScheduledPush.DONE).update(status=ScheduledPush.CANCELLED)
+
+	cancel.short_description = _("Cancel selected scheduled pushes")
+
+
 admin.site.register(APNSDevice, DeviceAdmin)
 admin.site.register(GCMDevice, GCMDeviceAdmin)
 admin.site.register(WNSDevice, DeviceAdmin)
 admin.site.register(WebPushDevice, WebPushDeviceAdmin)
+admin.site.register(ScheduledPush, ScheduledPushAdmin)
+
+if SETTINGS["CONFIG"] == "push_notifications.conf.AppModelConfig":
+	admin.site.register(Application, ApplicationAdmin)
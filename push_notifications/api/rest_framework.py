@@ -142,6 +142,22 @@ class WebPushDeviceSerializer(UniqueRegistrationSerializerMixin, ModelSerializer
 			"application_id",
 		)
 
+	def validate(self, attrs: Dict[str, Any]) -> Dict[str, Any]:
+		attrs = super().validate(attrs)
+		try:
+			from push_notifications.webpush import decode_subscriber_keys
+		except ImportError:
+			# the keys are checked when the WP extra (pywebpush) is installed
+			return attrs
+
+		p256dh = attrs.get("p256dh", getattr(self.instance, "p256dh", None))
+		auth = attrs.get("auth", getattr(self.instance, "auth", None))
+		try:
+			decode_subscriber_keys(p256dh, auth)
+		except ValueError as e:
+			raise ValidationError(str(e))
+		return attrs
+
 
 # Permissions
 class IsOwner(permissions.BasePermission):
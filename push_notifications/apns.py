@@ -4,18 +4,63 @@ Documentation is available on the iOS Developer Library:
 https://developer.apple.com/library/content/documentation/NetworkingInternet/Conceptual/RemoteNotificationsPG/APNSOverview.html
 """
 
+import json
+import threading
 import time
-from typing import Optional, Dict, Any, List, Union
+from contextlib import nullcontext
+from typing import Optional, Dict, Any, List, Tuple, Union
 from apns2 import client as apns2_client
 from apns2 import credentials as apns2_credentials
 from apns2 import errors as apns2_errors
 from apns2 import payload as apns2_payload
 
-from . import models
+from . import metrics, models, payload
 from .conf import get_manager
 from .exceptions import APNSUnsupportedPriority, APNSServerError
 
 
+class APNSSession:
+	"""
+	One apns2 client per application, connected by the first send of the
+	application and reused by the following ones, so the chunks of a bulk
+	send share its connection. A client sends one batch at a time.
+
+		with APNSSession() as session:
+			for chunk in chunks:
+				apns_send_bulk_message(chunk, "Hello", application_id=app_id, session=session)
+	"""
+
+	def __init__(self) -> None:
+		self.clients: Dict[Optional[str], apns2_client.APNsClient] = {}
+		self.locks: Dict[Optional[str], threading.Lock] = {}
+		self.lock = threading.Lock()
+
+	def __enter__(self) -> "APNSSession":
+		return self
+
+	def __exit__(self, *exc_info: Any) -> None:
+		self.close()
+
+	def close(self) -> None:
+		self.clients.clear()
+
+	def client(
+		self,
+		creds: Optional[apns2_credentials.Credentials] = None,
+		application_id: Optional[str] = None,
+	) -> Tuple[apns2_client.APNsClient, threading.Lock]:
+		"""The client of the application, and the lock to hold while using it."""
+		with self.lock:
+			lock = self.locks.setdefault(application_id, threading.Lock())
+		with lock:
+			client = self.clients.get(application_id)
+			if client is None:
+				client = self.clients[application_id] = _apns_create_socket(
+					creds=creds, application_id=application_id
+				)
+		return client, lock
+
+
 def _apns_create_socket(creds: Optional[apns2_credentials.Credentials] = None, application_id: Optional[str] = None) -> apns2_client.APNsClient:
 	if creds is None:
 		if not get_manager().has_auth_token_creds(application_id):
@@ -76,10 +121,9 @@ def _apns_send(
 	batch: bool = False,
 	application_id: Optional[str] = None,
 	creds: Optional[apns2_credentials.Credentials] = None,
+	session: Optional[APNSSession] = None,
 	**kwargs: Any
 ) -> Optional[Dict[str, str]]:
-	client = _apns_create_socket(creds=creds, application_id=application_id)
-
 	notification_kwargs: Dict[str, Any] = {}
 
 	# if expiration isn"t specified use 1 month from now
@@ -96,22 +140,53 @@ def _apns_send(
 
 	notification_kwargs["collapse_id"] = kwargs.pop("collapse_id", None)
 
+	# the payload is the same for every device (except a callable badge),
+	# check it once before connecting
+	size_kwargs = dict(kwargs, badge=0) if callable(kwargs.get("badge")) else kwargs
+	alert = payload.fit_text(
+		"APNS", alert, lambda alert: _payload_size(_apns_prepare("", alert, **size_kwargs))
+	)
+
+	with metrics.span("connect", platform="APNS"):
+		if session is None:
+			client = _apns_create_socket(creds=creds, application_id=application_id)
+			lock = nullcontext()
+		else:
+			client, lock = session.client(creds=creds, application_id=application_id)
+
 	if batch:
-		data = [apns2_client.Notification(
-			token=rid, payload=_apns_prepare(rid, alert, **kwargs)) for rid in registration_id]
+		with metrics.span("build_payload", platform="APNS"):
+			data = [apns2_client.Notification(
+				token=rid, payload=_apns_prepare(rid, alert, **kwargs)) for rid in registration_id]
+		if metrics.enabled():
+			for notification in data:
+				_observe_payload_size(notification.payload)
 		# returns a dictionary mapping each token to its result. That
 		# result is either "Success" or the reason for the failure.
-		return client.send_notification_batch(
-			data, get_manager().get_apns_topic(application_id=application_id),
+		with metrics.timed("batch", "batch_latency", platform="APNS"), lock:
+			return client.send_notification_batch(
+				data, get_manager().get_apns_topic(application_id=application_id),
+				**notification_kwargs
+			)
+
+	with metrics.span("build_payload", platform="APNS"):
+		data = _apns_prepare(registration_id, alert, **kwargs)
+	if metrics.enabled():
+		_observe_payload_size(data)
+	with metrics.timed("request", "request_latency", platform="APNS"), lock:
+		client.send_notification(
+			registration_id, data,
+			get_manager().get_apns_topic(application_id=application_id),
 			**notification_kwargs
 		)
 
-	data = _apns_prepare(registration_id, alert, **kwargs)
-	client.send_notification(
-		registration_id, data,
-		get_manager().get_apns_topic(application_id=application_id),
-		**notification_kwargs
-	)
+
+def _payload_size(payload: apns2_payload.Payload) -> int:
+	return len(json.dumps(payload.dict(), ensure_ascii=False, separators=(",", ":")).encode())
+
+
+def _observe_payload_size(payload: apns2_payload.Payload) -> None:
+	metrics.observe("payload_bytes", _payload_size(payload), platform="APNS")
 
 
 def apns_send_message(
@@ -137,9 +212,15 @@ def apns_send_message(
 			registration_id, alert, application_id=application_id,
 			creds=creds, **kwargs
 		)
+		metrics.increment("sent", platform="APNS")
 	except apns2_errors.APNsException as apns2_exception:
+		metrics.increment(
+			"failed", platform="APNS", reason=apns2_exception.__class__.__name__
+		)
 		if isinstance(apns2_exception, apns2_errors.Unregistered):
-			models.APNSDevice.objects.filter(registration_id=registration_id).update(active=False)
+			with metrics.span("deactivate", platform="APNS"):
+				models.APNSDevice.objects.filter(registration_id=registration_id).update(active=False)
+			metrics.increment("deactivated", platform="APNS")
 
 		raise APNSServerError(status=apns2_exception.__class__.__name__)
 
@@ -149,6 +230,8 @@ def apns_send_bulk_message(
 	alert: Optional[str] = None,
 	application_id: Optional[str] = None,
 	creds: Optional[apns2_credentials.Credentials] = None,
+	session: Optional[APNSSession] = None,
+	deactivate: bool = True,
 	**kwargs: Any
 ) -> Optional[Dict[str, str]]:
 	"""
@@ -158,12 +241,39 @@ def apns_send_bulk_message(
 	Note that if set alert should always be a string. If it is not set,
 	it won"t be included in the notification. You will need to pass None
 	to this for silent notifications.
+
+	:param session: An APNSSession whose client of the application is used,
+		instead of connecting for this call only.
+	:param deactivate: If False, the unregistered devices are not
+		deactivated, see deactivate_devices().
 	"""
 
 	results = _apns_send(
 		registration_ids, alert, batch=True, application_id=application_id,
-		creds=creds, **kwargs
+		creds=creds, session=session, **kwargs
 	)
-	inactive_tokens = [token for token, result in results.items() if result == "Unregistered"]
-	models.APNSDevice.objects.filter(registration_id__in=inactive_tokens).update(active=False)
+	if metrics.enabled():
+		for result in results.values():
+			if result == "Success":
+				metrics.increment("sent", platform="APNS")
+			else:
+				# Unregistered comes back as a (reason, timestamp) tuple
+				reason = result[0] if isinstance(result, tuple) else result
+				metrics.increment("failed", platform="APNS", reason=str(reason))
+	if deactivate:
+		deactivate_devices(results)
 	return results
+
+
+def deactivate_devices(results: Dict[str, Any]) -> int:
+	"""
+	Deactivates the unregistered devices in the results of
+	apns_send_bulk_message().
+
+	:return: The number of registration ids deactivated.
+	"""
+	inactive_tokens = [token for token, result in results.items() if result == "Unregistered"]
+	with metrics.span("deactivate", platform="APNS"):
+		models.APNSDevice.objects.filter(registration_id__in=inactive_tokens).update(active=False)
+	metrics.increment("deactivated", len(inactive_tokens), platform="APNS")
+	return len(inactive_tokens)
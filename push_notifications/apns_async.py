@@ -1,15 +1,25 @@
 import asyncio
+import json
+import threading
 import time
 
-from dataclasses import asdict, dataclass
+from dataclasses import asdict, dataclass, replace
 from typing import Awaitable, Callable, Dict, Optional, Union, Any, Tuple, List
 
 from aioapns import APNs, ConnectionError, NotificationRequest
-from aioapns.common import NotificationResult
+from aioapns.common import APNS_RESPONSE_CODE, NotificationResult
 
-from . import models
+from . import metrics, models, payload
+from .concurrency import AsyncLimiterSlot, get_limiter
 from .conf import get_manager
 from .exceptions import APNSServerError, APNSError
+from .transports import THROTTLED, UNREGISTERED, Transport, get_transport
+
+# TooManyRequests / ServiceUnavailable / Shutdown
+APNS_THROTTLE_STATUSES = ("429", "503")
+
+# the results for which a device is deactivated
+APNS_INACTIVE_RESULTS = ("Unregistered", "BadDeviceToken", "DeviceTokenNotForTopic")
 
 ErrFunc = Optional[Callable[[NotificationRequest, NotificationResult], Awaitable[None]]]
 """function to proces errors from aioapns send_message"""
@@ -172,15 +182,34 @@ def _create_notification_request_from_args(
 	return request
 
 
+def _fit_alert(
+	alert: Union[str, Alert, None], size_of: Callable[[Union[str, Alert, None]], int]
+) -> Union[str, Alert, None]:
+	"""
+	Checks the size of the payload carrying alert, and truncates the alert
+	text or the body of an Alert if needed and enabled.
+	"""
+	if isinstance(alert, Alert) and isinstance(alert.body, str):
+		body = payload.fit_text(
+			"APNS", alert.body, lambda body: size_of(replace(alert, body=body))
+		)
+		return alert if body == alert.body else replace(alert, body=body)
+	if isinstance(alert, str):
+		return payload.fit_text("APNS", alert, size_of)
+	payload.check_size("APNS", size_of(alert))
+	return alert
+
+
 def _create_client(
 	creds: Optional[Credentials] = None,
 	application_id: Optional[str] = None,
 	topic: Optional[str] = None,
 	err_func: ErrFunc = None,
 ) -> APNs:
-	use_sandbox = get_manager().get_apns_use_sandbox(application_id)
+	manager = get_manager()
+	use_sandbox = manager.get_apns_use_sandbox(application_id)
 	if topic is None:
-		topic = get_manager().get_apns_topic(application_id)
+		topic = manager.get_apns_topic(application_id)
 	if creds is None:
 		creds = _get_credentials(application_id)
 
@@ -201,15 +230,16 @@ def _create_client(
 
 
 def _get_credentials(application_id: Optional[str] = None) -> Credentials:
-	if not get_manager().has_auth_token_creds(application_id):
+	manager = get_manager()
+	if not manager.has_auth_token_creds(application_id):
 		# TLS certificate authentication
-		cert = get_manager().get_apns_certificate(application_id)
+		cert = manager.get_apns_certificate(application_id)
 		return CertificateCredentials(
 			client_cert=cert,
 		)
 	else:
 		# Token authentication
-		keyPath, keyId, teamId = get_manager().get_apns_auth_creds(application_id)
+		keyPath, keyId, teamId = manager.get_apns_auth_creds(application_id)
 		# No use getting a lifetime because this credential is
 		# ephemeral, but if you're looking at this to see how to
 		# create a credential, you could also pass the lifetime and
@@ -218,6 +248,63 @@ def _get_credentials(application_id: Optional[str] = None) -> Credentials:
 		return TokenCredentials(key=keyPath, key_id=keyId, team_id=teamId)
 
 
+class APNSSession:
+	"""
+	An event loop, with one APNs client per application, running in a thread
+	of its own, so the chunks of a bulk send reuse the connections of their
+	application. apns_send_bulk_message(session=...) can be called from any
+	thread.
+
+		with APNSSession() as session:
+			for chunk in chunks:
+				apns_send_bulk_message(chunk, "Hello", application_id=app_id, session=session)
+
+	The client of an application is created by its first send, with the
+	credentials, topic and err_func of that send.
+	"""
+
+	def __init__(self) -> None:
+		self.loop = asyncio.new_event_loop()
+		# only used from the event loop
+		self.clients: Dict[Optional[str], APNs] = {}
+		self.thread = threading.Thread(
+			target=self.loop.run_forever, name="push-notifications-apns", daemon=True
+		)
+		self.thread.start()
+
+	def __enter__(self) -> "APNSSession":
+		return self
+
+	def __exit__(self, *exc_info: Any) -> None:
+		self.close()
+
+	def close(self) -> None:
+		# aioapns has no API to close a client: like with asyncio.run(), its
+		# connections are dropped with the event loop
+		self.loop.call_soon_threadsafe(self.loop.stop)
+		self.thread.join()
+		self.loop.close()
+		self.clients.clear()
+
+	def run(self, coroutine: Awaitable[Any]) -> Any:
+		"""Runs coroutine in the event loop of the session and returns its result."""
+		return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+	def client(
+		self,
+		creds: Optional[Credentials] = None,
+		application_id: Optional[str] = None,
+		topic: Optional[str] = None,
+		err_func: ErrFunc = None,
+	) -> APNs:
+		client = self.clients.get(application_id)
+		if client is None:
+			client = self.clients[application_id] = _create_client(
+				creds=creds, application_id=application_id, topic=topic, err_func=err_func
+			)
+		return client
+
+
 def apns_send_message(
 	registration_id: str,
 	alert: Union[str, Alert],
@@ -305,6 +392,8 @@ def apns_send_bulk_message(
 	mutable_content: Optional[bool] = False,
 	category: Optional[str] = None,
 	err_func: Optional[ErrFunc] = None,
+	session: Optional[APNSSession] = None,
+	deactivate: bool = True,
 ) -> Dict[str, str]:
 	"""
 	Sends an APNS notification to one or more registration_ids.
@@ -326,33 +415,40 @@ def apns_send_bulk_message(
 					 Notification Content Extension or UNNotificationCategory configuration.
 					 It allows the app to display custom actions with the notification.
 	:param content_available: If True the `content-available` flag will be set to 1, allowing the app to be woken up in the background
+	:param session: An APNSSession whose client of the application is used,
+		instead of connecting for this call only.
+	:param deactivate: If False, the devices rejected by APNs are not
+		deactivated, see deactivate_devices().
+	:raises APNSError: If a device failed. Its `results` attribute holds the
+		results of every device.
 	"""
 	try:
 		topic = get_manager().get_apns_topic(application_id)
-		results: Dict[str, str] = {}
-		inactive_tokens = []
-
-		responses = asyncio.run(
-			_send_bulk_request(
-				registration_ids=registration_ids,
-				alert=alert,
-				application_id=application_id,
-				creds=creds,
-				topic=topic,
-				badge=badge,
-				sound=sound,
-				content_available=content_available,
-				extra=extra,
-				expiration=expiration,
-				thread_id=thread_id,
-				loc_key=loc_key,
-				priority=priority,
-				collapse_id=collapse_id,
-				mutable_content=mutable_content,
-				category=category,
-				err_func=err_func,
+
+		with metrics.timed("batch", "batch_latency", platform="APNS"):
+			run = asyncio.run if session is None else session.run
+			responses = run(
+				_send_bulk_request(
+					registration_ids=registration_ids,
+					alert=alert,
+					application_id=application_id,
+					creds=creds,
+					topic=topic,
+					badge=badge,
+					sound=sound,
+					content_available=content_available,
+					extra=extra,
+					expiration=expiration,
+					thread_id=thread_id,
+					loc_key=loc_key,
+					priority=priority,
+					collapse_id=collapse_id,
+					mutable_content=mutable_content,
+					category=category,
+					err_func=err_func,
+					session=session,
+				)
 			)
-		)
 
 		results = {}
 		errors = []
@@ -362,21 +458,20 @@ def apns_send_bulk_message(
 			)
 			if not result.is_successful:
 				errors.append(result.description)
-				if result.description in [
-					"Unregistered",
-					"BadDeviceToken",
-					"DeviceTokenNotForTopic",
-				]:
-					inactive_tokens.append(registration_id)
-
-		if len(inactive_tokens) > 0:
-			models.APNSDevice.objects.filter(
-				registration_id__in=inactive_tokens
-			).update(active=False)
+
+		if metrics.enabled():
+			metrics.increment("sent", len(results) - len(errors), platform="APNS")
+			for error in errors:
+				metrics.increment("failed", platform="APNS", reason=error)
+
+		if deactivate:
+			deactivate_devices(results)
 
 		if len(errors) > 0:
 			msg = "One or more errors failed with errors: {}".format(", ".join(errors))
-			raise APNSError(msg)
+			error = APNSError(msg)
+			error.results = results
+			raise error
 
 		return results
 
@@ -384,6 +479,26 @@ def apns_send_bulk_message(
 		raise APNSServerError(status=e.__class__.__name__)
 
 
+def deactivate_devices(results: Dict[str, str]) -> int:
+	"""
+	Deactivates the devices APNs rejected in the results of
+	apns_send_bulk_message().
+
+	:return: The number of registration ids deactivated.
+	"""
+	inactive_tokens = [
+		registration_id for registration_id, result in results.items()
+		if result in APNS_INACTIVE_RESULTS
+	]
+	if inactive_tokens:
+		with metrics.span("deactivate", platform="APNS"):
+			models.APNSDevice.objects.filter(
+				registration_id__in=inactive_tokens
+			).update(active=False)
+		metrics.increment("deactivated", len(inactive_tokens), platform="APNS")
+	return len(inactive_tokens)
+
+
 async def _send_bulk_request(
 	registration_ids: list[str],
 	alert: Union[str, Alert],
@@ -402,11 +517,8 @@ async def _send_bulk_request(
 	mutable_content: Optional[bool] = False,
 	category: Optional[str] = None,
 	err_func: Optional[ErrFunc] = None,
+	session: Optional[APNSSession] = None,
 ) -> List[Tuple[str, NotificationResult]]:
-	client = _create_client(
-		creds=creds, application_id=application_id, topic=topic, err_func=err_func
-	)
-
 	aps_kwargs = {}
 	if mutable_content:
 		aps_kwargs["mutable-content"] = 1
@@ -415,8 +527,8 @@ async def _send_bulk_request(
 	if content_available:
 		aps_kwargs["content-available"] = 1
 
-	requests = [
-		_create_notification_request_from_args(
+	def build(registration_id: str, alert: Union[str, Alert]) -> NotificationRequest:
+		return _create_notification_request_from_args(
 			registration_id,
 			alert,
 			badge=badge,
@@ -429,19 +541,83 @@ async def _send_bulk_request(
 			collapse_id=collapse_id,
 			aps_kwargs=aps_kwargs,
 		)
-		for registration_id in registration_ids
-	]
 
-	send_requests = [_send_request(client, request) for request in requests]
+	# the payload is the same for every device, check it once before connecting
+	alert = _fit_alert(alert, lambda alert: payload.apns_size(build("", alert).message))
+
+	transport = get_transport(application_id)
+	client = None
+	if transport is None:
+		with metrics.span("connect", platform="APNS"):
+			create_client = _create_client if session is None else session.client
+			client = create_client(
+				creds=creds, application_id=application_id, topic=topic, err_func=err_func
+			)
+
+	with metrics.span("build_payload", platform="APNS"):
+		requests = [build(registration_id, alert) for registration_id in registration_ids]
+
+	if metrics.enabled():
+		for request in requests:
+			metrics.observe(
+				"payload_bytes",
+				len(json.dumps(request.message, separators=(",", ":")).encode()),
+				platform="APNS",
+			)
+
+	slot = AsyncLimiterSlot(get_limiter("APNS", application_id))
+	send_requests = [
+		_send_request(client, request, slot, transport, application_id)
+		for request in requests
+	]
 	return await asyncio.gather(*send_requests)
 
 
+async def _transport_send_notification(
+	transport: Transport, request: NotificationRequest, application_id: Optional[str]
+) -> NotificationResult:
+	outcome = await transport.deliver_async(
+		"APNS", application_id, request.device_token, request.message
+	)
+	if outcome == UNREGISTERED:
+		status, description = APNS_RESPONSE_CODE.GONE, "Unregistered"
+	elif outcome == THROTTLED:
+		status, description = APNS_RESPONSE_CODE.TOO_MANY_REQUESTS, "TooManyRequests"
+	else:
+		status, description = APNS_RESPONSE_CODE.SUCCESS, None
+	return NotificationResult(
+		notification_id=request.notification_id, status=status, description=description
+	)
+
+
 async def _send_request(
-	apns: APNs,
+	apns: Optional[APNs],
 	request: NotificationRequest,
+	slot: Optional[AsyncLimiterSlot] = None,
+	transport: Optional[Transport] = None,
+	application_id: Optional[str] = None,
 ) -> Tuple[str, NotificationResult]:
+	if slot is None:
+		slot = AsyncLimiterSlot(get_limiter("APNS", application_id))
 	try:
-		res = await asyncio.wait_for(apns.send_notification(request), timeout=1)
+		async with slot as limiter:
+			start = time.monotonic()
+			try:
+				with metrics.span("request", platform="APNS"):
+					if transport is None:
+						send = apns.send_notification(request)
+					else:
+						send = _transport_send_notification(transport, request, application_id)
+					res = await asyncio.wait_for(send, timeout=1)
+			except asyncio.TimeoutError:
+				limiter.record_timeout()
+				raise
+			latency = time.monotonic() - start
+			metrics.observe("request_latency", latency, platform="APNS")
+			if str(res.status) in APNS_THROTTLE_STATUSES:
+				limiter.record_throttle()
+			else:
+				limiter.record_success(latency)
 		return request.device_token, res
 
 	except asyncio.TimeoutError:
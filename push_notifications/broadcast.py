@@ -0,0 +1,148 @@
+"""
+Multi-process broadcasts, used by the push_broadcast command.
+
+A single process is bound by the GIL for building payloads, TLS and JSON.
+broadcast() splits a device queryset into primary key ranges and sends them
+from a pool of worker processes, each with its own database connection and
+provider clients. Workers send in batches through the bulk send_message() of
+the queryset and return a compact BroadcastSummary, merged at the end.
+
+A broadcast can also be split across machines: shard (index, total) only
+sends the index-th of `total` primary key ranges.
+"""
+
+import multiprocessing
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, List, NamedTuple, Optional, Tuple
+
+from django.apps import apps
+from django.db import connections
+from django.db.models import Max, Min, QuerySet
+
+from .jobs import JOB_BATCH_SIZE, MAX_JOB_ERRORS, _send_batch
+
+
+PkRange = Tuple[int, int]
+
+
+class BroadcastSummary(NamedTuple):
+	sent: int = 0
+	failed: int = 0
+	deactivated: List[Any] = []
+	errors: List[str] = []
+
+	def merge(self, other: "BroadcastSummary") -> "BroadcastSummary":
+		return BroadcastSummary(
+			self.sent + other.sent,
+			self.failed + other.failed,
+			self.deactivated + other.deactivated,
+			(self.errors + other.errors)[:MAX_JOB_ERRORS],
+		)
+
+
+def pk_ranges(
+	queryset: QuerySet, parts: int, shard: Optional[Tuple[int, int]] = None
+) -> List[PkRange]:
+	"""
+	Splits the primary keys of queryset into up to `parts` half-open ranges
+	[start, end) of equal width.
+
+	:param shard: (index, total): only split the index-th of `total` ranges.
+	"""
+	bounds = queryset.aggregate(start=Min("pk"), end=Max("pk"))
+	if bounds["start"] is None:
+		return []
+	start, end = bounds["start"], bounds["end"] + 1
+	if shard is not None:
+		index, total = shard
+		start, end = _split(start, end, total)[index]
+	return [(s, e) for s, e in _split(start, end, parts) if s < e]
+
+
+def _split(start: int, end: int, parts: int) -> List[PkRange]:
+	step, extra = divmod(end - start, parts)
+	ranges = []
+	for i in range(parts):
+		size = step + (1 if i < extra else 0)
+		ranges.append((start, start + size))
+		start += size
+	return ranges
+
+
+def send_range(
+	queryset: QuerySet, pk_range: PkRange, message: str, batch_size: int
+) -> BroadcastSummary:
+	"""Sends message to the active devices of queryset within pk_range."""
+	model = queryset.model
+	summary = BroadcastSummary()
+	devices = queryset.filter(pk__gte=pk_range[0], pk__lt=pk_range[1], active=True)
+	batches = devices.iter_batches(batch_size, fields=())
+	for batch in batches:
+		pks = [row.pk for row in batch]
+		sent, failed, errors = _send_batch(
+			model.objects.filter(pk__in=pks, active=True), message, True
+		)
+		deactivated = list(
+			model.objects.filter(pk__in=pks, active=False).values_list("pk", flat=True)
+		)
+		summary = summary.merge(BroadcastSummary(sent, failed, deactivated, errors))
+	return summary
+
+
+def _send_range_in_worker(
+	model_label: str, query: bytes, pk_range: PkRange, message: str, batch_size: int
+) -> BroadcastSummary:
+	queryset = apps.get_model(model_label).objects.all()
+	queryset.query = pickle.loads(query)
+	try:
+		return send_range(queryset, pk_range, message, batch_size)
+	finally:
+		connections.close_all()
+
+
+def _init_worker() -> None:
+	# spawned workers (macOS, Windows) start without Django
+	import django
+
+	if not apps.ready:
+		django.setup()
+
+
+def broadcast(
+	queryset: QuerySet,
+	message: str,
+	workers: int = 1,
+	shard: Optional[Tuple[int, int]] = None,
+	batch_size: int = JOB_BATCH_SIZE,
+) -> BroadcastSummary:
+	"""
+	Sends message to the active devices of queryset from `workers` processes,
+	one primary key range each.
+
+	:param shard: (index, total): only send to the index-th of `total` ranges,
+		to split a broadcast across machines.
+	"""
+	ranges = pk_ranges(queryset.filter(active=True), workers, shard)
+	summary = BroadcastSummary()
+	if workers <= 1 or len(ranges) <= 1:
+		for pk_range in ranges:
+			summary = summary.merge(send_range(queryset, pk_range, message, batch_size))
+		return summary
+
+	model_label = queryset.model._meta.label
+	query = pickle.dumps(queryset.query)
+	# the workers must not share the connections of this process
+	connections.close_all()
+	with ProcessPoolExecutor(
+		max_workers=len(ranges),
+		mp_context=multiprocessing.get_context(),
+		initializer=_init_worker,
+	) as executor:
+		futures = [
+			executor.submit(_send_range_in_worker, model_label, query, pk_range, message, batch_size)
+			for pk_range in ranges
+		]
+		for future in futures:
+			summary = summary.merge(future.result())
+	return summary
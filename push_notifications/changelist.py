@@ -0,0 +1,99 @@
+"""
+Admin changelist helpers for very large device tables, used by DeviceAdmin
+when PUSH_NOTIFICATIONS_SETTINGS["ADMIN_LARGE_TABLES"] is set.
+"""
+
+import re
+import uuid
+from typing import Optional, Tuple
+
+from django.contrib.admin.views.main import PAGE_VAR, ChangeList
+from django.core.exceptions import FieldDoesNotExist
+from django.core.paginator import Paginator
+from django.db import connections, models
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+
+from .fields import HexIntegerField, hex_re
+
+
+# Below this estimate, the exact count is cheap enough
+EXACT_COUNT_THRESHOLD = 100000
+
+_explain_rows_re = re.compile(r"rows=(\d+)")
+
+
+def estimate_count(queryset: QuerySet) -> Optional[int]:
+	"""
+	The number of rows of queryset as estimated by the PostgreSQL planner:
+	the table statistics for an unfiltered queryset, else the EXPLAIN plan.
+	None on other databases, or if the table was never analyzed.
+	"""
+	connection = connections[queryset.db]
+	if connection.vendor != "postgresql":
+		return None
+	with connection.cursor() as cursor:
+		if not queryset.query.where:
+			cursor.execute(
+				"SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+				[queryset.model._meta.db_table],
+			)
+			row = cursor.fetchone()
+			return row[0] if row and row[0] >= 0 else None
+		sql, params = queryset.order_by().query.sql_with_params()
+		cursor.execute("EXPLAIN " + sql, params)
+		match = _explain_rows_re.search(cursor.fetchone()[0])
+		return int(match.group(1)) if match else None
+
+
+class EstimatedCountPaginator(Paginator):
+	"""
+	Counts large results from the planner estimate instead of a COUNT(*),
+	which scans the whole table.
+	"""
+
+	@cached_property
+	def count(self) -> int:
+		estimate = estimate_count(self.object_list)
+		if estimate is None or estimate < EXACT_COUNT_THRESHOLD:
+			return self.object_list.count()
+		return estimate
+
+
+class KeysetChangeList(ChangeList):
+	"""
+	A changelist ordered by descending primary key, whose next page is the
+	rows below the last primary key shown (pk__lt), an index range scan at
+	any depth, unlike the OFFSET of page numbers.
+	"""
+
+	@property
+	def next_page_query_string(self) -> Optional[str]:
+		results = list(self.result_list)
+		if len(results) < self.list_per_page:
+			return None
+		pk_name = self.lookup_opts.pk.attname
+		return self.get_query_string({"%s__lt" % pk_name: results[-1].pk}, [PAGE_VAR])
+
+
+def exact_device_search(queryset: QuerySet, search_term: str) -> Tuple[QuerySet, bool]:
+	"""
+	Searches devices by exact registration id or device id, through their
+	indexes, instead of unanchored icontains searches.
+	"""
+	search_term = search_term.strip()
+	if not search_term:
+		return queryset, False
+	condition = models.Q(registration_id=search_term)
+	try:
+		field = queryset.model._meta.get_field("device_id")
+	except FieldDoesNotExist:
+		field = None
+	if isinstance(field, HexIntegerField) and hex_re.match(search_term):
+		condition |= models.Q(device_id=search_term)
+	elif isinstance(field, models.UUIDField):
+		try:
+			condition |= models.Q(device_id=uuid.UUID(search_term))
+		except ValueError:
+			pass
+	return queryset.filter(condition), False
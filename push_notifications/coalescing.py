@@ -0,0 +1,192 @@
+"""
+Coalescing of the notifications sent to the same recipient in a short window.
+
+Chatty workloads (chat messages, likes) send several notifications to the
+same device or user within seconds. coalesce() holds each notification for
+PUSH_NOTIFICATIONS_SETTINGS["COALESCE_WINDOW"] seconds, keyed by recipient and
+collapse key: notifications arriving in the meantime replace it, or are merged
+into it, and only one is sent when the window closes. The collapse key is also
+passed to the providers, as the APNs collapse_id and the FCM collapse_key, so a
+device that was offline only shows the latest notification.
+
+Notifications are held in memory, in the process that called coalesce(): they
+are lost if the process is killed before the window closes. Pending
+notifications are flushed when the interpreter exits. One thread per Coalescer
+sends them as their windows close, however many are held.
+"""
+
+import atexit
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, NamedTuple, Optional, Tuple
+
+from django.db import connections
+from django.db.models import QuerySet
+
+from . import metrics
+from .models import APNSDevice, GCMDevice, WebPushDevice, WNSDevice
+from .settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
+
+
+logger = logging.getLogger(__name__)
+
+# Merges the held message with a new one, e.g. into "3 new messages"
+MergeFunction = Callable[[Any, Any], Any]
+
+PLATFORMS = {APNSDevice: "APNS", GCMDevice: "FCM", WNSDevice: "WNS", WebPushDevice: "WP"}
+
+# The send_message() argument each provider collapses notifications on
+COLLAPSE_ARGUMENTS = {"APNS": "collapse_id", "FCM": "collapse_key"}
+
+
+def _platform(devices: Any) -> str:
+	model = devices.model if isinstance(devices, QuerySet) else type(devices)
+	return PLATFORMS[model._meta.concrete_model]
+
+
+class _Pending(NamedTuple):
+	devices: Any
+	message: Any
+	kwargs: Dict[str, Any]
+	deadline: float
+
+
+class Coalescer:
+	"""
+	Holds notifications for `window` seconds per (recipient, collapse key).
+
+	:param window: Seconds a notification is held before it is sent.
+	:param merge: Called with the held message and a new one, returns the
+		message to hold. By default the latest message wins.
+	"""
+
+	def __init__(self, window: float = 2.0, merge: Optional[MergeFunction] = None) -> None:
+		self.window = window
+		self.merge = merge
+		self._pending: Dict[Tuple[Hashable, str], _Pending] = {}
+		# (deadline, sequence, key) of the pending notifications, the earliest first
+		self._deadlines: List[Tuple[float, int, Tuple[Hashable, str]]] = []
+		self._sequence = itertools.count()
+		self._cond = threading.Condition()
+		self._thread: Optional[threading.Thread] = None
+
+	def add(
+		self,
+		devices: Any,
+		message: Any,
+		collapse_key: str,
+		recipient: Optional[Hashable] = None,
+		**kwargs: Any
+	) -> None:
+		"""
+		Holds a notification, or coalesces it with the one held for the same
+		recipient and collapse key.
+
+		:param devices: A Device, or a queryset of devices such as all the
+			devices of a user.
+		:param recipient: Identifies the recipient, e.g. the user id. Defaults to
+			the device; required for querysets.
+		:param kwargs: Passed to send_message(); those of the latest
+			notification are used.
+		"""
+		if recipient is None:
+			if isinstance(devices, QuerySet):
+				raise ValueError("recipient is required to coalesce notifications to a queryset")
+			recipient = (devices._meta.label, devices.pk)
+		key = (recipient, collapse_key)
+
+		with self._cond:
+			pending = self._pending.get(key)
+			if pending is None:
+				deadline = time.monotonic() + self.window
+				self._pending[key] = _Pending(devices, message, kwargs, deadline)
+				heapq.heappush(self._deadlines, (deadline, next(self._sequence), key))
+				if self._thread is None or not self._thread.is_alive():
+					# also after a fork, which does not inherit the thread
+					self._thread = threading.Thread(
+						target=self._run, name="push-notifications-coalescer", daemon=True
+					)
+					self._thread.start()
+				elif self._deadlines[0][2] == key:
+					# the flusher waits for a later deadline
+					self._cond.notify()
+				return
+			if self.merge is not None:
+				message = self.merge(pending.message, message)
+			self._pending[key] = pending._replace(devices=devices, message=message, kwargs=kwargs)
+		metrics.increment("coalesced", platform=_platform(devices))
+
+	def _run(self) -> None:
+		while True:
+			with self._cond:
+				while not self._deadlines or self._deadlines[0][0] > time.monotonic():
+					timeout = self._deadlines[0][0] - time.monotonic() if self._deadlines else None
+					self._cond.wait(timeout)
+				deadline, _, key = heapq.heappop(self._deadlines)
+			try:
+				self._flush_key(key, deadline)
+			finally:
+				# the connections of the flusher thread are not closed by Django
+				connections.close_all()
+
+	def _flush_key(self, key: Tuple[Hashable, str], deadline: Optional[float] = None) -> None:
+		with self._cond:
+			pending = self._pending.get(key)
+			# flush() may have sent the notification the deadline was for
+			if pending is None or deadline is not None and pending.deadline != deadline:
+				return
+			del self._pending[key]
+		self._send(pending, key[1])
+
+	def _send(self, pending: _Pending, collapse_key: str) -> None:
+		kwargs = dict(pending.kwargs)
+		argument = COLLAPSE_ARGUMENTS.get(_platform(pending.devices))
+		if argument:
+			kwargs.setdefault(argument, collapse_key)
+		try:
+			pending.devices.send_message(pending.message, **kwargs)
+		except Exception:
+			logger.exception("Error sending coalesced notification %r", collapse_key)
+
+	def flush(self) -> None:
+		"""Sends all held notifications now."""
+		with self._cond:
+			keys = list(self._pending)
+		for key in keys:
+			self._flush_key(key)
+
+	def __len__(self) -> int:
+		return len(self._pending)
+
+
+_coalescer: Optional[Coalescer] = None
+_coalescer_lock = threading.Lock()
+
+
+def get_coalescer() -> Coalescer:
+	"""The Coalescer used by coalesce(), created on first use."""
+	global _coalescer
+	if _coalescer is None:
+		with _coalescer_lock:
+			if _coalescer is None:
+				_coalescer = Coalescer(SETTINGS["COALESCE_WINDOW"])
+				atexit.register(_coalescer.flush)
+	return _coalescer
+
+
+def coalesce(
+	devices: Any,
+	message: Any,
+	collapse_key: str,
+	recipient: Optional[Hashable] = None,
+	**kwargs: Any
+) -> None:
+	"""
+	Sends a notification after COALESCE_WINDOW seconds, unless a newer one for
+	the same recipient and collapse key replaces it in the meantime.
+	See Coalescer.add().
+	"""
+	get_coalescer().add(devices, message, collapse_key, recipient, **kwargs)
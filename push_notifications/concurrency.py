@@ -0,0 +1,388 @@
+"""
+Adaptive (AIMD) concurrency control for the bulk send paths.
+
+Every (platform, application_id) pair gets an AdaptiveLimiter that bounds the
+number of requests in flight towards the provider. The limit grows additively
+while the provider answers quickly, and is cut multiplicatively when it
+throttles (429/503, WNS 406), times out or slows down noticeably. A
+`Retry-After` value pauses new requests until it has elapsed.
+
+Slowdowns are measured against a baseline latency per request shape (e.g.
+the size class of an FCM chunk, or the origin of a WebPush endpoint), as a
+single token and a 500 token request can't be compared. The baseline is the
+fastest recent latency: it follows slower samples back up over time, so one
+fast outlier does not make every later request look congested.
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import (
+	Any, Callable, Dict, Hashable, Iterable, Iterator, List, Mapping, Optional, Tuple
+)
+from urllib.parse import urlparse
+
+from . import metrics
+from .exceptions import NotificationError
+from .settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
+
+
+# Defaults per platform, can be overridden through
+# PUSH_NOTIFICATIONS_SETTINGS["CONCURRENCY"][<platform>].
+# APNs multiplexes many streams on a single HTTP/2 connection, FCM requests
+# are whole send_each() chunks, WNS and WebPush are one request per device.
+DEFAULT_CONCURRENCY = {
+	"APNS": {"INITIAL_LIMIT": 100, "MIN_LIMIT": 1, "MAX_LIMIT": 1000},
+	"FCM": {"INITIAL_LIMIT": 2, "MIN_LIMIT": 1, "MAX_LIMIT": 16},
+	"WNS": {"INITIAL_LIMIT": 8, "MIN_LIMIT": 1, "MAX_LIMIT": 64},
+	"WP": {"INITIAL_LIMIT": 8, "MIN_LIMIT": 1, "MAX_LIMIT": 64},
+}
+
+# HTTP status codes that signal provider back-pressure
+THROTTLE_STATUS_CODES = (429, 503)
+
+# Upper bound on the threads of fair_map(), whatever the number of tenants
+MAX_FAIR_WORKERS = 64
+
+
+def parse_retry_after(value: Optional[Any]) -> Optional[float]:
+	"""
+	Parses a Retry-After header value (delta-seconds or HTTP-date) into a
+	number of seconds to wait. Returns None if the value can't be parsed.
+	"""
+	if value is None or value == "":
+		return None
+	try:
+		return max(0.0, float(value))
+	except (TypeError, ValueError):
+		pass
+	try:
+		return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+	except (TypeError, ValueError, IndexError):
+		return None
+
+
+def size_class(size: int) -> int:
+	"""The latency key of a request of `size` items, one per power of two."""
+	return max(1, size).bit_length()
+
+
+def url_origin(url: str) -> str:
+	"""The latency key of a request to url, e.g. "https://fcm.googleapis.com"."""
+	parsed = urlparse(url)
+	return "{}://{}".format(parsed.scheme, parsed.netloc)
+
+
+class AdaptiveLimiter:
+	"""
+	Additive-increase / multiplicative-decrease limit on requests in flight.
+
+	:param initial_limit: The limit to start from.
+	:param min_limit: The limit never drops below this value.
+	:param max_limit: The limit never grows above this value.
+	:param backoff: Factor applied to the limit on back-pressure.
+	:param latency_tolerance: A request slower than the baseline latency of
+		its key times this factor is treated as congestion.
+	:param smoothing: Weight of the newest sample in the latency moving average.
+	:param baseline_decay: Weight of a slower sample in the baseline latency,
+		which otherwise follows the fastest sample.
+	:param platform: Tags the concurrency_limit / concurrency_latency gauges.
+	:param application_id: Tags the gauges as well, so each application of a
+		platform reports its own series.
+	"""
+
+	def __init__(
+		self,
+		initial_limit: int = 10,
+		min_limit: int = 1,
+		max_limit: int = 100,
+		backoff: float = 0.5,
+		latency_tolerance: float = 2.0,
+		smoothing: float = 0.2,
+		baseline_decay: float = 0.05,
+		platform: Optional[str] = None,
+		application_id: Optional[str] = None,
+	) -> None:
+		self.platform = platform
+		self.application_id = application_id
+		self.min_limit = max(1, min_limit)
+		self.max_limit = max(self.min_limit, max_limit)
+		self.backoff = backoff
+		self.latency_tolerance = latency_tolerance
+		self.smoothing = smoothing
+		self.baseline_decay = baseline_decay
+		self._limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+		self._in_flight = 0
+		self._latency: Optional[float] = None
+		# latency key: [moving average, baseline]
+		self._latencies: Dict[Hashable, List[float]] = {}
+		self._last_decrease = 0.0
+		self._blocked_until = 0.0
+		self._cond = threading.Condition()
+
+	@property
+	def limit(self) -> int:
+		"""The current number of requests allowed in flight."""
+		return int(self._limit)
+
+	@property
+	def in_flight(self) -> int:
+		return self._in_flight
+
+	@property
+	def latency(self) -> Optional[float]:
+		"""Moving average of the request latency, in seconds."""
+		return self._latency
+
+	def retry_delay(self) -> float:
+		"""Seconds left to wait because of a Retry-After response."""
+		return max(0.0, self._blocked_until - time.monotonic())
+
+	def try_acquire(self) -> bool:
+		with self._cond:
+			if self.retry_delay() > 0 or self._in_flight >= self.limit:
+				return False
+			self._in_flight += 1
+			return True
+
+	def acquire(self) -> None:
+		with self._cond:
+			while True:
+				delay = self.retry_delay()
+				if delay > 0:
+					self._cond.wait(delay)
+				elif self._in_flight < self.limit:
+					self._in_flight += 1
+					return
+				else:
+					self._cond.wait()
+
+	def release(self) -> None:
+		with self._cond:
+			self._in_flight -= 1
+			self._cond.notify_all()
+
+	@contextmanager
+	def slot(self) -> Iterator[None]:
+		self.acquire()
+		try:
+			yield
+		finally:
+			self.release()
+
+	def record_success(self, latency: float, key: Hashable = None) -> None:
+		"""
+		A request completed in `latency` seconds.
+
+		:param key: The shape of the request, see size_class() and url_origin():
+			its latency is only compared to that of the same key.
+		"""
+		with self._cond:
+			if self._latency is None:
+				self._latency = latency
+			else:
+				self._latency += self.smoothing * (latency - self._latency)
+			latencies = self._latencies.get(key)
+			if latencies is None:
+				latencies = self._latencies[key] = [latency, latency]
+			else:
+				latencies[0] += self.smoothing * (latency - latencies[0])
+				if latency < latencies[1]:
+					latencies[1] = latency
+				else:
+					latencies[1] += self.baseline_decay * (latency - latencies[1])
+
+			if latencies[0] > latencies[1] * self.latency_tolerance:
+				self._decrease()
+			else:
+				# grows by about one per round trip worth of successful requests
+				self._limit = min(float(self.max_limit), self._limit + 1.0 / self._limit)
+			self._cond.notify_all()
+		self._report()
+
+	def record_throttle(self, retry_after: Optional[float] = None) -> None:
+		"""The provider pushed back, optionally with a Retry-After delay in seconds."""
+		with self._cond:
+			if retry_after:
+				self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+			self._decrease()
+		self._report()
+
+	def record_timeout(self) -> None:
+		with self._cond:
+			self._decrease()
+		self._report()
+
+	def _report(self) -> None:
+		if self.platform and metrics.enabled():
+			tags = {"platform": self.platform, "application_id": self.application_id or "default"}
+			metrics.gauge("concurrency_limit", self.limit, **tags)
+			if self._latency is not None:
+				metrics.gauge("concurrency_latency", self._latency, **tags)
+
+	def _decrease(self) -> None:
+		# a burst of failures from the same window only counts once
+		now = time.monotonic()
+		if now - self._last_decrease < (self._latency or 0.0):
+			return
+		self._last_decrease = now
+		self._limit = max(float(self.min_limit), self._limit * self.backoff)
+
+	def stats(self) -> Dict[str, Any]:
+		return {
+			"limit": self.limit,
+			"in_flight": self.in_flight,
+			"latency": self.latency,
+		}
+
+
+class AsyncLimiterSlot:
+	"""
+	Acquires an AdaptiveLimiter slot from a coroutine without blocking the
+	event loop. Create one per event loop (e.g. per asyncio.run()).
+	"""
+
+	def __init__(self, limiter: AdaptiveLimiter) -> None:
+		self.limiter = limiter
+		self._cond = asyncio.Condition()
+
+	async def __aenter__(self) -> AdaptiveLimiter:
+		async with self._cond:
+			while not self.limiter.try_acquire():
+				delay = self.limiter.retry_delay()
+				try:
+					# slots can also be freed by other threads, so poll as well
+					await asyncio.wait_for(self._cond.wait(), timeout=delay or 0.1)
+				except asyncio.TimeoutError:
+					pass
+		return self.limiter
+
+	async def __aexit__(self, *exc_info: Any) -> None:
+		self.limiter.release()
+		async with self._cond:
+			self._cond.notify_all()
+
+
+_limiters: Dict[Tuple[str, Optional[str]], AdaptiveLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(platform: str, application_id: Optional[str] = None) -> AdaptiveLimiter:
+	"""
+	Returns the shared limiter for the platform ("APNS", "FCM", "WNS" or "WP")
+	and application_id, so that the limit learned by one bulk send carries
+	over to the next one.
+	"""
+	key = (platform, application_id)
+	limiter = _limiters.get(key)
+	if limiter is None:
+		with _limiters_lock:
+			limiter = _limiters.get(key)
+			if limiter is None:
+				conf = dict(DEFAULT_CONCURRENCY[platform])
+				conf.update(SETTINGS.get("CONCURRENCY", {}).get(platform, {}))
+				limiter = AdaptiveLimiter(
+					initial_limit=conf["INITIAL_LIMIT"],
+					min_limit=conf["MIN_LIMIT"],
+					max_limit=conf["MAX_LIMIT"],
+					platform=platform,
+					application_id=application_id,
+				)
+				_limiters[key] = limiter
+	return limiter
+
+
+def get_limiter_stats() -> Dict[str, Dict[str, Any]]:
+	"""
+	Returns the current limit, in-flight count and latency of every limiter,
+	keyed by "<platform>:<application_id>".
+	"""
+	return {
+		"{}:{}".format(platform, application_id or ""): limiter.stats()
+		for (platform, application_id), limiter in list(_limiters.items())
+	}
+
+
+def bulk_map(
+	limiter: AdaptiveLimiter, fn: Callable[[Any], Any], items: Iterable[Any]
+) -> List[Any]:
+	"""
+	Calls fn for every item from a thread pool sized to the limiter's maximum,
+	and returns the results in order. fn is expected to hold a limiter slot
+	around its provider request, so the limiter decides the real concurrency.
+
+	Every call completes before the first NotificationError is raised; its
+	`results` attribute holds the results of the other items, in order.
+	"""
+	items = list(items)
+	if len(items) <= 1:
+		return [fn(item) for item in items]
+	with ThreadPoolExecutor(max_workers=min(limiter.max_limit, len(items))) as executor:
+		futures = [executor.submit(fn, item) for item in items]
+	results = []
+	error = None
+	for future in futures:
+		try:
+			results.append(future.result())
+		except NotificationError as e:
+			error = error or e
+	if error is not None:
+		error.results = results
+		raise error
+	return results
+
+
+def fair_order(
+	queues: Mapping[Hashable, List[Any]], weights: Optional[Mapping[Hashable, int]] = None
+) -> Iterator[Tuple[Hashable, Any]]:
+	"""
+	Yields (key, item) pairs from the queues in weighted round robin: every
+	round takes up to `weight` items (default 1) from each queue, so a small
+	queue is done within a few rounds, however long the others are.
+	"""
+	weights = weights or {}
+	positions = {key: 0 for key in queues}
+	while positions:
+		for key in list(positions):
+			position = positions[key]
+			items = queues[key][position:position + max(1, weights.get(key, 1))]
+			for item in items:
+				yield key, item
+			position += len(items)
+			if position >= len(queues[key]):
+				del positions[key]
+			else:
+				positions[key] = position
+
+
+def fair_map(
+	fn: Callable[[Hashable, Any], Any],
+	queues: Mapping[Hashable, List[Any]],
+	limiters: Mapping[Hashable, AdaptiveLimiter],
+	weights: Optional[Mapping[Hashable, int]] = None,
+) -> Dict[Hashable, List[Any]]:
+	"""
+	Calls fn(key, item) for the items of every queue, interleaved by
+	fair_order(), from a thread pool large enough for every key to reach the
+	maximum of its limiter. fn is expected to hold a slot of the key's limiter,
+	so each key (e.g. tenant) has its own concurrency budget and a large queue
+	does not delay the others.
+
+	:return: The results of each queue, in order.
+	"""
+	order = list(fair_order(queues, weights))
+	if len(order) <= 1:
+		results = [fn(key, item) for key, item in order]
+	else:
+		workers = min(
+			sum(limiters[key].max_limit for key in queues), len(order), MAX_FAIR_WORKERS
+		)
+		with ThreadPoolExecutor(max_workers=workers) as executor:
+			results = list(executor.map(lambda pair: fn(*pair), order))
+	grouped: Dict[Hashable, List[Any]] = {key: [] for key in queues}
+	for (key, _), result in zip(order, results):
+		grouped[key].append(result)
+	return grouped
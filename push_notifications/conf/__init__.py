@@ -19,5 +19,7 @@ def get_manager(reload: bool = False) -> ManagerType:
 	return manager
 
 
-# implementing get_manager as a function allows tests to reload settings
-get_manager()
+# implementing get_manager as a function allows tests to reload settings.
+# With LAZY_LOADING the manager is only created (and validated) on first use.
+if not SETTINGS.get("LAZY_LOADING"):
+	get_manager()
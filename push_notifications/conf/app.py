@@ -1,8 +1,14 @@
+import os
+import threading
+from types import MappingProxyType
+
 from django.core.exceptions import ImproperlyConfigured
 
 from push_notifications.settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
 from .base import BaseConfig, check_apns_certificate
-from typing import Dict, List, Any, Optional, Tuple
+from typing import (
+	Collection, Dict, List, Any, Mapping, NamedTuple, Optional, Set, Tuple, Union
+)
 
 
 SETTING_MISMATCH = "Application '{application_id}' ({platform}) does not support the setting '{setting}'."
@@ -34,6 +40,9 @@ REQUIRED_SETTINGS = [
 # of the application at this time.
 OPTIONAL_SETTINGS = ["APPLICATION_GROUP", "APPLICATION_SECRET"]
 
+# Settings any application may have, whatever its platform
+TRANSPORT_SETTINGS = ["TRANSPORT", "TRANSPORT_OPTIONS"]
+
 # Since we can have an auth key, combined with a auth key id and team id *or*
 # a certificate, we make these all optional, and then make sure we have one or
 # the other (group) of settings.
@@ -46,7 +55,9 @@ APNS_AUTH_CREDS_OPTIONAL = ["CERTIFICATE", "ENCRYPTION_ALGORITHM", "TOKEN_LIFETI
 APNS_OPTIONAL_SETTINGS = ["USE_SANDBOX", "USE_ALTERNATIVE_PORT", "TOPIC"]
 
 FCM_REQUIRED_SETTINGS = []
-FCM_OPTIONAL_SETTINGS = ["MAX_RECIPIENTS", "FIREBASE_APP"]
+FCM_OPTIONAL_SETTINGS = [
+	"MAX_RECIPIENTS", "FIREBASE_APP", "CREDENTIALS", "FIREBASE_OPTIONS"
+]
 
 WNS_REQUIRED_SETTINGS = ["PACKAGE_SECURITY_ID", "SECRET_KEY"]
 WNS_OPTIONAL_SETTINGS = ["WNS_ACCESS_URL"]
@@ -55,19 +66,127 @@ WP_REQUIRED_SETTINGS = ["PRIVATE_KEY", "CLAIMS"]
 WP_OPTIONAL_SETTINGS = ["ERROR_TIMEOUT", "POST_URL"]
 
 
+# Resolved settings of one application, compiled once by AppConfig. Each field
+# is read from the upper-cased setting of the same name.
+
+class APNSApplication(NamedTuple):
+	application_id: str
+	platform: str
+	certificate: Optional[Any]
+	auth_key_path: Optional[str]
+	auth_key_id: Optional[str]
+	team_id: Optional[str]
+	has_token_creds: bool
+	use_sandbox: bool
+	use_alternative_port: bool
+	topic: Optional[str]
+	transport: Optional[str]
+	transport_options: Mapping[str, Any]
+
+
+class FCMApplication(NamedTuple):
+	application_id: str
+	platform: str
+	firebase_app: Any
+	credentials: Union[str, Mapping[str, Any], None]
+	firebase_options: Mapping[str, Any]
+	max_recipients: int
+	transport: Optional[str]
+	transport_options: Mapping[str, Any]
+
+
+class WNSApplication(NamedTuple):
+	application_id: str
+	platform: str
+	package_security_id: str
+	secret_key: str
+	wns_access_url: str
+	transport: Optional[str]
+	transport_options: Mapping[str, Any]
+
+
+class WPApplication(NamedTuple):
+	application_id: str
+	platform: str
+	private_key: str
+	claims: Mapping[str, Any]
+	post_url: Mapping[str, str]
+	error_timeout: int
+	transport: Optional[str]
+	transport_options: Mapping[str, Any]
+
+
+Application = Union[APNSApplication, FCMApplication, WNSApplication, WPApplication]
+
+APPLICATION_CLASSES = {
+	"APNS": APNSApplication,
+	"FCM": FCMApplication,
+	"WNS": WNSApplication,
+	"WP": WPApplication,
+}
+
+
+# (path, mtime) of the APNs certificates and keys that passed validation
+_valid_certificates: Set[Tuple[str, int]] = set()
+
+_firebase_apps: Dict[str, Tuple[FCMApplication, Any]] = {}
+_firebase_apps_lock = threading.Lock()
+
+
+def get_firebase_app(application: FCMApplication) -> Any:
+	"""
+	Returns the firebase_admin.App of an application configured with
+	CREDENTIALS, initialised on first use. The App, and with it the OAuth
+	access token and HTTP session of its messaging client, is shared by all
+	threads until the application settings change.
+	"""
+	entry = _firebase_apps.get(application.application_id)
+	if entry is not None and entry[0] == application:
+		return entry[1]
+
+	with _firebase_apps_lock:
+		entry = _firebase_apps.get(application.application_id)
+		if entry is not None and entry[0] == application:
+			return entry[1]
+
+		import firebase_admin
+		from firebase_admin import credentials
+
+		if entry is not None:
+			firebase_admin.delete_app(entry[1])
+		if isinstance(application.credentials, str):
+			cred = credentials.Certificate(application.credentials)
+		else:
+			cred = credentials.Certificate(dict(application.credentials))
+		app = firebase_admin.initialize_app(
+			cred,
+			dict(application.firebase_options),
+			name="push_notifications:{}".format(application.application_id),
+		)
+		_firebase_apps[application.application_id] = (application, app)
+		return app
+
+
 class AppConfig(BaseConfig):
 	"""
 	Supports any number of push notification enabled applications.
+
+	The applications are validated and compiled into immutable per-platform
+	settings objects when the manager is created, later changes to
+	PUSH_NOTIFICATIONS_SETTINGS need get_manager(reload=True).
 	"""
 
 	def __init__(self, settings: Optional[Dict[str, Any]] = None) -> None:
 		# supports overriding the settings to be loaded. Will load from ..settings by default.
 		self._settings = settings or SETTINGS
+		self._lazy = self._settings.get("LAZY_LOADING", SETTINGS.get("LAZY_LOADING", False))
+		self._checked_credentials: Set[str] = set()
 
 		# initialize APPLICATIONS to an empty collection
 		self._settings.setdefault("APPLICATIONS", {})
 
 		# validate application configurations
+		self._applications: Dict[str, Application] = {}
 		self._validate_applications(self._settings["APPLICATIONS"])
 
 	def _validate_applications(self, apps: Dict[str, Dict[str, Any]]) -> None:
@@ -76,6 +195,25 @@ class AppConfig(BaseConfig):
 			self._validate_config(application_id, application_config)
 
 			application_config["APPLICATION_ID"] = application_id
+			self._applications[application_id] = self._compile_application(
+				application_config
+			)
+
+	def _compile_application(self, application_config: Dict[str, Any]) -> Application:
+		application_class = APPLICATION_CLASSES[application_config["PLATFORM"]]
+		values = {}
+		for field in application_class._fields:
+			value = application_config.get(field.upper())
+			if isinstance(value, dict):
+				value = MappingProxyType(dict(value))
+			values[field] = value
+		if "has_token_creds" in values:
+			values["has_token_creds"] = all(
+				key in application_config for key in APNS_AUTH_CREDS_REQUIRED
+			)
+		if values["transport_options"] is None:
+			values["transport_options"] = MappingProxyType({})
+		return application_class(**values)
 
 	def _validate_config(
 		self, application_id: str, application_config: Dict[str, Any]
@@ -119,6 +257,7 @@ class AppConfig(BaseConfig):
 		allowed = (
 			REQUIRED_SETTINGS
 			+ OPTIONAL_SETTINGS
+			+ TRANSPORT_SETTINGS
 			+ APNS_AUTH_CREDS_REQUIRED
 			+ APNS_AUTH_CREDS_OPTIONAL
 			+ APNS_OPTIONAL_SETTINGS
@@ -152,6 +291,7 @@ class AppConfig(BaseConfig):
 				+ APNS_AUTH_CREDS_OPTIONAL
 				+ APNS_OPTIONAL_SETTINGS
 				+ REQUIRED_SETTINGS
+				+ TRANSPORT_SETTINGS
 			)
 			self._validate_allowed_settings(
 				application_id, application_config, allowed_tokens
@@ -159,7 +299,8 @@ class AppConfig(BaseConfig):
 			self._validate_required_settings(
 				application_id, application_config, APNS_AUTH_CREDS_REQUIRED
 			)
-		self._validate_apns_certificate(application_config[cert_path])
+		if not self._lazy:
+			self._validate_apns_certificate(application_config[cert_path])
 
 		# determine/set optional values
 		application_config.setdefault("USE_SANDBOX", False)
@@ -167,12 +308,16 @@ class AppConfig(BaseConfig):
 		application_config.setdefault("TOPIC", None)
 
 	def _validate_apns_certificate(self, certfile: str) -> None:
-		"""Validate the APNS certificate at startup."""
+		"""Validate the APNS certificate, once per version of the file."""
 
 		try:
+			key = (certfile, os.stat(certfile).st_mtime_ns)
+			if key in _valid_certificates:
+				return
 			with open(certfile) as f:
 				content = f.read()
 				check_apns_certificate(content)
+			_valid_certificates.add(key)
 		except Exception as e:
 			raise ImproperlyConfigured(
 				"The APNS certificate file at {!r} is not readable: {}".format(
@@ -180,12 +325,20 @@ class AppConfig(BaseConfig):
 				)
 			)
 
+	def _check_credentials(self, application: APNSApplication, certfile: Any) -> None:
+		"""With LAZY_LOADING, validates the credentials file on first use."""
+
+		if self._lazy and application.application_id not in self._checked_credentials:
+			self._validate_apns_certificate(certfile)
+			self._checked_credentials.add(application.application_id)
+
 	def _validate_fcm_config(
 		self, application_id: str, application_config: Dict[str, Any]
 	) -> None:
 		allowed = (
 			REQUIRED_SETTINGS
 			+ OPTIONAL_SETTINGS
+			+ TRANSPORT_SETTINGS
 			+ FCM_REQUIRED_SETTINGS
 			+ FCM_OPTIONAL_SETTINGS
 		)
@@ -195,7 +348,16 @@ class AppConfig(BaseConfig):
 			application_id, application_config, FCM_REQUIRED_SETTINGS
 		)
 
+		if application_config.get("FIREBASE_APP") and application_config.get("CREDENTIALS"):
+			raise ImproperlyConfigured(
+				"Application '{}' can not have both FIREBASE_APP and CREDENTIALS.".format(
+					application_id
+				)
+			)
+
 		application_config.setdefault("FIREBASE_APP", None)
+		application_config.setdefault("CREDENTIALS", None)
+		application_config.setdefault("FIREBASE_OPTIONS", {})
 		application_config.setdefault("MAX_RECIPIENTS", 1000)
 
 	def _validate_wns_config(
@@ -204,6 +366,7 @@ class AppConfig(BaseConfig):
 		allowed = (
 			REQUIRED_SETTINGS
 			+ OPTIONAL_SETTINGS
+			+ TRANSPORT_SETTINGS
 			+ WNS_REQUIRED_SETTINGS
 			+ WNS_OPTIONAL_SETTINGS
 		)
@@ -223,6 +386,7 @@ class AppConfig(BaseConfig):
 		allowed = (
 			REQUIRED_SETTINGS
 			+ OPTIONAL_SETTINGS
+			+ TRANSPORT_SETTINGS
 			+ WP_REQUIRED_SETTINGS
 			+ WP_OPTIONAL_SETTINGS
 		)
@@ -325,17 +489,75 @@ class AppConfig(BaseConfig):
 
 		return app_config.get(settings_key)
 
+	def get_applications(self) -> Collection[str]:
+		return self._applications.keys()
+
+	def _lookup(self, application_id: Optional[str]) -> Optional[Application]:
+		return self._applications.get(application_id)
+
+	def get_application(self, application_id: Optional[str]) -> Application:
+		"""
+		Returns the resolved settings of an application, or raises
+		ImproperlyConfigured if it does not exist.
+		"""
+
+		application = self._lookup(application_id)
+		if application is None:
+			# raises the same errors as a missing application did before
+			self._get_application_settings(application_id, "", "")
+		return application
+
+	def _get_application(
+		self, application_id: Optional[str], platform: str, settings_key: str
+	) -> Application:
+		application = self.get_application(application_id)
+		if application.platform != platform:
+			raise ImproperlyConfigured(
+				SETTING_MISMATCH.format(
+					application_id=application_id,
+					platform=application.platform,
+					setting=settings_key,
+				)
+			)
+		return application
+
+	def _require(self, application_id: Optional[str], settings_key: str, value: Any) -> Any:
+		if value is None:
+			raise ImproperlyConfigured(
+				MISSING_SETTING.format(
+					application_id=application_id, setting=settings_key
+				)
+			)
+		return value
+
+	def get_transport(self, application_id: Optional[str] = None) -> Optional[str]:
+		application = self._lookup(application_id)
+		if application is not None and application.transport:
+			return application.transport
+		return super().get_transport(application_id)
+
+	def get_transport_options(self, application_id: Optional[str] = None) -> Mapping[str, Any]:
+		application = self._lookup(application_id)
+		if application is not None and application.transport:
+			return application.transport_options
+		return super().get_transport_options(application_id)
+
 	def get_firebase_app(self, application_id: Optional[str] = None) -> Any:
-		return self._get_application_settings(application_id, "FCM", "FIREBASE_APP")
+		application = self._get_application(application_id, "FCM", "FIREBASE_APP")
+		if application.credentials is None:
+			return application.firebase_app
+		return get_firebase_app(application)
 
 	def has_auth_token_creds(self, application_id: Optional[str] = None) -> bool:
-		return self.has_token_creds
+		return self._get_application(application_id, "APNS", "AUTH_KEY_PATH").has_token_creds
 
 	def get_max_recipients(self, application_id: Optional[str] = None) -> int:
-		return self._get_application_settings(application_id, "FCM", "MAX_RECIPIENTS")
+		return self._get_application(application_id, "FCM", "MAX_RECIPIENTS").max_recipients
 
 	def get_apns_certificate(self, application_id: Optional[str] = None) -> str:
-		r = self._get_application_settings(application_id, "APNS", "CERTIFICATE")
+		application = self._get_application(application_id, "APNS", "CERTIFICATE")
+		r = self._require(application_id, "CERTIFICATE", application.certificate)
+		self._check_credentials(application, r)
 		if not isinstance(r, str):
 			# probably the (Django) file, and file path should be got
 			if hasattr(r, "path"):
@@ -359,43 +581,48 @@ class AppConfig(BaseConfig):
 		)
 
 	def _get_apns_auth_key_path(self, application_id: Optional[str] = None) -> str:
-		return self._get_application_settings(application_id, "APNS", "AUTH_KEY_PATH")
+		application = self._get_application(application_id, "APNS", "AUTH_KEY_PATH")
+		path = self._require(application_id, "AUTH_KEY_PATH", application.auth_key_path)
+		self._check_credentials(application, path)
+		return path
 
 	def _get_apns_auth_key_id(self, application_id: Optional[str] = None) -> str:
-		return self._get_application_settings(application_id, "APNS", "AUTH_KEY_ID")
+		application = self._get_application(application_id, "APNS", "AUTH_KEY_ID")
+		return self._require(application_id, "AUTH_KEY_ID", application.auth_key_id)
 
 	def _get_apns_team_id(self, application_id: Optional[str] = None) -> str:
-		return self._get_application_settings(application_id, "APNS", "TEAM_ID")
+		application = self._get_application(application_id, "APNS", "TEAM_ID")
+		return self._require(application_id, "TEAM_ID", application.team_id)
 
 	def get_apns_use_sandbox(self, application_id: Optional[str] = None) -> bool:
-		return self._get_application_settings(application_id, "APNS", "USE_SANDBOX")
+		return self._get_application(application_id, "APNS", "USE_SANDBOX").use_sandbox
 
 	def get_apns_use_alternative_port(
 		self, application_id: Optional[str] = None
 	) -> bool:
-		return self._get_application_settings(
+		return self._get_application(
 			application_id, "APNS", "USE_ALTERNATIVE_PORT"
-		)
+		).use_alternative_port
 
 	def get_apns_topic(self, application_id: Optional[str] = None) -> Optional[str]:
-		return self._get_application_settings(application_id, "APNS", "TOPIC")
+		return self._get_application(application_id, "APNS", "TOPIC").topic
 
 	def get_wns_package_security_id(self, application_id: Optional[str] = None) -> str:
-		return self._get_application_settings(
+		return self._get_application(
 			application_id, "WNS", "PACKAGE_SECURITY_ID"
-		)
+		).package_security_id
 
 	def get_wns_secret_key(self, application_id: Optional[str] = None) -> str:
-		return self._get_application_settings(application_id, "WNS", "SECRET_KEY")
+		return self._get_application(application_id, "WNS", "SECRET_KEY").secret_key
 
 	def get_wp_post_url(self, application_id: str, browser: str) -> str:
-		return self._get_application_settings(application_id, "WP", "POST_URL")[browser]
+		return self._get_application(application_id, "WP", "POST_URL").post_url[browser]
 
 	def get_wp_private_key(self, application_id: Optional[str] = None) -> str:
-		return self._get_application_settings(application_id, "WP", "PRIVATE_KEY")
+		return self._get_application(application_id, "WP", "PRIVATE_KEY").private_key
 
-	def get_wp_claims(self, application_id: Optional[str] = None) -> Dict[str, Any]:
-		return self._get_application_settings(application_id, "WP", "CLAIMS")
+	def get_wp_claims(self, application_id: Optional[str] = None) -> Mapping[str, Any]:
+		return self._get_application(application_id, "WP", "CLAIMS").claims
 
 	def get_wp_error_timeout(self, application_id: Optional[str] = None) -> int:
-		return self._get_application_settings(application_id, "WP", "ERROR_TIMEOUT")
+		return self._get_application(application_id, "WP", "ERROR_TIMEOUT").error_timeout
@@ -1,10 +1,123 @@
-from .base import BaseConfig
+import logging
+import threading
+import time
+from typing import Any, Collection, Dict, Optional
 
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 
-class AppModelConfig(BaseConfig):
-	"""Future home of the Application Model conf adapter
+from push_notifications.settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
+from .app import AppConfig, Application, FCMApplication, get_firebase_app
 
-	Supports multiple applications in the database.
+
+logger = logging.getLogger(__name__)
+
+# Django cache key of the generation counter shared by all processes
+GENERATION_CACHE_KEY = "push_notifications:applications:generation"
+
+# Bumped in this process whenever an Application is saved or deleted
+_local_generation = 0
+
+
+def _shared_generation() -> int:
+	return cache.get(GENERATION_CACHE_KEY, 0)
+
+
+def _bump_shared_generation() -> None:
+	if not cache.add(GENERATION_CACHE_KEY, 1, timeout=None):
+		try:
+			cache.incr(GENERATION_CACHE_KEY)
+		except ValueError:
+			# evicted in between
+			cache.set(GENERATION_CACHE_KEY, 1, timeout=None)
+
+
+def invalidate_applications(**kwargs: Any) -> None:
 	"""
+	Marks the cached applications as stale: at once in this process, and in
+	the other processes once the transaction is committed.
+	"""
+	global _local_generation
+	_local_generation += 1
+	transaction.on_commit(_bump_shared_generation)
+
+
+post_save.connect(
+	invalidate_applications, sender="push_notifications.Application",
+	dispatch_uid="push_notifications_application_saved",
+)
+post_delete.connect(
+	invalidate_applications, sender="push_notifications.Application",
+	dispatch_uid="push_notifications_application_deleted",
+)
+
+
+class AppModelConfig(AppConfig):
+	"""
+	Supports any number of applications stored in the database, see
+	push_notifications.models.Application.
+
+	The active applications are loaded on first use, validated and compiled like
+	AppConfig does, and kept in a per-process cache, so sending never queries the
+	application table. Unless LAZY_LOADING is set, their credentials are loaded
+	at the same time: APNs certificates and keys are read and checked, and the
+	Firebase apps of FCM applications with CREDENTIALS are initialised. Saving
+	or deleting an Application reloads the cache at once in the same process,
+	and within PUSH_NOTIFICATIONS_SETTINGS
+	["APP_MODEL_REFRESH_INTERVAL"] seconds in other processes, through a
+	generation counter in the Django cache. Applications with invalid settings
+	are logged and skipped.
+	"""
+
+	def __init__(self, settings: Optional[Dict[str, Any]] = None) -> None:
+		# nothing is read here, the manager is created before the app registry is ready
+		super().__init__({"APPLICATIONS": {}})
+		self._generation: Optional[tuple] = None
+		self._next_check = 0.0
+		self._lock = threading.Lock()
+
+	def _refresh(self) -> None:
+		now = time.monotonic()
+		if self._generation is not None and self._generation[0] == _local_generation \
+			and now < self._next_check:
+			return
+		with self._lock:
+			generation = (_local_generation, _shared_generation())
+			if generation != self._generation:
+				self._load()
+				self._generation = generation
+			self._next_check = now + SETTINGS.get("APP_MODEL_REFRESH_INTERVAL", 5)
+
+	def _load(self) -> None:
+		from ..models import Application as ApplicationModel
+
+		apps: Dict[str, Dict[str, Any]] = {}
+		applications: Dict[str, Application] = {}
+		for row in ApplicationModel.objects.filter(active=True):
+			try:
+				config = row.get_config()
+				self._validate_config(row.application_id, config)
+				config["APPLICATION_ID"] = row.application_id
+				application = self._compile_application(config)
+				preload = not self._lazy and isinstance(application, FCMApplication)
+				if preload and application.credentials:
+					get_firebase_app(application)
+			except (ImproperlyConfigured, ValueError, OSError) as e:
+				logger.error("Skipping push notifications application %r: %s", row.application_id, e)
+				continue
+			apps[row.application_id] = config
+			applications[row.application_id] = application
+
+		self._settings = {"APPLICATIONS": apps}
+		self._applications = applications
+		self._checked_credentials = set()
+
+	def _lookup(self, application_id: Optional[str]) -> Optional[Application]:
+		self._refresh()
+		return self._applications.get(application_id)
 
-	pass
+	def get_applications(self) -> Collection[str]:
+		self._refresh()
+		return self._applications.keys()
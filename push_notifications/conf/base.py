@@ -1,5 +1,7 @@
 from django.core.exceptions import ImproperlyConfigured
-from typing import Optional, Any, Collection
+from typing import Optional, Any, Collection, Dict
+
+from ..settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
 
 
 class BaseConfig:
@@ -31,6 +33,14 @@ class BaseConfig:
 	def get_max_recipients(self, application_id: Optional[str] = None) -> int:
 		raise NotImplementedError
 
+	def get_transport(self, application_id: Optional[str] = None) -> Optional[str]:
+		"""The delivery transport, see push_notifications.transports."""
+
+		return SETTINGS.get("TRANSPORT")
+
+	def get_transport_options(self, application_id: Optional[str] = None) -> Dict[str, Any]:
+		return SETTINGS.get("TRANSPORT_OPTIONS") or {}
+
 	def get_applications(self) -> Collection[str]:
 		"""Returns a collection containing the configured applications."""
 
@@ -3,6 +3,17 @@ class NotificationError(Exception):
 		super().__init__(message)
 		self.message = message
 
+
+class PayloadTooLarge(NotificationError):
+	def __init__(self, platform: str, size: int, limit: int) -> None:
+		super().__init__(
+			"%s payload of %d bytes exceeds the %d byte limit" % (platform, size, limit)
+		)
+		self.platform = platform
+		self.size = size
+		self.limit = limit
+
+
 # APNS
 class APNSError(NotificationError):
 	pass
@@ -1,16 +1,17 @@
 import re
-import struct
-from typing import Optional, Any
+from typing import Any, Callable, Iterable, List, Optional
 from django import forms
 from django.core.validators import MaxValueValidator, MinValueValidator, RegexValidator
 from django.db import connection, models
+from django.db.models import lookups
 from django.utils.translation import gettext_lazy as _
 
 
-__all__ = ["HexadecimalField", "HexIntegerField"]
+__all__ = ["HexadecimalField", "HexIntegerField", "hex_integers_to_db_values"]
 
 UNSIGNED_64BIT_INT_MIN_VALUE = 0
 UNSIGNED_64BIT_INT_MAX_VALUE = 2**64 - 1
+SIGNED_64BIT_INT_MAX_VALUE = 2**63 - 1
 
 
 hex_re = re.compile(r"^(0x)?([0-9a-f])+$", re.I)
@@ -20,22 +21,55 @@ signed_integer_vendors = [
 ]
 
 
-def _using_signed_storage() -> bool:
+def _using_signed_storage(connection: Any) -> bool:
 	return connection.vendor in signed_integer_vendors
 
 
 def _signed_to_unsigned_integer(value: int) -> int:
-	return struct.unpack("Q", struct.pack("q", value))[0]
+	return value + 2**64 if value < 0 else value
 
 
 def _unsigned_to_signed_integer(value: int) -> int:
-	return struct.unpack("q", struct.pack("Q", value))[0]
+	if value > SIGNED_64BIT_INT_MAX_VALUE:
+		if value > UNSIGNED_64BIT_INT_MAX_VALUE:
+			raise ValueError("%d is out of the unsigned 64 bit range" % value)
+		return value - 2**64
+	return value
 
 
 def _hex_string_to_unsigned_integer(value: str) -> int:
 	return int(value, 16)
 
 
+def _prep_integer(value: Any) -> Optional[int]:
+	if value is None or value == "":
+		return None
+	if isinstance(value, str):
+		return _hex_string_to_unsigned_integer(value)
+	return value
+
+
+def _signed_db_converter(
+	value: Optional[int], expression: Any, connection: Any
+) -> Optional[int]:
+	if value is None or value >= 0:
+		return value
+	return value + 2**64
+
+
+def hex_integers_to_db_values(
+	values: Iterable[Any], connection: Any
+) -> List[Optional[int]]:
+	"""
+	Converts device ids (hex strings or unsigned integers) to the integers
+	stored by connection, in one pass, e.g. for a raw SQL IN clause.
+	"""
+	values = [_prep_integer(value) for value in values]
+	if not _using_signed_storage(connection):
+		return values
+	return [None if value is None else _unsigned_to_signed_integer(value) for value in values]
+
+
 def _unsigned_integer_to_hex_string(value: int) -> str:
 	return hex(value).rstrip("L")
 
@@ -69,7 +103,8 @@ class HexIntegerField(models.BigIntegerField):
 
 	Reasoning: Postgres only supports signed bigints. Since we don't care about
 	signedness, we store it as signed, and cast it to unsigned when we deal with
-	the actual value (with struct)
+	the actual value. The storage is chosen from the connection of each query,
+	so databases of different vendors can be used together.
 
 	On sqlite and mysql, native unsigned bigint types are used. In all cases, the
 	value we deal with in python is always in hex.
@@ -89,23 +124,39 @@ class HexIntegerField(models.BigIntegerField):
 			return super().db_type(connection=connection)
 
 	def get_prep_value(self, value: Optional[Any]) -> Optional[int]:
-		"""Return the integer value to be stored from the hex string"""
-		if value is None or value == "":
-			return None
-		if isinstance(value, str):
-			value = _hex_string_to_unsigned_integer(value)
-		if _using_signed_storage():
+		"""Return the unsigned integer value from the hex string"""
+		return _prep_integer(value)
+
+	def get_db_prep_value(
+		self, value: Optional[Any], connection: Any, prepared: bool = False
+	) -> Optional[int]:
+		"""Return the integer value to be stored by connection"""
+		value = super().get_db_prep_value(value, connection, prepared)
+		if value is not None and _using_signed_storage(connection):
 			value = _unsigned_to_signed_integer(value)
 		return value
 
-	def from_db_value(self, value: Optional[int], *args: Any) -> Optional[int]:
+	def from_db_value(
+		self, value: Optional[int], expression: Any, connection: Any
+	) -> Optional[int]:
 		"""Return an unsigned int representation from all db backends"""
 		if value is None:
 			return value
-		if _using_signed_storage():
+		if _using_signed_storage(connection):
 			value = _signed_to_unsigned_integer(value)
 		return value
 
+	def get_db_converters(self, connection: Any) -> List[Callable[..., Any]]:
+		# from_db_value() checks the storage for every row, the converters
+		# are chosen once per query: none for unsigned storage.
+		converters = [
+			converter for converter in super().get_db_converters(connection)
+			if converter != self.from_db_value
+		]
+		if _using_signed_storage(connection):
+			converters.append(_signed_db_converter)
+		return converters
+
 	def to_python(self, value: Optional[Any]) -> Optional[str]:
 		"""Return a str representation of the hexadecimal"""
 		if isinstance(value, str):
@@ -126,3 +177,20 @@ class HexIntegerField(models.BigIntegerField):
 		# it only raises ValidationError on failure
 		value = _hex_string_to_unsigned_integer(value)
 		super(models.BigIntegerField, self).run_validators(value)
+
+
+# The integer lookups reject values above the signed bigint range before
+# get_db_prep_value() converts them to the signed storage, and "in" converts
+# its values one by one.
+
+HexIntegerField.register_lookup(lookups.Exact)
+HexIntegerField.register_lookup(lookups.GreaterThan)
+HexIntegerField.register_lookup(lookups.GreaterThanOrEqual)
+HexIntegerField.register_lookup(lookups.LessThan)
+HexIntegerField.register_lookup(lookups.LessThanOrEqual)
+
+
+@HexIntegerField.register_lookup
+class HexIntegerIn(lookups.In):
+	def get_db_prep_lookup(self, value: Iterable[Any], connection: Any) -> Any:
+		return "%s", hex_integers_to_db_values(value, connection)
@@ -5,13 +5,18 @@ Documentation is available on the Firebase Developer website:
 https://firebase.google.com/docs/cloud-messaging/
 """
 
+import time
 from copy import copy
 from typing import List, Union, Dict, Any, Generator, Optional
 
 from firebase_admin import messaging
-from firebase_admin.exceptions import FirebaseError, InvalidArgumentError
+from firebase_admin.exceptions import FirebaseError, InvalidArgumentError, UnavailableError
 
+from . import metrics, payload
+from .concurrency import bulk_map, fair_map, get_limiter, parse_retry_after, size_class
 from .conf import get_manager
+from .settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
+from .transports import THROTTLED, UNREGISTERED, Transport, get_transport
 
 
 # Valid keys for FCM messages. Reference:
@@ -77,9 +82,9 @@ def dict_to_fcm_message(data: Dict[str, Any], dry_run: bool = False, **kwargs: A
 	notification_key = data.pop(
 		"notification_key", None) or kwargs.get("notification_key", None)
 
-	# topic is set with /topic/ prefix, message can handle this format as well
-	if to and to.startswith("/topic/"):
-		message.topic = to
+	# a topic is given with a /topics/ (or legacy /topic/) prefix
+	if to and to.startswith(("/topics/", "/topic/")):
+		message.topic = topic_name(to)
 	else:
 		message.token = notification_key or to
 	message.condition = condition
@@ -87,6 +92,14 @@ def dict_to_fcm_message(data: Dict[str, Any], dry_run: bool = False, **kwargs: A
 	return message
 
 
+def topic_name(topic: str) -> str:
+	"""The name of an FCM topic, without its "/topics/" (or legacy "/topic/") prefix."""
+	for prefix in ("/topics/", "/topic/"):
+		if topic.startswith(prefix):
+			return topic[len(prefix):]
+	return topic
+
+
 def _chunks(lst: List[Any], n: int) -> Generator[List[Any], None, None]:
 	"""
 	Yield successive chunks from list \a lst with a maximum size \a n
@@ -134,13 +147,85 @@ def _deactivate_devices_with_error_results(
 			if _validate_exception_for_deactivation(x.reason)
 		]
 	from .models import GCMDevice
-	GCMDevice.objects.filter(registration_id__in=deactivated_ids).update(active=False)
+	with metrics.span("deactivate", platform="FCM"):
+		GCMDevice.objects.filter(registration_id__in=deactivated_ids).update(active=False)
+	metrics.increment("deactivated", len(deactivated_ids), platform="FCM")
 	return deactivated_ids
 
 
+# Errors meaning FCM is pushing back rather than rejecting the token
+fcm_throttle_error_list = [
+	messaging.QuotaExceededError,
+	UnavailableError,
+]
+
+
+def _record_throttle(limiter: Any, exc: FirebaseError) -> None:
+	http_response = getattr(exc, "http_response", None)
+	headers = getattr(http_response, "headers", None) or {}
+	limiter.record_throttle(parse_retry_after(headers.get("Retry-After")))
+
+
+def _send_chunk(
+	chunk: List[str],
+	message: messaging.Message,
+	dry_run: bool = False,
+	app: Optional[Any] = None,
+	application_id: Optional[str] = None,
+) -> List[messaging.SendResponse]:
+	limiter = get_limiter("FCM", application_id)
+	transport = get_transport(application_id)
+	with metrics.span("build_payload", platform="FCM"):
+		messages = [_prepare_message(message, token) for token in chunk]
+	with limiter.slot(), metrics.span("request", platform="FCM"):
+		start = time.monotonic()
+		if transport is None:
+			responses = messaging.send_each(messages, dry_run=dry_run, app=app).responses
+		else:
+			responses = _transport_send_each(transport, messages, application_id)
+	latency = time.monotonic() - start
+	metrics.observe("request_latency", latency, platform="FCM")
+	if metrics.enabled():
+		failed = [r.exception for r in responses if r.exception is not None]
+		metrics.increment("sent", len(responses) - len(failed), platform="FCM")
+		for exc in failed:
+			metrics.increment("failed", platform="FCM", reason=type(exc).__name__)
+
+	throttled = [
+		r.exception for r in responses if type(r.exception) in fcm_throttle_error_list
+	]
+	if throttled:
+		_record_throttle(limiter, throttled[0])
+	else:
+		limiter.record_success(latency, size_class(len(chunk)))
+	return responses
+
+
+def _transport_send_each(
+	transport: Transport, messages: List[messaging.Message], application_id: Optional[str]
+) -> List[messaging.SendResponse]:
+	outcomes = transport.deliver_many(
+		"FCM", application_id, [(message.token, message) for message in messages]
+	)
+	responses = []
+	for message, outcome in zip(messages, outcomes):
+		if outcome == UNREGISTERED:
+			exc = messaging.UnregisteredError("Requested entity was not found.")
+		elif outcome == THROTTLED:
+			exc = messaging.QuotaExceededError("Sending limit exceeded for the message target.")
+		else:
+			exc = None
+		responses.append(messaging.SendResponse(
+			None if exc else {"name": "transport/%s" % message.token}, exc
+		))
+	return responses
+
+
 def _prepare_message(message: messaging.Message, token: str) -> messaging.Message:
+	# copy first, the same message is shared by concurrently sent chunks
+	message = copy(message)
 	message.token = token
-	return copy(message)
+	return message
 
 
 def send_message(
@@ -161,12 +246,23 @@ def send_message(
 
 	:return: A BatchResponse object
 	"""
-	max_recipients = get_manager().get_max_recipients(application_id)
-	app = get_manager().get_firebase_app(application_id) if application_id else None
+	manager = get_manager()
+	max_recipients = manager.get_max_recipients(application_id)
+	app = manager.get_firebase_app(application_id) if application_id else None
 
 	# Checks for valid recipient
-	if registration_ids is None and message.topic is None and message.condition is None:
-		return
+	if registration_ids is None:
+		to = kwargs.get("to")
+		topic = message.topic
+		if topic is None and to and to.startswith(("/topics/", "/topic/")):
+			topic = topic_name(to)
+		if topic is None and message.condition is None:
+			return
+		message_id = send_to_topic(
+			message, topic=topic, condition=message.condition,
+			application_id=application_id, dry_run=dry_run,
+		)
+		return messaging.BatchResponse([messaging.SendResponse({"name": message_id}, None)])
 
 	# Bundles the registration_ids in an list if only one is sent
 	if not isinstance(registration_ids, list):
@@ -175,12 +271,17 @@ def send_message(
 	# FCM only allows up to 1000 reg ids per bulk message
 	# https://firebase.google.com/docs/cloud-messaging/server#http-request
 	if registration_ids:
+		# the message is the same for every device, check it once
+		message = payload.fit_fcm_message(message)
 		ret: List[messaging.SendResponse] = []
-		for chunk in _chunks(registration_ids, max_recipients):
-			messages = [
-				_prepare_message(message, token) for token in chunk
-			]
-			responses = messaging.send_each(messages, dry_run=dry_run, app=app).responses
+		# chunks are sent concurrently, as far as the FCM limiter allows
+		with metrics.timed("batch", "batch_latency", platform="FCM"):
+			chunk_responses = bulk_map(
+				get_limiter("FCM", application_id),
+				lambda chunk: _send_chunk(chunk, message, dry_run, app, application_id),
+				_chunks(registration_ids, max_recipients),
+			)
+		for responses in chunk_responses:
 			ret.extend(responses)
 		_deactivate_devices_with_error_results(registration_ids, ret)
 		return messaging.BatchResponse(ret)
@@ -189,3 +290,165 @@ def send_message(
 
 
 send_bulk_message = send_message
+
+
+def send_application_messages(
+	registration_ids: Dict[Optional[str], List[str]],
+	message: messaging.Message,
+	dry_run: bool = False,
+	**kwargs: Any
+) -> messaging.BatchResponse:
+	"""
+	Sends an FCM notification to the registration ids of several applications
+	(tenants) at once. Their chunks are interleaved in weighted round robin,
+	see PUSH_NOTIFICATIONS_SETTINGS["TENANT_WEIGHTS"], and each application
+	sends within its own limiter, so a large audience does not hold back the
+	smaller ones.
+
+	:param registration_ids: The registration ids of each application id
+	:param dry_run: If True, no message will be sent.
+	:param kwargs: The other arguments of send_message(), which only uses
+		them for topic messages.
+	:return: A BatchResponse, with the responses of the applications in order
+	"""
+	message = payload.fit_fcm_message(message)
+	manager = get_manager()
+	queues = {}
+	apps = {}
+	for application_id, ids in registration_ids.items():
+		if ids:
+			queues[application_id] = list(_chunks(ids, manager.get_max_recipients(application_id)))
+			apps[application_id] = (
+				manager.get_firebase_app(application_id) if application_id else None
+			)
+
+	with metrics.timed("batch", "batch_latency", platform="FCM"):
+		chunk_responses = fair_map(
+			lambda application_id, chunk: _send_chunk(
+				chunk, message, dry_run, apps[application_id], application_id
+			),
+			queues,
+			{application_id: get_limiter("FCM", application_id) for application_id in queues},
+			SETTINGS["TENANT_WEIGHTS"],
+		)
+
+	ret: List[messaging.SendResponse] = []
+	for application_id, chunks in chunk_responses.items():
+		responses = [response for chunk in chunks for response in chunk]
+		_deactivate_devices_with_error_results(registration_ids[application_id], responses)
+		ret.extend(responses)
+	return messaging.BatchResponse(ret)
+
+
+def send_to_topic(
+	message: messaging.Message,
+	topic: Optional[str] = None,
+	condition: Optional[str] = None,
+	application_id: Optional[str] = None,
+	dry_run: bool = False,
+) -> str:
+	"""
+	Sends an FCM notification to all devices subscribed to a topic, or to a
+	condition on topics (e.g. "'sports' in topics || 'news' in topics"), in a
+	single request, without loading any device.
+
+	:param message: The Message object, use `dict_to_fcm_message` to convert dict to Message
+	:param topic: The topic name, with or without the /topics/ prefix.
+	:param condition: The topic condition, instead of a topic.
+	:param application_id: The application id to use.
+	:param dry_run: If True, no message will be sent.
+
+	:return: The message id
+	"""
+	if not topic and not condition:
+		raise ValueError("Either topic or condition must be given")
+	app = get_manager().get_firebase_app(application_id) if application_id else None
+
+	topic = topic_name(topic) if topic else None
+	message = copy(payload.fit_fcm_message(message))
+	message.token = None
+	message.topic = topic
+	message.condition = None if topic else condition
+
+	limiter = get_limiter("FCM", application_id)
+	transport = get_transport(application_id)
+	with limiter.slot(), metrics.span("request", platform="FCM"):
+		start = time.monotonic()
+		try:
+			if transport is None:
+				message_id = messaging.send(message, dry_run=dry_run, app=app)
+			else:
+				outcome = transport.deliver(
+					"FCM", application_id, "/topics/%s" % topic if topic else condition, message
+				)
+				if outcome == THROTTLED:
+					raise messaging.QuotaExceededError("Sending limit exceeded for the message target.")
+				message_id = "transport/%s" % (topic or condition)
+		except FirebaseError as e:
+			metrics.increment("failed", platform="FCM", reason=type(e).__name__)
+			if type(e) in fcm_throttle_error_list:
+				_record_throttle(limiter, e)
+			raise
+	latency = time.monotonic() - start
+	limiter.record_success(latency, "topic")
+	metrics.observe("request_latency", latency, platform="FCM")
+	metrics.increment("sent", platform="FCM")
+	return message_id
+
+
+# FCM accepts up to 1000 registration ids per topic management request
+TOPIC_MANAGEMENT_MAX_TOKENS = 1000
+
+
+def _manage_topic(
+	operation: Any,
+	registration_ids: List[str],
+	topic: str,
+	application_id: Optional[str],
+) -> messaging.TopicManagementResponse:
+	app = get_manager().get_firebase_app(application_id) if application_id else None
+	limiter = get_limiter("FCM", application_id)
+	transport = get_transport(application_id)
+
+	def manage_chunk(chunk: List[str]) -> List[Dict[str, Any]]:
+		if transport is not None:
+			return [{} for _ in chunk]
+		with limiter.slot(), metrics.span("request", platform="FCM"):
+			start = time.monotonic()
+			response = operation(chunk, topic, app=app)
+		limiter.record_success(time.monotonic() - start, ("topic", size_class(len(chunk))))
+		results: List[Dict[str, Any]] = [{} for _ in chunk]
+		for error in response.errors:
+			results[error.index] = {"error": error.reason}
+		return results
+
+	results: List[Dict[str, Any]] = []
+	for chunk_results in bulk_map(
+		limiter, manage_chunk, _chunks(registration_ids, TOPIC_MANAGEMENT_MAX_TOKENS)
+	):
+		results.extend(chunk_results)
+	return messaging.TopicManagementResponse({"results": results})
+
+
+def subscribe_to_topic(
+	registration_ids: List[str], topic: str, application_id: Optional[str] = None
+) -> messaging.TopicManagementResponse:
+	"""
+	Subscribes registration ids to an FCM topic, in requests of up to 1000 ids.
+
+	:return: A TopicManagementResponse over all registration ids
+	"""
+	return _manage_topic(messaging.subscribe_to_topic, registration_ids, topic, application_id)
+
+
+def unsubscribe_from_topic(
+	registration_ids: List[str], topic: str, application_id: Optional[str] = None
+) -> messaging.TopicManagementResponse:
+	"""
+	Unsubscribes registration ids from an FCM topic, in requests of up to 1000 ids.
+
+	:return: A TopicManagementResponse over all registration ids
+	"""
+	return _manage_topic(
+		messaging.unsubscribe_from_topic, registration_ids, topic, application_id
+	)
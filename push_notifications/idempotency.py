@@ -0,0 +1,57 @@
+"""
+Idempotent sends: every send_message() method accepts an idempotency_key, and
+a repeated key is skipped, without a provider request, for
+PUSH_NOTIFICATIONS_SETTINGS["IDEMPOTENCY_TTL"] seconds.
+
+Keys are recorded in the Django cache named by IDEMPOTENCY_CACHE, with one
+atomic cache.add() per send_message() call however many devices it reaches.
+Keys are scoped to the device model, and to the device for single device sends.
+A key is released if the send raises, so a retry after a failure is sent.
+"""
+
+import functools
+from typing import Any, Callable, Optional
+
+from django.core.cache import caches
+from django.db.models import QuerySet
+
+from . import metrics
+from .settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
+
+
+KEY_PREFIX = "push_notifications:idempotency"
+
+
+def make_key(target: Any, idempotency_key: str) -> str:
+	if isinstance(target, QuerySet):
+		return "{}:{}:{}".format(KEY_PREFIX, target.model._meta.label_lower, idempotency_key)
+	return "{}:{}:{}:{}".format(
+		KEY_PREFIX, target._meta.label_lower, target.pk, idempotency_key
+	)
+
+
+def idempotent(send_message: Callable[..., Any]) -> Callable[..., Any]:
+	"""
+	Adds the idempotency_key argument to a send_message() method. Sends with
+	a key already seen return None.
+	"""
+
+	@functools.wraps(send_message)
+	def wrapper(
+		self: Any, *args: Any, idempotency_key: Optional[str] = None, **kwargs: Any
+	) -> Any:
+		if idempotency_key is None:
+			return send_message(self, *args, **kwargs)
+
+		cache = caches[SETTINGS["IDEMPOTENCY_CACHE"]]
+		key = make_key(self, idempotency_key)
+		if not cache.add(key, True, timeout=SETTINGS["IDEMPOTENCY_TTL"]):
+			metrics.increment("duplicate_skipped")
+			return None
+		try:
+			return send_message(self, *args, **kwargs)
+		except BaseException:
+			cache.delete(key)
+			raise
+
+	return wrapper
@@ -0,0 +1,172 @@
+"""
+Background send jobs, used by the admin send actions.
+
+start_send_job() records a SendJob and runs it in a thread once the
+transaction is committed, so the admin request returns at once whatever the
+size of the selection. The job walks the selection in batches of device ids
+(DeviceQuerySet.iter_batches), sends each batch through the platform bulk
+path, or device by device, and saves its progress (sent, failed, deactivated)
+after every batch for the admin status page to poll.
+
+The thread does not survive its process: a job without progress for
+PUSH_NOTIFICATIONS_SETTINGS["SEND_JOB_TIMEOUT"] seconds is marked failed by
+fail_stale_jobs(), and stops if its thread is in fact still running.
+"""
+
+import datetime
+import json
+import logging
+import threading
+from typing import Any, List, Optional, Tuple
+
+from django.db import connections, transaction
+from django.db.models import F, Q, QuerySet
+from django.utils import timezone
+
+from .exceptions import APNSServerError, NotificationError
+from .models import SendJob
+from .settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
+
+
+logger = logging.getLogger(__name__)
+
+# Devices sent to per batch, between two progress updates
+JOB_BATCH_SIZE = 1000
+
+# Error messages kept on a job
+MAX_JOB_ERRORS = 20
+
+
+def count_results(result: Any) -> Tuple[int, int, List[str]]:
+	"""
+	Counts the sent and failed notifications in the result of a send_message()
+	call, whatever the platform.
+
+	:return: sent, failed, and the error messages
+	"""
+	if result is None:
+		return 0, 0, []
+	if hasattr(result, "success_count"):
+		# FCM BatchResponse
+		errors = [repr(r.exception) for r in result.responses if r.exception]
+		return result.success_count, result.failure_count, errors
+	if isinstance(result, list):
+		sent, failed, errors = 0, 0, []
+		for item in result:
+			item_sent, item_failed, item_errors = count_results(item)
+			sent += item_sent
+			failed += item_failed
+			errors += item_errors
+		return sent, failed, errors
+	if isinstance(result, dict):
+		if "results" in result:
+			# WebPush and single APNs results
+			errors = [str(r["error"]) for r in result["results"] if "error" in r]
+			return len(result["results"]) - len(errors), len(errors), errors
+		# APNs bulk results, {token: status}
+		errors = [str(status) for status in result.values() if str(status).lower() != "success"]
+		return len(result) - len(errors), len(errors), errors
+	# WNS returns the response body
+	return 1, 0, []
+
+
+def _send_batch(devices: QuerySet, message: str, bulk: bool) -> Tuple[int, int, List[str]]:
+	if bulk:
+		count = devices.count()
+		try:
+			return count_results(devices.send_message(message))
+		except NotificationError as e:
+			# the bulk paths attach the results of the devices sent to
+			sent, failed, errors = count_results(getattr(e, "results", None))
+			return sent, max(count - sent, 0), errors + [_error_message(e)]
+
+	sent, failed, errors = 0, 0, []
+	for device in devices:
+		try:
+			device_sent, device_failed, device_errors = count_results(device.send_message(message))
+		except NotificationError as e:
+			device_sent, device_failed, device_errors = 0, 1, [_error_message(e)]
+		sent += device_sent
+		failed += device_failed
+		errors += device_errors
+	return sent, failed, errors
+
+
+def _error_message(e: NotificationError) -> str:
+	return e.status if isinstance(e, APNSServerError) else str(e)
+
+
+def fail_stale_jobs(now: Optional[datetime.datetime] = None) -> int:
+	"""
+	Marks failed the pending and running jobs without progress for
+	SEND_JOB_TIMEOUT seconds, e.g. because their process died.
+
+	:return: The number of jobs marked failed.
+	"""
+	now = now or timezone.now()
+	cutoff = now - datetime.timedelta(seconds=SETTINGS["SEND_JOB_TIMEOUT"])
+	return SendJob.objects.filter(
+		Q(date_heartbeat__lt=cutoff) | Q(date_heartbeat__isnull=True, date_created__lt=cutoff),
+		status__in=[SendJob.PENDING, SendJob.RUNNING],
+	).update(status=SendJob.FAILED, date_finished=now)
+
+
+def run_send_job(job: SendJob, queryset: QuerySet) -> None:
+	"""Sends the job's message to the active devices of queryset."""
+	SendJob.objects.filter(pk=job.pk).update(
+		status=SendJob.RUNNING, date_heartbeat=timezone.now()
+	)
+	running = SendJob.objects.filter(pk=job.pk, status=SendJob.RUNNING)
+	model = queryset.model
+	errors: List[str] = []
+	try:
+		for batch in queryset.filter(active=True).iter_batches(JOB_BATCH_SIZE, fields=()):
+			pks = [row.pk for row in batch]
+			devices = model.objects.filter(pk__in=pks, active=True)
+			sent, failed, batch_errors = _send_batch(devices, job.message, job.bulk)
+			deactivated = len(pks) - model.objects.filter(pk__in=pks, active=True).count()
+			update = {
+				"sent": F("sent") + sent,
+				"failed": F("failed") + failed,
+				"deactivated": F("deactivated") + deactivated,
+				"date_heartbeat": timezone.now(),
+			}
+			if batch_errors and len(errors) < MAX_JOB_ERRORS:
+				errors = (errors + batch_errors)[:MAX_JOB_ERRORS]
+				update["errors"] = json.dumps(errors)
+			if not running.update(**update):
+				logger.warning("Send job %d was marked failed while running, stopping", job.pk)
+				return
+	except Exception:
+		logger.exception("Send job %d failed", job.pk)
+		running.update(status=SendJob.FAILED, date_finished=timezone.now())
+		raise
+	running.update(status=SendJob.DONE, date_finished=timezone.now())
+
+
+def _run_in_thread(job: SendJob, queryset: QuerySet) -> None:
+	try:
+		run_send_job(job, queryset)
+	except Exception:
+		# logged by run_send_job
+		pass
+	finally:
+		connections.close_all()
+
+
+def start_send_job(queryset: QuerySet, message: str, bulk: bool = True) -> SendJob:
+	"""
+	Records a SendJob for the devices of queryset and starts it in a thread
+	when the current transaction is committed.
+	"""
+	fail_stale_jobs()
+	job = SendJob.objects.create(
+		device_model=queryset.model._meta.label,
+		message=message,
+		bulk=bulk,
+		total=queryset.filter(active=True).count(),
+	)
+	transaction.on_commit(
+		lambda: threading.Thread(target=_run_in_thread, args=(job, queryset), daemon=True).start()
+	)
+	return job
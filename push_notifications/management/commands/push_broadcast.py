@@ -0,0 +1,61 @@
+import os
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+
+from push_notifications.broadcast import broadcast
+from push_notifications.jobs import JOB_BATCH_SIZE
+from push_notifications.transfer import DEVICE_MODELS
+
+
+class Command(BaseCommand):
+	help = (
+		"Sends a message to all the active devices of a platform from several "
+		"processes, each sending a range of device ids."
+	)
+
+	def add_arguments(self, parser: CommandParser) -> None:
+		parser.add_argument("platform", choices=sorted(DEVICE_MODELS))
+		parser.add_argument("message")
+		parser.add_argument(
+			"--application-id", help="Only send to the devices of this application."
+		)
+		parser.add_argument(
+			"--workers", type=int, default=os.cpu_count() or 1,
+			help="Worker processes (default: the number of CPUs)."
+		)
+		parser.add_argument(
+			"--shard", metavar="INDEX/TOTAL",
+			help=(
+				'Only send to one of TOTAL ranges of devices, e.g. "0/4" on the first '
+				"of 4 machines."
+			)
+		)
+		parser.add_argument(
+			"--batch-size", type=int, default=JOB_BATCH_SIZE,
+			help="Devices per send_message() call (default: %d)." % JOB_BATCH_SIZE
+		)
+
+	def handle(self, *args: Any, **options: Any) -> None:
+		shard = None
+		if options["shard"]:
+			try:
+				index, total = (int(value) for value in options["shard"].split("/"))
+			except ValueError:
+				raise CommandError("--shard must be INDEX/TOTAL, e.g. 0/4")
+			if not 0 <= index < total:
+				raise CommandError("The shard index must be between 0 and TOTAL - 1")
+			shard = (index, total)
+
+		queryset = DEVICE_MODELS[options["platform"]].objects.all()
+		if options["application_id"]:
+			queryset = queryset.filter(application_id=options["application_id"])
+
+		summary = broadcast(
+			queryset, options["message"], max(1, options["workers"]), shard, options["batch_size"]
+		)
+		for error in summary.errors:
+			self.stderr.write(error)
+		self.stdout.write("Sent {}, failed {}, deactivated {} devices".format(
+			summary.sent, summary.failed, len(summary.deactivated)
+		))
@@ -0,0 +1,63 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+
+from push_notifications.transfer import (
+	DEVICE_MODELS, FORMATS, IMPORT_BATCH_SIZE, export_devices, guess_format, import_devices,
+	open_file, read_rows
+)
+
+
+class Command(BaseCommand):
+	help = (
+		"Exports the devices of a platform to NDJSON or CSV, optionally gzipped, "
+		"or imports them, updating the devices with the same registration id."
+	)
+
+	def add_arguments(self, parser: CommandParser) -> None:
+		parser.add_argument("action", choices=("export", "import"))
+		parser.add_argument("platform", choices=sorted(DEVICE_MODELS))
+		parser.add_argument("path", help='The file to write or read, "-" for stdout/stdin.')
+		parser.add_argument(
+			"--format", choices=FORMATS,
+			help="The file format (default: guessed from the file name, else ndjson)."
+		)
+		parser.add_argument(
+			"--gzip", action="store_true", default=None,
+			help="Compress or decompress with gzip (default: if the file name ends with .gz)."
+		)
+		parser.add_argument(
+			"--batch-size", type=int, default=IMPORT_BATCH_SIZE,
+			help="Devices read or saved per query (default: %d)." % IMPORT_BATCH_SIZE
+		)
+		parser.add_argument(
+			"--active", action="store_true", help="Only export the active devices."
+		)
+
+	def handle(self, *args: Any, **options: Any) -> None:
+		platform = options["platform"]
+		path = options["path"]
+		format = options["format"] or guess_format(path)
+
+		if options["action"] == "export":
+			queryset = DEVICE_MODELS[platform].objects.all()
+			if options["active"]:
+				queryset = queryset.filter(active=True)
+			with open_file(path, "w", options["gzip"]) as stream:
+				count = export_devices(queryset, platform, stream, format, options["batch_size"])
+			self.stderr.write("Exported {} devices".format(count))
+			return
+
+		with open_file(path, "r", options["gzip"]) as stream:
+			try:
+				result = import_devices(platform, read_rows(stream, format), options["batch_size"])
+			except ValueError as e:
+				# malformed JSON lines
+				raise CommandError("Could not read {}: {}".format(path, e))
+		for number, error in result.errors:
+			self.stderr.write("Row {}: {}".format(number, error))
+		self.stderr.write(
+			"Imported {} new and {} updated devices, skipped {} invalid rows".format(
+				result.created, result.updated, len(result.errors)
+			)
+		)
@@ -0,0 +1,29 @@
+import time
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from push_notifications.scheduling import dispatch_scheduled
+
+
+class Command(BaseCommand):
+	help = "Sends the scheduled push notifications that are due."
+
+	def add_arguments(self, parser: CommandParser) -> None:
+		parser.add_argument(
+			"--once", action="store_true",
+			help="Dispatch the due notifications once and exit, e.g. from cron."
+		)
+		parser.add_argument(
+			"--interval", type=float, default=10,
+			help="Seconds between two dispatches (default: 10)."
+		)
+
+	def handle(self, *args: Any, **options: Any) -> None:
+		while True:
+			sent = dispatch_scheduled()
+			if options["verbosity"] > 1 and sent:
+				self.stdout.write("Sent {} slices".format(sent))
+			if options["once"]:
+				break
+			time.sleep(options["interval"])
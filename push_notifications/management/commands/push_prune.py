@@ -0,0 +1,90 @@
+import os
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.utils import timezone
+
+from push_notifications.pruning import (
+	duplicate_devices, prune_devices, stale_devices, validate_fcm_devices
+)
+from push_notifications.transfer import DEVICE_MODELS, IMPORT_BATCH_SIZE, open_file
+
+
+class Command(BaseCommand):
+	help = (
+		"Deletes the devices whose registration id is used by another device, and "
+		"the inactive devices older than --inactive-days."
+	)
+
+	def add_arguments(self, parser: CommandParser) -> None:
+		parser.add_argument(
+			"--platform", action="append", choices=sorted(DEVICE_MODELS),
+			help="Prune the devices of this platform (default: all). Can be repeated."
+		)
+		parser.add_argument(
+			"--duplicates", action="store_true",
+			help="Delete the devices whose registration id is used by another device."
+		)
+		parser.add_argument(
+			"--inactive-days", type=int,
+			help="Delete the inactive devices created more than this many days ago."
+		)
+		parser.add_argument(
+			"--validate-fcm", action="store_true",
+			help="First deactivate the FCM devices rejected by dry run sends."
+		)
+		parser.add_argument(
+			"--archive", metavar="DIRECTORY",
+			help="Write the deleted devices to gzipped NDJSON files in this directory."
+		)
+		parser.add_argument(
+			"--dry-run", action="store_true",
+			help="Only count the devices that would be deleted."
+		)
+		parser.add_argument(
+			"--batch-size", type=int, default=IMPORT_BATCH_SIZE,
+			help="Devices deleted or validated per query (default: %d)." % IMPORT_BATCH_SIZE
+		)
+
+	def handle(self, *args: Any, **options: Any) -> None:
+		if not (
+			options["duplicates"] or options["inactive_days"] is not None
+			or options["validate_fcm"]
+		):
+			raise CommandError(
+				"Nothing to prune: use --duplicates, --inactive-days or --validate-fcm."
+			)
+		platforms = options["platform"] or sorted(DEVICE_MODELS)
+		batch_size = options["batch_size"]
+		now = timezone.now()
+
+		if options["validate_fcm"] and "FCM" in platforms:
+			if options["dry_run"]:
+				self.stdout.write("FCM: validation skipped in a dry run")
+			else:
+				count = validate_fcm_devices(batch_size=batch_size)
+				self.stdout.write("FCM: deactivated {} devices rejected by FCM".format(count))
+
+		for platform in platforms:
+			model = DEVICE_MODELS[platform]
+			selections = []
+			if options["duplicates"]:
+				selections.append(("duplicates", duplicate_devices(model)))
+			if options["inactive_days"] is not None:
+				selections.append(("inactive", stale_devices(model, options["inactive_days"], now)))
+
+			for kind, queryset in selections:
+				if options["dry_run"]:
+					self.stdout.write("{}: {} {} devices would be deleted".format(
+						platform, queryset.count(), kind
+					))
+					continue
+				if options["archive"]:
+					path = os.path.join(options["archive"], "{}-{}-{}.ndjson.gz".format(
+						platform, kind, now.strftime("%Y%m%d%H%M%S")
+					))
+					with open_file(path, "w") as archive:
+						count = prune_devices(queryset, platform, archive, batch_size=batch_size)
+				else:
+					count = prune_devices(queryset, platform, batch_size=batch_size)
+				self.stdout.write("{}: deleted {} {} devices".format(platform, count, kind))
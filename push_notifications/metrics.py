@@ -0,0 +1,232 @@
+"""
+Metrics and tracing hooks for the send paths.
+
+A backend is enabled by setting PUSH_NOTIFICATIONS_SETTINGS["METRICS_BACKEND"]
+to the dotted path of a MetricsBackend subclass; PUSH_NOTIFICATIONS_SETTINGS
+["METRICS_OPTIONS"] is passed to its constructor. Without a backend every hook
+returns immediately.
+
+Emitted metrics (all tagged with `platform`):
+	counters: sent, failed (tagged with `reason`), deactivated
+	histograms: request_latency, batch_latency (seconds), payload_bytes
+	gauges: concurrency_limit, concurrency_latency (tagged with `application_id`)
+	spans: build_payload, connect, request, batch, deactivate
+"""
+
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, ContextManager, Dict, Iterator, Optional
+
+from django.utils.module_loading import import_string
+
+from .settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
+
+
+class MetricsBackend:
+	"""
+	Base class for metrics backends. Subclasses override the hooks they support,
+	the others are no-ops.
+	"""
+
+	def __init__(self, prefix: str = "push_notifications") -> None:
+		self.prefix = prefix
+
+	def metric_name(self, name: str, separator: str = ".") -> str:
+		return "{}{}{}".format(self.prefix, separator, name) if self.prefix else name
+
+	def increment(
+		self, name: str, value: int = 1, tags: Optional[Dict[str, str]] = None
+	) -> None:
+		pass
+
+	def observe(self, name: str, value: float, tags: Optional[Dict[str, str]] = None) -> None:
+		pass
+
+	def gauge(self, name: str, value: float, tags: Optional[Dict[str, str]] = None) -> None:
+		pass
+
+	def span(self, name: str, tags: Optional[Dict[str, str]] = None) -> ContextManager[Any]:
+		return nullcontext()
+
+
+class PrometheusBackend(MetricsBackend):
+	"""Requires prometheus_client. Metric names use "_" as separator."""
+
+	def __init__(
+		self, prefix: str = "push_notifications", registry: Optional[Any] = None
+	) -> None:
+		import prometheus_client
+
+		super().__init__(prefix)
+		self._client = prometheus_client
+		self._registry = registry or prometheus_client.REGISTRY
+		self._metrics: Dict[str, Any] = {}
+
+	def _get(self, cls_name: str, name: str, tags: Optional[Dict[str, str]]) -> Any:
+		# label names are fixed by the first use, every call site of a metric
+		# passes the same tags
+		metric = self._metrics.get(name)
+		if metric is None:
+			metric = getattr(self._client, cls_name)(
+				self.metric_name(name, "_"), name.replace("_", " "),
+				sorted(tags or ()), registry=self._registry
+			)
+			self._metrics[name] = metric
+		return metric.labels(**tags) if tags else metric
+
+	def increment(
+		self, name: str, value: int = 1, tags: Optional[Dict[str, str]] = None
+	) -> None:
+		self._get("Counter", name, tags).inc(value)
+
+	def observe(self, name: str, value: float, tags: Optional[Dict[str, str]] = None) -> None:
+		self._get("Histogram", name, tags).observe(value)
+
+	def gauge(self, name: str, value: float, tags: Optional[Dict[str, str]] = None) -> None:
+		self._get("Gauge", name, tags).set(value)
+
+
+class StatsdBackend(MetricsBackend):
+	"""
+	Requires the statsd package. Tag values are appended to the metric name, e.g.
+	push_notifications.failed.FCM.UnregisteredError
+	"""
+
+	def __init__(
+		self, prefix: str = "push_notifications", host: str = "localhost", port: int = 8125
+	) -> None:
+		import statsd
+
+		super().__init__(prefix)
+		self._client = statsd.StatsClient(host, port)
+
+	def _name(self, name: str, tags: Optional[Dict[str, str]]) -> str:
+		parts = [self.metric_name(name)]
+		if tags:
+			parts += [str(tags[key]) for key in sorted(tags)]
+		return ".".join(parts)
+
+	def increment(
+		self, name: str, value: int = 1, tags: Optional[Dict[str, str]] = None
+	) -> None:
+		self._client.incr(self._name(name, tags), value)
+
+	def observe(self, name: str, value: float, tags: Optional[Dict[str, str]] = None) -> None:
+		if name.endswith("_latency"):
+			# statsd timers are in milliseconds
+			self._client.timing(self._name(name, tags), value * 1000)
+		else:
+			self._client.timing(self._name(name, tags), value)
+
+	def gauge(self, name: str, value: float, tags: Optional[Dict[str, str]] = None) -> None:
+		self._client.gauge(self._name(name, tags), value)
+
+
+class OpenTelemetryBackend(MetricsBackend):
+	"""Requires opentelemetry-api. Emits metrics and spans."""
+
+	def __init__(self, prefix: str = "push_notifications") -> None:
+		from opentelemetry import metrics, trace
+
+		super().__init__(prefix)
+		self._meter = metrics.get_meter("push_notifications")
+		self._tracer = trace.get_tracer("push_notifications")
+		self._instruments: Dict[str, Any] = {}
+
+	def _instrument(self, factory: str, name: str) -> Any:
+		instrument = self._instruments.get(name)
+		if instrument is None:
+			instrument = getattr(self._meter, factory)(self.metric_name(name))
+			self._instruments[name] = instrument
+		return instrument
+
+	def increment(
+		self, name: str, value: int = 1, tags: Optional[Dict[str, str]] = None
+	) -> None:
+		self._instrument("create_counter", name).add(value, tags)
+
+	def observe(self, name: str, value: float, tags: Optional[Dict[str, str]] = None) -> None:
+		self._instrument("create_histogram", name).record(value, tags)
+
+	def gauge(self, name: str, value: float, tags: Optional[Dict[str, str]] = None) -> None:
+		if hasattr(self._meter, "create_gauge"):
+			self._instrument("create_gauge", name).set(value, tags)
+
+	def span(self, name: str, tags: Optional[Dict[str, str]] = None) -> ContextManager[Any]:
+		return self._tracer.start_as_current_span(
+			self.metric_name(name), attributes=tags
+		)
+
+
+class _Unset:
+	pass
+
+
+_backend: Any = _Unset
+_null_span = nullcontext()
+
+
+def get_backend(reload: bool = False) -> Optional[MetricsBackend]:
+	global _backend
+	if _backend is _Unset or reload:
+		path = SETTINGS.get("METRICS_BACKEND")
+		if path:
+			_backend = import_string(path)(**SETTINGS.get("METRICS_OPTIONS", {}))
+		else:
+			_backend = None
+	return _backend
+
+
+def set_backend(backend: Optional[MetricsBackend]) -> None:
+	"""Installs a backend instance directly, e.g. from an AppConfig.ready()"""
+	global _backend
+	_backend = backend
+
+
+def enabled() -> bool:
+	return get_backend() is not None
+
+
+def increment(name: str, value: int = 1, **tags: str) -> None:
+	backend = get_backend()
+	if backend is not None and value:
+		backend.increment(name, value, tags)
+
+
+def observe(name: str, value: float, **tags: str) -> None:
+	backend = get_backend()
+	if backend is not None:
+		backend.observe(name, value, tags)
+
+
+def gauge(name: str, value: float, **tags: str) -> None:
+	backend = get_backend()
+	if backend is not None:
+		backend.gauge(name, value, tags)
+
+
+def span(name: str, **tags: str) -> ContextManager[Any]:
+	backend = get_backend()
+	if backend is None:
+		return _null_span
+	return backend.span(name, tags)
+
+
+@contextmanager
+def _timed(
+	backend: MetricsBackend, name: str, histogram: str, tags: Dict[str, str]
+) -> Iterator[None]:
+	start = time.monotonic()
+	with backend.span(name, tags):
+		try:
+			yield
+		finally:
+			backend.observe(histogram, time.monotonic() - start, tags)
+
+
+def timed(name: str, histogram: str, **tags: str) -> ContextManager[Any]:
+	"""A span named `name` whose duration is also recorded in `histogram`."""
+	backend = get_backend()
+	if backend is None:
+		return _null_span
+	return _timed(backend, name, histogram, tags)
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('push_notifications', '0012_alter_webpushdevice_browser'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Application',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('application_id', models.CharField(max_length=64, unique=True, verbose_name='Application ID')),
+                ('platform', models.CharField(choices=[('APNS', 'Apple Push Notification Service'), ('FCM', 'Firebase Cloud Messaging'), ('WNS', 'Windows Notification Service'), ('WP', 'WebPush')], max_length=4, verbose_name='Platform')),
+                ('settings', models.TextField(blank=True, default='{}', help_text='JSON object with the platform settings, the same keys as an entry of PUSH_NOTIFICATIONS_SETTINGS["APPLICATIONS"]', verbose_name='Settings')),
+                ('active', models.BooleanField(default=True, help_text='Inactive applications can not send notifications', verbose_name='Is active')),
+                ('date_created', models.DateTimeField(auto_now_add=True, verbose_name='Creation date')),
+                ('date_modified', models.DateTimeField(auto_now=True, verbose_name='Modification date')),
+            ],
+            options={
+                'verbose_name': 'Application',
+            },
+        ),
+    ]
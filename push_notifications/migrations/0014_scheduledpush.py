@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('push_notifications', '0013_application'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduledPush',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('platform', models.CharField(choices=[('APNS', 'Apple Push Notification Service'), ('FCM', 'Firebase Cloud Messaging'), ('WNS', 'Windows Notification Service'), ('WP', 'WebPush')], max_length=4, verbose_name='Platform')),
+                ('application_id', models.CharField(blank=True, help_text='Only send to the devices of this application', max_length=64, null=True, verbose_name='Application ID')),
+                ('message', models.TextField(verbose_name='Message')),
+                ('options', models.TextField(blank=True, default='{}', help_text='JSON object of keyword arguments for send_message()', verbose_name='Options')),
+                ('send_at', models.DateTimeField(db_index=True, verbose_name='Send at')),
+                ('local_time', models.BooleanField(default=False, help_text='Deliver at the wall clock time of send_at (read as UTC) in the time zone of each device', verbose_name='Local time')),
+                ('window', models.PositiveIntegerField(default=0, help_text='Spread the delivery of each time zone over this many seconds', verbose_name='Window')),
+                ('jitter', models.PositiveIntegerField(default=0, help_text='Delay each slice of devices by up to this many random seconds', verbose_name='Jitter')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('cancelled', 'Cancelled')], db_index=True, default='pending', max_length=10, verbose_name='Status')),
+                ('recipients', models.PositiveIntegerField(default=0, verbose_name='Recipients')),
+                ('date_created', models.DateTimeField(auto_now_add=True, verbose_name='Creation date')),
+            ],
+            options={
+                'verbose_name': 'Scheduled push',
+            },
+        ),
+        migrations.CreateModel(
+            name='ScheduledPushBucket',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('utc_offset', models.IntegerField(help_text='In minutes', verbose_name='UTC offset')),
+                ('release_at', models.DateTimeField(db_index=True, verbose_name='Release at')),
+                ('slices', models.PositiveIntegerField(default=1, verbose_name='Slices')),
+                ('next_slice', models.PositiveIntegerField(default=0, verbose_name='Next slice')),
+                ('scheduled_push', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='buckets', to='push_notifications.scheduledpush')),
+            ],
+            options={
+                'verbose_name': 'Scheduled push bucket',
+                'unique_together': {('scheduled_push', 'utc_offset')},
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('push_notifications', '0014_scheduledpush'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TopicSubscription',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('topic', models.CharField(db_index=True, max_length=255, verbose_name='Topic')),
+                ('date_created', models.DateTimeField(auto_now_add=True, verbose_name='Creation date')),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='topic_subscriptions', to='push_notifications.gcmdevice')),
+            ],
+            options={
+                'verbose_name': 'FCM topic subscription',
+                'unique_together': {('device', 'topic')},
+            },
+        ),
+    ]
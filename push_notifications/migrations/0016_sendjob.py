@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('push_notifications', '0015_topicsubscription'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SendJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device_model', models.CharField(max_length=100, verbose_name='Device model')),
+                ('message', models.TextField(verbose_name='Message')),
+                ('bulk', models.BooleanField(default=True, verbose_name='Bulk')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10, verbose_name='Status')),
+                ('total', models.PositiveIntegerField(default=0, verbose_name='Total')),
+                ('sent', models.PositiveIntegerField(default=0, verbose_name='Sent')),
+                ('failed', models.PositiveIntegerField(default=0, verbose_name='Failed')),
+                ('deactivated', models.PositiveIntegerField(default=0, verbose_name='Deactivated')),
+                ('errors', models.TextField(blank=True, default='[]', verbose_name='Errors')),
+                ('date_created', models.DateTimeField(auto_now_add=True, verbose_name='Creation date')),
+                ('date_finished', models.DateTimeField(blank=True, null=True, verbose_name='Finish date')),
+                ('date_heartbeat', models.DateTimeField(blank=True, null=True, verbose_name='Last progress')),
+            ],
+            options={
+                'verbose_name': 'Send job',
+            },
+        ),
+    ]
@@ -1,7 +1,13 @@
+import json
+from itertools import groupby, islice
+from operator import attrgetter
+
 from django.db import models
 from django.utils.translation import gettext_lazy as _
-from typing import List, Optional, Dict, Any
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+from . import metrics
 from .fields import HexIntegerField
+from .idempotency import idempotent
 from .settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
 
 
@@ -10,6 +16,13 @@ CLOUD_MESSAGE_TYPES = (
 	("GCM", "Google Cloud Message"),
 )
 
+PLATFORM_TYPES = (
+	("APNS", "Apple Push Notification Service"),
+	("FCM", "Firebase Cloud Messaging"),
+	("WNS", "Windows Notification Service"),
+	("WP", "WebPush"),
+)
+
 BROWSER_TYPES = (
 	("CHROME", "Chrome"),
 	("FIREFOX", "Firefox"),
@@ -51,16 +64,54 @@ class Device(models.Model):
 		)
 
 
-class GCMDeviceManager(models.Manager):
+class DeviceQuerySet(models.query.QuerySet):
+	def iter_batches(
+		self, batch_size: int = 1000, fields: Sequence[str] = ("registration_id",)
+	) -> Iterator[List[Any]]:
+		"""
+		Yields the devices in lists of up to batch_size named tuples of pk and
+		`fields`, paginated on the primary key: every batch is an index range
+		scan, so a pass over the whole table runs in linear time and constant
+		memory, unlike OFFSET pagination or iterating over model instances.
+		"""
+		fields = [field for field in fields if field != "pk"]
+		queryset = self.order_by("pk").values_list("pk", *fields, named=True)
+		batch = list(queryset[:batch_size])
+		while batch:
+			yield batch
+			if len(batch) < batch_size:
+				break
+			batch = list(queryset.filter(pk__gt=batch[-1].pk)[:batch_size])
+
+	def _registration_ids(self, application_id: Optional[str], **filters: Any) -> List[str]:
+		"""
+		The registration ids of the active devices of an application, one per
+		row in primary key order. A token stored in several rows
+		(re-registrations, shared devices) appears once per row: bulk sends go
+		to the distinct tokens, see _distinct(), and map their results back to
+		every row with _per_row().
+		"""
+		devices = self.filter(active=True, application_id=application_id, **filters)
+		return list(devices.order_by("pk").values_list("registration_id", flat=True))
+
+
+class DeviceManager(models.Manager):
+	def iter_batches(
+		self, batch_size: int = 1000, fields: Sequence[str] = ("registration_id",)
+	) -> Iterator[List[Any]]:
+		return self.get_queryset().iter_batches(batch_size, fields)
+
+
+class GCMDeviceManager(DeviceManager):
 	def get_queryset(self) -> "GCMDeviceQuerySet":
 		return GCMDeviceQuerySet(self.model)
 
 
-class GCMDeviceQuerySet(models.query.QuerySet):
+class GCMDeviceQuerySet(DeviceQuerySet):
+	@idempotent
 	def send_message(self, message: Any, **kwargs: Any) -> Any:
 		if self.exists():
-			from .gcm import dict_to_fcm_message, messaging
-			from .gcm import send_message as fcm_send_message
+			from .gcm import dict_to_fcm_message, messaging, send_application_messages
 
 			if not isinstance(message, messaging.Message):
 				data = kwargs.pop("extra", {})
@@ -73,19 +124,75 @@ class GCMDeviceQuerySet(models.query.QuerySet):
 				"application_id"
 			).values_list("application_id", flat=True).distinct())
 
-			responses = []
-			for app_id in app_ids:
-				reg_ids = list(
-					self.filter(
-						active=True, cloud_message_type="FCM", application_id=app_id).values_list(
-						"registration_id", flat=True
-					)
+			reg_ids = {
+				app_id: self._registration_ids(app_id, cloud_message_type="FCM") for app_id in app_ids
+			}
+			tokens = {app_id: _distinct(ids) for app_id, ids in reg_ids.items()}
+			response = send_application_messages(tokens, message, **kwargs)
+			# the responses are in the order of the tokens of each application
+			responses = iter(response.responses)
+			return messaging.BatchResponse([
+				r for app_id in app_ids for r in _per_row(
+					reg_ids[app_id], tokens[app_id], list(islice(responses, len(tokens[app_id])))
 				)
-				if reg_ids:
-					r = fcm_send_message(reg_ids, message, application_id=app_id, **kwargs)
-					responses.extend(r.responses)
-
-			return messaging.BatchResponse(responses)
+			])
+
+	def _fcm_device_batches(
+		self, batch_size: int
+	) -> Iterator[Tuple[Optional[str], List[Any]]]:
+		"""
+		Yields the active FCM devices in batches of one application, as
+		(pk, registration_id).
+		"""
+		batches = self.filter(active=True, cloud_message_type="FCM").iter_batches(
+			batch_size, fields=("registration_id", "application_id")
+		)
+		for batch in batches:
+			batch.sort(key=_application_id)
+			for app_id, devices in groupby(batch, key=attrgetter("application_id")):
+				yield app_id, [(device.pk, device.registration_id) for device in devices]
+
+	def subscribe_to_topic(self, topic: str) -> List[Any]:
+		"""
+		Subscribes the devices to an FCM topic, see gcm.send_to_topic, and
+		records the subscriptions of the devices that FCM accepted.
+
+		:return: A TopicManagementResponse per batch of devices of an application
+		"""
+		from .gcm import TOPIC_MANAGEMENT_MAX_TOKENS, subscribe_to_topic, topic_name
+
+		topic = topic_name(topic)
+		responses = []
+		for app_id, devices in self._fcm_device_batches(TOPIC_MANAGEMENT_MAX_TOKENS):
+			response = subscribe_to_topic(
+				[registration_id for _, registration_id in devices], topic, application_id=app_id
+			)
+			failed = {error.index for error in response.errors}
+			TopicSubscription.objects.bulk_create([
+				TopicSubscription(device_id=pk, topic=topic)
+				for i, (pk, _) in enumerate(devices) if i not in failed
+			], batch_size=TOPIC_MANAGEMENT_MAX_TOKENS, ignore_conflicts=True)
+			responses.append(response)
+		return responses
+
+	def unsubscribe_from_topic(self, topic: str) -> List[Any]:
+		"""
+		Unsubscribes the devices from an FCM topic.
+
+		:return: A TopicManagementResponse per batch of devices of an application
+		"""
+		from .gcm import TOPIC_MANAGEMENT_MAX_TOKENS, topic_name, unsubscribe_from_topic
+
+		topic = topic_name(topic)
+		responses = []
+		for app_id, devices in self._fcm_device_batches(TOPIC_MANAGEMENT_MAX_TOKENS):
+			responses.append(unsubscribe_from_topic(
+				[registration_id for _, registration_id in devices], topic, application_id=app_id
+			))
+			TopicSubscription.objects.filter(
+				device_id__in=[pk for pk, _ in devices], topic=topic
+			).delete()
+		return responses
 
 
 class GCMDevice(Device):
@@ -107,6 +214,7 @@ class GCMDevice(Device):
 	class Meta:
 		verbose_name = _("FCM device")
 
+	@idempotent
 	def send_message(self, message: Any, **kwargs: Any) -> Optional[Any]:
 		from .gcm import dict_to_fcm_message, messaging
 		from .gcm import send_message as fcm_send_message
@@ -127,34 +235,106 @@ class GCMDevice(Device):
 			application_id=self.application_id, **kwargs
 		)
 
-class APNSDeviceManager(models.Manager):
+	def subscribe_to_topic(self, topic: str) -> Optional[Any]:
+		responses = GCMDevice.objects.filter(pk=self.pk).subscribe_to_topic(topic)
+		return responses[0] if responses else None
+
+	def unsubscribe_from_topic(self, topic: str) -> Optional[Any]:
+		responses = GCMDevice.objects.filter(pk=self.pk).unsubscribe_from_topic(topic)
+		return responses[0] if responses else None
+
+
+class TopicSubscription(models.Model):
+	"""An FCM topic a GCMDevice was subscribed to."""
+
+	device = models.ForeignKey(
+		GCMDevice, related_name="topic_subscriptions", on_delete=models.CASCADE
+	)
+	topic = models.CharField(max_length=255, verbose_name=_("Topic"), db_index=True)
+	date_created = models.DateTimeField(verbose_name=_("Creation date"), auto_now_add=True)
+
+	class Meta:
+		verbose_name = _("FCM topic subscription")
+		unique_together = ("device", "topic")
+
+	def __str__(self) -> str:
+		return "{} on {}".format(self.device, self.topic)
+
+
+class APNSDeviceManager(DeviceManager):
 	def get_queryset(self) -> "APNSDeviceQuerySet":
 		return APNSDeviceQuerySet(self.model)
 
 
-class APNSDeviceQuerySet(models.query.QuerySet):
+class APNSDeviceQuerySet(DeviceQuerySet):
+	@idempotent
 	def send_message(self, message: Any, creds: Optional[Any] = None, **kwargs: Any) -> List[Any]:
+		"""
+		Sends message to the active devices in chunks of TENANT_CHUNK_SIZE.
+		The applications are sent to concurrently, each within its own limiter,
+		and every chunk reuses the client of its application.
+
+		:raises APNSError: The first error of a chunk, raised once the other
+			chunks are sent to. Its `results` attribute holds the results of
+			every chunk.
+		"""
 		if self.exists():
 			try:
-				from .apns_async import apns_send_bulk_message
+				from .apns_async import (
+					APNSSession, apns_send_bulk_message, deactivate_devices
+				)
 			except ImportError:
-				from .apns import apns_send_bulk_message
+				from .apns import APNSSession, apns_send_bulk_message, deactivate_devices
 
-			app_ids = self.filter(active=True).order_by("application_id") \
-				.values_list("application_id", flat=True).distinct()
-			res = []
+			from .concurrency import fair_map, get_limiter
+			from .exceptions import APNSError
+
+			app_ids = list(self.filter(active=True).order_by(
+				"application_id"
+			).values_list("application_id", flat=True).distinct())
+			chunk_size = SETTINGS["TENANT_CHUNK_SIZE"]
+			queues = {}
 			for app_id in app_ids:
-				reg_ids = list(self.filter(active=True, application_id=app_id).values_list(
-					"registration_id", flat=True)
-				)
-				r = apns_send_bulk_message(
-					registration_ids=reg_ids, alert=message, application_id=app_id,
-					creds=creds, **kwargs
+				reg_ids = _distinct(self._registration_ids(app_id))
+				queues[app_id] = [
+					reg_ids[i:i + chunk_size] for i in range(0, len(reg_ids), chunk_size)
+				]
+
+			def send(app_id: Optional[str], reg_ids: List[str]) -> Any:
+				try:
+					return apns_send_bulk_message(
+						registration_ids=reg_ids, alert=message, application_id=app_id,
+						creds=creds, session=session, deactivate=False, **kwargs
+					)
+				except APNSError as e:
+					# the other chunks are still sent to
+					return e
+
+			# the chunks of the applications are interleaved, so a large
+			# audience does not hold back the others
+			with APNSSession() as session:
+				chunk_results = fair_map(
+					send, queues, {app_id: get_limiter("APNS", app_id) for app_id in queues},
+					SETTINGS["TENANT_WEIGHTS"],
 				)
-				if hasattr(r, "keys"):
-					res += [r]
-				elif hasattr(r, "__getitem__"):
-					res += r
+
+			res = []
+			error = None
+			for results in chunk_results.values():
+				for r in results:
+					if isinstance(r, APNSError):
+						error = error or r
+						r = getattr(r, "results", None)
+					if hasattr(r, "keys"):
+						res += [r]
+					elif hasattr(r, "__getitem__"):
+						res += r
+			deactivate_devices({
+				token: result for r in res if hasattr(r, "items") for token, result in r.items()
+			})
+			if error is not None:
+				error.results = res
+				raise error
 			return res
 
 
@@ -174,6 +354,7 @@ class APNSDevice(Device):
 	class Meta:
 		verbose_name = _("APNS device")
 
+	@idempotent
 	def send_message(self, message: Any, creds: Optional[Any] = None, **kwargs: Any) -> Any:
 		try:
 			from .apns_async import apns_send_message
@@ -188,29 +369,46 @@ class APNSDevice(Device):
 		)
 
 
-class WNSDeviceManager(models.Manager):
+class WNSDeviceManager(DeviceManager):
 	def get_queryset(self) -> "WNSDeviceQuerySet":
 		return WNSDeviceQuerySet(self.model)
 
 
-class WNSDeviceQuerySet(models.query.QuerySet):
+class WNSDeviceQuerySet(DeviceQuerySet):
+	@idempotent
 	def send_message(self, message: Any, **kwargs: Any) -> List[Any]:
+		"""
+		Sends message to the active devices, application by application.
+
+		:raises NotificationError: The first error, raised once the other
+			devices are sent to. Its `results` attribute holds their results.
+		"""
+		from .exceptions import NotificationError
 		from .wns import wns_send_bulk_message
 
 		app_ids = list(self.filter(active=True).order_by("application_id").values_list(
 			"application_id", flat=True
 		).distinct())
 		res = []
+		error = None
 		for app_id in app_ids:
-			reg_ids = list(self.filter(active=True, application_id=app_id).values_list(
-				"registration_id", flat=True
-			))
-			r = wns_send_bulk_message(uri_list=reg_ids, message=message, **kwargs)
+			reg_ids = self._registration_ids(app_id)
+			uris = _distinct(reg_ids)
+			try:
+				r = wns_send_bulk_message(uri_list=uris, message=message, **kwargs)
+				r = _per_row(reg_ids, uris, r)
+			except NotificationError as e:
+				# the other applications are still sent to
+				error = error or e
+				r = getattr(e, "results", [])
 			if hasattr(r, "keys"):
 				res += [r]
 			elif hasattr(r, "__getitem__"):
 				res += r
 
+		if error is not None:
+			error.results = res
+			raise error
 		return res
 
 
@@ -226,6 +424,7 @@ class WNSDevice(Device):
 	class Meta:
 		verbose_name = _("WNS device")
 
+	@idempotent
 	def send_message(self, message: Any, **kwargs: Any) -> str:
 		from .wns import wns_send_message
 
@@ -235,18 +434,98 @@ class WNSDevice(Device):
 		)
 
 
-class WebPushDeviceManager(models.Manager):
+def _distinct(registration_ids: List[str]) -> List[str]:
+	"""The distinct registration ids, in order, so each token is sent to once."""
+	return list(dict.fromkeys(registration_ids))
+
+
+def _per_row(
+	registration_ids: List[str], tokens: List[str], results: Sequence[Any]
+) -> List[Any]:
+	"""
+	The results of the distinct tokens, in the order of registration_ids, so
+	every row of a token gets its result.
+	"""
+	if len(tokens) == len(registration_ids):
+		return list(results)
+	by_token = dict(zip(tokens, results))
+	return [by_token[registration_id] for registration_id in registration_ids]
+
+
+def _application_id(device: Any) -> str:
+	# sort key, application_id may be None
+	return device.application_id or ""
+
+
+class WebPushDeviceManager(DeviceManager):
 	def get_queryset(self) -> "WebPushDeviceQuerySet":
 		return WebPushDeviceQuerySet(self.model)
 
 
-class WebPushDeviceQuerySet(models.query.QuerySet):
+class WebPushDeviceQuerySet(DeviceQuerySet):
+	@idempotent
 	def send_message(self, message: Any, **kwargs: Any) -> List[Any]:
-		devices = self.filter(active=True).order_by("application_id").distinct()
+		"""
+		Sends message to the active devices, in batches.
+
+		:raises WebPushError: The first error, raised once the other devices
+			are sent to. Its `results` attribute holds their results.
+		"""
+		from .concurrency import bulk_map
+		from .exceptions import WebPushError
+		from .payload import fit_webpush_message
+		from .webpush import _webpush_send, get_webpush_application
+
+		# the message is the same for every device, check it once
+		message = fit_webpush_message(message)
 		res: List[Any] = []
-		for device in devices:
-			res.append(device.send_message(message))
-
+		expired: List[Any] = []
+		applications: Dict[Optional[str], Any] = {}
+		batches = self.filter(active=True).iter_batches(
+			fields=("application_id", "registration_id", "browser", "auth", "p256dh")
+		)
+		error = None
+		for batch in batches:
+			batch.sort(key=_application_id)
+			for app_id, group in groupby(batch, key=attrgetter("application_id")):
+				group = list(group)
+				application = applications.get(app_id)
+				if application is None:
+					application = applications[app_id] = get_webpush_application(app_id)
+				try:
+					with metrics.timed("batch", "batch_latency", platform="WP"):
+						if SETTINGS["WP_HTTP2"]:
+							from .webpush_async import get_session
+
+							results = get_session().send(group, message, application, **kwargs)
+						else:
+							results = bulk_map(
+								application.limiter,
+								lambda device: _webpush_send(device, message, application, **kwargs),
+								group,
+							)
+				except WebPushError as e:
+					# the other devices are still sent to
+					error = error or e
+					pks = {device.registration_id: device.pk for device in group}
+					for result, is_expired in getattr(e, "results", []):
+						res.append(result)
+						if is_expired:
+							expired.append(pks[result["results"][0]["original_registration_id"]])
+					continue
+				for device, (result, is_expired) in zip(group, results):
+					res.append(result)
+					if is_expired:
+						expired.append(device.pk)
+
+		if expired:
+			with metrics.span("deactivate", platform="WP"):
+				self.model.objects.filter(pk__in=expired).update(active=False)
+			metrics.increment("deactivated", len(expired), platform="WP")
+
+		if error is not None:
+			error.results = res
+			raise error
 		return res
 
 
@@ -272,7 +551,196 @@ class WebPushDevice(Device):
 	def device_id(self) -> None:
 		return None
 
+	@idempotent
 	def send_message(self, message: Any, **kwargs: Any) -> Any:
 		from .webpush import webpush_send_message
 
 		return webpush_send_message(self, message, **kwargs)
+
+
+class Application(models.Model):
+	"""
+	A push notification enabled application, read by
+	push_notifications.conf.AppModelConfig.
+	"""
+
+	application_id = models.CharField(
+		max_length=64, verbose_name=_("Application ID"), unique=True
+	)
+	platform = models.CharField(
+		max_length=4, verbose_name=_("Platform"), choices=PLATFORM_TYPES
+	)
+	settings = models.TextField(
+		verbose_name=_("Settings"), blank=True, default="{}",
+		help_text=_(
+			"JSON object with the platform settings, the same keys as an entry of"
+			' PUSH_NOTIFICATIONS_SETTINGS["APPLICATIONS"]'
+		)
+	)
+	active = models.BooleanField(
+		verbose_name=_("Is active"), default=True,
+		help_text=_("Inactive applications can not send notifications")
+	)
+	date_created = models.DateTimeField(verbose_name=_("Creation date"), auto_now_add=True)
+	date_modified = models.DateTimeField(verbose_name=_("Modification date"), auto_now=True)
+
+	class Meta:
+		verbose_name = _("Application")
+
+	def __str__(self) -> str:
+		return "{} ({})".format(self.application_id, self.platform)
+
+	def get_config(self) -> Dict[str, Any]:
+		"""The application config, in the PUSH_NOTIFICATIONS_SETTINGS["APPLICATIONS"] format."""
+		config = json.loads(self.settings or "{}")
+		config["PLATFORM"] = self.platform
+		return config
+
+	def clean(self) -> None:
+		from django.core.exceptions import ImproperlyConfigured, ValidationError
+		from .conf import AppConfig
+
+		try:
+			settings = json.loads(self.settings or "{}")
+		except ValueError as e:
+			raise ValidationError({"settings": str(e)})
+		if not isinstance(settings, dict):
+			raise ValidationError({"settings": _("Settings must be a JSON object.")})
+		config = self.get_config()
+		try:
+			AppConfig({"APPLICATIONS": {self.application_id: config}})
+		except ImproperlyConfigured as e:
+			raise ValidationError({"settings": str(e)})
+
+
+class ScheduledPush(models.Model):
+	"""
+	A notification to send to all active devices of a platform (and
+	application) at a given time, see push_notifications.scheduling.
+	"""
+
+	PENDING = "pending"
+	RUNNING = "running"
+	DONE = "done"
+	CANCELLED = "cancelled"
+	STATUSES = (
+		(PENDING, _("Pending")),
+		(RUNNING, _("Running")),
+		(DONE, _("Done")),
+		(CANCELLED, _("Cancelled")),
+	)
+
+	platform = models.CharField(
+		max_length=4, verbose_name=_("Platform"), choices=PLATFORM_TYPES
+	)
+	application_id = models.CharField(
+		max_length=64, verbose_name=_("Application ID"), blank=True, null=True,
+		help_text=_("Only send to the devices of this application")
+	)
+	message = models.TextField(verbose_name=_("Message"))
+	options = models.TextField(
+		verbose_name=_("Options"), blank=True, default="{}",
+		help_text=_("JSON object of keyword arguments for send_message()")
+	)
+	send_at = models.DateTimeField(verbose_name=_("Send at"), db_index=True)
+	local_time = models.BooleanField(
+		verbose_name=_("Local time"), default=False,
+		help_text=_(
+			"Deliver at the wall clock time of send_at (read as UTC) in the time"
+			" zone of each device"
+		)
+	)
+	window = models.PositiveIntegerField(
+		verbose_name=_("Window"), default=0,
+		help_text=_("Spread the delivery of each time zone over this many seconds")
+	)
+	jitter = models.PositiveIntegerField(
+		verbose_name=_("Jitter"), default=0,
+		help_text=_("Delay each slice of devices by up to this many random seconds")
+	)
+	status = models.CharField(
+		max_length=10, verbose_name=_("Status"), choices=STATUSES, default=PENDING,
+		db_index=True
+	)
+	recipients = models.PositiveIntegerField(verbose_name=_("Recipients"), default=0)
+	date_created = models.DateTimeField(verbose_name=_("Creation date"), auto_now_add=True)
+
+	class Meta:
+		verbose_name = _("Scheduled push")
+
+	def __str__(self) -> str:
+		return "{} push at {}".format(self.platform, self.send_at)
+
+	def get_options(self) -> Dict[str, Any]:
+		return json.loads(self.options or "{}")
+
+
+class ScheduledPushBucket(models.Model):
+	"""The devices of a ScheduledPush sharing a UTC offset."""
+
+	scheduled_push = models.ForeignKey(
+		ScheduledPush, related_name="buckets", on_delete=models.CASCADE
+	)
+	utc_offset = models.IntegerField(verbose_name=_("UTC offset"), help_text=_("In minutes"))
+	release_at = models.DateTimeField(verbose_name=_("Release at"), db_index=True)
+	slices = models.PositiveIntegerField(verbose_name=_("Slices"), default=1)
+	next_slice = models.PositiveIntegerField(verbose_name=_("Next slice"), default=0)
+
+	class Meta:
+		verbose_name = _("Scheduled push bucket")
+		unique_together = ("scheduled_push", "utc_offset")
+
+	def __str__(self) -> str:
+		return "{} (UTC{:+d}min)".format(self.scheduled_push, self.utc_offset)
+
+	@property
+	def done(self) -> bool:
+		return self.next_slice >= self.slices
+
+
+class SendJob(models.Model):
+	"""
+	A notification sent to a selection of devices in the background, see
+	push_notifications.jobs.
+	"""
+
+	PENDING = "pending"
+	RUNNING = "running"
+	DONE = "done"
+	FAILED = "failed"
+	STATUSES = (
+		(PENDING, _("Pending")),
+		(RUNNING, _("Running")),
+		(DONE, _("Done")),
+		(FAILED, _("Failed")),
+	)
+
+	device_model = models.CharField(max_length=100, verbose_name=_("Device model"))
+	message = models.TextField(verbose_name=_("Message"))
+	bulk = models.BooleanField(verbose_name=_("Bulk"), default=True)
+	status = models.CharField(
+		max_length=10, verbose_name=_("Status"), choices=STATUSES, default=PENDING
+	)
+	total = models.PositiveIntegerField(verbose_name=_("Total"), default=0)
+	sent = models.PositiveIntegerField(verbose_name=_("Sent"), default=0)
+	failed = models.PositiveIntegerField(verbose_name=_("Failed"), default=0)
+	deactivated = models.PositiveIntegerField(verbose_name=_("Deactivated"), default=0)
+	errors = models.TextField(verbose_name=_("Errors"), blank=True, default="[]")
+	date_created = models.DateTimeField(verbose_name=_("Creation date"), auto_now_add=True)
+	date_finished = models.DateTimeField(verbose_name=_("Finish date"), blank=True, null=True)
+	date_heartbeat = models.DateTimeField(
+		verbose_name=_("Last progress"), blank=True, null=True
+	)
+
+	class Meta:
+		verbose_name = _("Send job")
+
+	def __str__(self) -> str:
+		return "{} job {}".format(self.device_model, self.pk)
+
+	@property
+	def processed(self) -> int:
+		return self.sent + self.failed
+
+	def get_errors(self) -> List[str]:
+		return json.loads(self.errors or "[]")
@@ -0,0 +1,154 @@
+"""
+Payload size checks, run once per message before it is sent to any device.
+
+Providers reject oversized payloads for every recipient: APNs and FCM accept
+4KB, WNS 5KB and push services 4KB of WebPush record, after the aes128gcm
+encryption overhead. The encoded size of a message is checked against these
+limits before a send, which raises PayloadTooLarge instead of failing for
+every device. With PUSH_NOTIFICATIONS_SETTINGS["PAYLOAD_TRUNCATE"], the alert
+or body text is truncated, on a UTF-8 character boundary, to fit instead.
+"""
+
+import json
+from copy import copy
+from typing import Any, Callable, Dict, Optional, Union
+
+from . import metrics
+from .exceptions import PayloadTooLarge
+from .settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
+
+
+PAYLOAD_LIMITS = {"APNS": 4096, "FCM": 4096, "WNS": 5120, "WP": 4096}
+
+# aes128gcm (RFC 8188): a header of salt (16), record size (4), key id length
+# (1) and the 65 byte server key, a padding delimiter and a 16 byte tag
+WEBPUSH_ENCRYPTION_OVERHEAD = 16 + 4 + 1 + 65 + 1 + 16
+
+ELLIPSIS = "…"
+
+
+def apns_size(message: Dict[str, Any]) -> int:
+	"""The size of an APNs payload dict, as encoded by aioapns."""
+	return len(json.dumps(message, ensure_ascii=False).encode())
+
+
+def fcm_size(message: Any) -> int:
+	"""The size of a messaging.Message, without its token."""
+	from firebase_admin._messaging_encoder import MessageEncoder
+
+	# encoded as sent to a single token, which is not counted
+	message = copy(message)
+	message.token, message.topic, message.condition = "-", None, None
+	encoded = MessageEncoder().default(message)
+	del encoded["token"]
+	return len(json.dumps(encoded, ensure_ascii=False, separators=(",", ":")).encode())
+
+
+def wns_size(data: Union[str, bytes]) -> int:
+	return len(data.encode() if isinstance(data, str) else data)
+
+
+def webpush_size(data: Union[str, bytes, None]) -> int:
+	"""The size of a WebPush record carrying data."""
+	if not data:
+		return 0
+	return len(data.encode() if isinstance(data, str) else data) + WEBPUSH_ENCRYPTION_OVERHEAD
+
+
+def check_size(platform: str, size: int) -> None:
+	""":raises PayloadTooLarge: If size exceeds the limit of the platform."""
+	limit = PAYLOAD_LIMITS[platform]
+	if size > limit:
+		metrics.increment("payload_too_large", platform=platform)
+		raise PayloadTooLarge(platform, size, limit)
+
+
+def truncate_text(text: str, max_bytes: int) -> str:
+	"""
+	Truncates text to at most max_bytes UTF-8 bytes, ellipsis included,
+	without splitting a character.
+	"""
+	if len(text.encode()) <= max_bytes:
+		return text
+	keep = max_bytes - len(ELLIPSIS.encode())
+	if keep <= 0:
+		return ""
+	return text.encode()[:keep].decode("utf-8", "ignore") + ELLIPSIS
+
+
+def fit_text(
+	platform: str, text: Optional[str], size_of: Callable[[Optional[str]], int]
+) -> Optional[str]:
+	"""
+	Returns text if size_of(text), the size of the payload carrying it, fits
+	the platform limit. Otherwise, with PAYLOAD_TRUNCATE, returns text
+	truncated until the payload fits.
+
+	:raises PayloadTooLarge: If the payload does not fit.
+	"""
+	size = size_of(text)
+	limit = PAYLOAD_LIMITS[platform]
+	if size <= limit:
+		return text
+	if not SETTINGS["PAYLOAD_TRUNCATE"] or not text or not isinstance(text, str):
+		check_size(platform, size)
+	base = size_of("")
+	if base > limit:
+		# the rest of the payload is too large on its own
+		check_size(platform, size)
+	while size > limit:
+		# the text can be repeated or escaped in the payload
+		text_size = len(text.encode())
+		max_bytes = min(int((limit - base) * text_size / (size - base)), text_size - 1)
+		text = truncate_text(text, max_bytes)
+		size = size_of(text)
+	metrics.increment("payload_truncated", platform=platform)
+	return text
+
+
+def fit_fcm_message(message: Any) -> Any:
+	"""
+	Checks the size of a messaging.Message, and truncates the body of its
+	notification and Android notification if needed and enabled.
+	"""
+	android = message.android
+	body = None
+	if android is not None and android.notification is not None:
+		body = android.notification.body
+	if body is None and message.notification is not None:
+		body = message.notification.body
+
+	def with_body(body: Optional[str]) -> Any:
+		fitted = copy(message)
+		if android is not None and android.notification is not None:
+			fitted.android = copy(android)
+			fitted.android.notification = copy(android.notification)
+			fitted.android.notification.body = body
+		if message.notification is not None:
+			fitted.notification = copy(message.notification)
+			fitted.notification.body = body
+		return fitted
+
+	fitted_body = fit_text("FCM", body, lambda body: fcm_size(with_body(body)))
+	return message if fitted_body == body else with_body(fitted_body)
+
+
+def fit_webpush_message(message: Any) -> Any:
+	"""
+	Checks the size of a WebPush message, and truncates it if needed and
+	enabled: the "body" of a JSON notification, or else the plain text.
+	"""
+	if not isinstance(message, str):
+		check_size("WP", webpush_size(message))
+		return message
+	try:
+		notification = json.loads(message)
+	except ValueError:
+		notification = None
+	if isinstance(notification, dict) and isinstance(notification.get("body"), str):
+		def dump(body: Optional[str]) -> str:
+			return json.dumps(dict(notification, body=body))
+
+		body = fit_text("WP", notification["body"], lambda body: webpush_size(dump(body)))
+		return message if body == notification["body"] else dump(body)
+	return fit_text("WP", message, webpush_size)
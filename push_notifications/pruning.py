@@ -0,0 +1,128 @@
+"""
+Pruning of duplicate and stale devices, used by the push_prune command.
+
+Devices are only deactivated when a provider rejects them during a send and
+are never deleted, and without UNIQUE_REG_ID the same registration id can be
+stored in many rows, each of them sent to. duplicate_devices() and
+stale_devices() select the rows to remove, validate_fcm_devices() finds dead
+FCM tokens with dry run sends, and prune_devices() deletes the selected rows in
+batches, optionally archiving them first in the push_devices export format.
+"""
+
+import datetime
+from itertools import groupby
+from operator import attrgetter
+from typing import IO, Any, List, Optional
+
+import django
+from django.db.models import Exists, F, OuterRef, Q, QuerySet, Subquery, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from .models import GCMDevice
+from .transfer import IMPORT_BATCH_SIZE, export_devices
+
+
+def duplicate_devices(model: Any) -> QuerySet:
+	"""
+	The devices whose registration id is also used by another device of the
+	same application. One row is kept per registration id: the newest active
+	one, or the newest one if none is active.
+
+	The duplicates are selected with a subquery, so nothing is loaded until
+	the queryset is evaluated and each batch of a prune stays a single query.
+	"""
+	if django.VERSION >= (4, 2):
+		ranked = model.objects.annotate(rank=Window(
+			RowNumber(),
+			partition_by=[F("registration_id"), F("application_id")],
+			order_by=[F("active").desc(), F("pk").desc()],
+		))
+		return model.objects.filter(pk__in=Subquery(ranked.filter(rank__gt=1).values("pk")))
+
+	# window functions can only be filtered on since Django 4.2: look for a
+	# device ranked before this one instead
+	kept = model.objects.filter(registration_id=OuterRef("registration_id")).filter(
+		Q(active__gt=OuterRef("active")) | Q(active=OuterRef("active"), pk__gt=OuterRef("pk"))
+	)
+	return model.objects.annotate(
+		kept_in_application=Exists(kept.filter(application_id=OuterRef("application_id"))),
+		kept_without_application=Exists(kept.filter(application_id__isnull=True)),
+	).filter(
+		Q(application_id__isnull=False, kept_in_application=True)
+		| Q(application_id__isnull=True, kept_without_application=True)
+	)
+
+
+def stale_devices(
+	model: Any, days: int, now: Optional[datetime.datetime] = None
+) -> QuerySet:
+	"""
+	The inactive devices created more than `days` days ago. Devices do not
+	record when they were deactivated, so this is an upper bound of the time
+	they have been inactive.
+	"""
+	now = now or timezone.now()
+	return model.objects.filter(
+		active=False, date_created__lt=now - datetime.timedelta(days=days)
+	)
+
+
+def prune_devices(
+	queryset: QuerySet,
+	platform: str,
+	archive: Optional[IO[str]] = None,
+	format: str = "ndjson",
+	batch_size: int = IMPORT_BATCH_SIZE,
+) -> int:
+	"""
+	Deletes the devices of queryset in batches, after writing them to archive
+	if given.
+
+	:return: The number of devices deleted.
+	"""
+	model = queryset.model
+
+	def delete(batch: List[Any]) -> None:
+		model.objects.filter(pk__in=[row.pk for row in batch]).delete()
+
+	if archive is not None:
+		return export_devices(queryset, platform, archive, format, batch_size, on_batch=delete)
+	count = 0
+	for batch in queryset.iter_batches(batch_size, fields=()):
+		delete(batch)
+		count += len(batch)
+	return count
+
+
+def validate_fcm_devices(
+	queryset: Optional[QuerySet] = None, batch_size: int = IMPORT_BATCH_SIZE
+) -> int:
+	"""
+	Sends an empty message with dry_run=True to the active FCM devices of
+	queryset, so FCM validates their registration ids without delivering
+	anything, and deactivates the devices it rejects.
+
+	:return: The number of devices deactivated.
+	"""
+	from firebase_admin import messaging
+
+	from .gcm import send_message
+
+	if queryset is None:
+		queryset = GCMDevice.objects.all()
+	deactivated = 0
+	batches = queryset.filter(active=True).iter_batches(
+		batch_size, fields=("registration_id", "application_id")
+	)
+	for batch in batches:
+		batch.sort(key=lambda row: row.application_id or "")
+		for application_id, rows in groupby(batch, attrgetter("application_id")):
+			registration_ids = [row.registration_id for row in rows]
+			send_message(
+				registration_ids, messaging.Message(), application_id=application_id, dry_run=True
+			)
+			deactivated += len(registration_ids) - GCMDevice.objects.filter(
+				registration_id__in=registration_ids, active=True
+			).count()
+	return deactivated
@@ -0,0 +1,202 @@
+"""
+Scheduled and time zone aware delivery of ScheduledPush notifications.
+
+A ScheduledPush is planned shortly before it is due: its devices are grouped
+in one ScheduledPushBucket per UTC offset, released at send_at (or, for
+local_time pushes, at the wall clock time of send_at in that offset). Each
+bucket is split into slices of devices (pk modulo the number of slices) that
+are spread over the push window, plus an optional jitter, so a large audience
+does not hit the providers, nor the application servers the notification
+links to, all at once.
+
+dispatch_scheduled() is run periodically, e.g. by the push_dispatch management
+command. It sends the due slices through the usual queryset send_message().
+The slices are claimed first, in a short transaction locking their bucket, and
+sent after it is committed, so several dispatchers can run at once and a
+slice is sent at most once.
+"""
+
+import datetime
+import logging
+import random
+from typing import Optional, Tuple, Type
+
+from django.db import connection, transaction
+from django.db.models import F, Q, QuerySet
+from django.db.models.functions import Mod
+from django.utils import timezone
+
+from . import metrics
+from .exceptions import NotificationError
+from .models import (
+	APNSDevice, Device, GCMDevice, ScheduledPush, ScheduledPushBucket, WebPushDevice, WNSDevice
+)
+from .settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
+
+
+logger = logging.getLogger(__name__)
+
+DEVICE_MODELS = {
+	"APNS": APNSDevice,
+	"FCM": GCMDevice,
+	"WNS": WNSDevice,
+	"WP": WebPushDevice,
+}
+
+# The earliest time zone, UTC+14:00
+MAX_UTC_OFFSET = datetime.timedelta(hours=14)
+
+
+def device_model(platform: str) -> Type[Device]:
+	return DEVICE_MODELS[platform]
+
+
+def _lock(queryset: QuerySet) -> QuerySet:
+	if connection.features.has_select_for_update_skip_locked:
+		return queryset.select_for_update(skip_locked=True)
+	return queryset.select_for_update()
+
+
+def get_devices(push: ScheduledPush) -> QuerySet:
+	"""The active devices a ScheduledPush is sent to."""
+	devices = device_model(push.platform).objects.filter(active=True)
+	if push.application_id:
+		devices = devices.filter(application_id=push.application_id)
+	return devices
+
+
+def _offset_field(push: ScheduledPush) -> Optional[str]:
+	return SETTINGS["SCHEDULE_UTC_OFFSET_FIELD"] if push.local_time else None
+
+
+def get_bucket_devices(bucket: ScheduledPushBucket) -> QuerySet:
+	"""The devices of a bucket; devices without a known offset count as UTC."""
+	devices = get_devices(bucket.scheduled_push)
+	field = _offset_field(bucket.scheduled_push)
+	if field:
+		condition = Q(**{field: bucket.utc_offset})
+		if bucket.utc_offset == 0:
+			condition |= Q(**{field + "__isnull": True})
+		devices = devices.filter(condition)
+	return devices
+
+
+def get_slice_devices(bucket: ScheduledPushBucket, index: int) -> QuerySet:
+	devices = get_bucket_devices(bucket)
+	if bucket.slices > 1:
+		devices = devices.annotate(_slice=Mod("pk", bucket.slices)).filter(_slice=index)
+	return devices
+
+
+def slice_time(bucket: ScheduledPushBucket, index: int) -> datetime.datetime:
+	"""When a slice of a bucket is due: spread over the window, plus jitter."""
+	push = bucket.scheduled_push
+	delay = push.window * index / bucket.slices
+	if push.jitter:
+		seed = "{}:{}:{}".format(push.pk, bucket.utc_offset, index)
+		delay += random.Random(seed).uniform(0, push.jitter)
+	return bucket.release_at + datetime.timedelta(seconds=delay)
+
+
+def plan(push: ScheduledPush) -> None:
+	"""Creates the buckets of a pending ScheduledPush and marks it running."""
+	field = _offset_field(push)
+	if field:
+		offsets = {
+			offset or 0 for offset in get_devices(push).values_list(field, flat=True).distinct()
+		}
+	else:
+		offsets = {0}
+	slices = max(1, push.window // SETTINGS["SCHEDULE_SLICE_SECONDS"])
+
+	ScheduledPushBucket.objects.bulk_create([
+		ScheduledPushBucket(
+			scheduled_push=push,
+			utc_offset=offset,
+			release_at=push.send_at - datetime.timedelta(minutes=offset),
+			slices=slices,
+		)
+		for offset in sorted(offsets)
+	])
+	push.status = ScheduledPush.RUNNING
+	push.save(update_fields=["status"])
+
+
+def _plan_due(now: datetime.datetime) -> None:
+	due = Q(local_time=False, send_at__lte=now) | Q(
+		local_time=True, send_at__lte=now + MAX_UTC_OFFSET
+	)
+	with transaction.atomic():
+		for push in _lock(ScheduledPush.objects.filter(due, status=ScheduledPush.PENDING)):
+			plan(push)
+
+
+def _send_slice(bucket: ScheduledPushBucket, index: int) -> None:
+	push = bucket.scheduled_push
+	devices = get_slice_devices(bucket, index)
+	count = devices.count()
+	if not count:
+		return
+	try:
+		with metrics.span("scheduled_slice", platform=push.platform):
+			devices.send_message(push.message, **push.get_options())
+	except NotificationError:
+		logger.exception(
+			"Error sending slice %d of scheduled push %d (UTC%+dmin)",
+			index, push.pk, bucket.utc_offset,
+		)
+		metrics.increment("scheduled_slice_failed", platform=push.platform)
+		return
+	ScheduledPush.objects.filter(pk=push.pk).update(recipients=F("recipients") + count)
+
+
+def _claim_slices(
+	bucket_id: int, now: datetime.datetime
+) -> Tuple[Optional[ScheduledPushBucket], range]:
+	"""
+	Advances next_slice of a bucket past its due slices, in a transaction of
+	its own, so no other dispatcher sends them, and returns them.
+	"""
+	with transaction.atomic():
+		unlocked = ScheduledPushBucket.objects.filter(pk=bucket_id, next_slice__lt=F("slices"))
+		bucket = _lock(unlocked).first()
+		if bucket is None:
+			# done, or locked by another dispatcher
+			return None, range(0)
+		first = bucket.next_slice
+		while not bucket.done and slice_time(bucket, bucket.next_slice) <= now:
+			bucket.next_slice += 1
+		if bucket.next_slice > first:
+			bucket.save(update_fields=["next_slice"])
+	return bucket, range(first, bucket.next_slice)
+
+
+def dispatch_scheduled(now: Optional[datetime.datetime] = None) -> int:
+	"""
+	Plans the scheduled pushes coming due and sends the due slices.
+
+	:param now: The current time, for tests.
+	:returns: The number of slices sent.
+	"""
+	now = now or timezone.now()
+	_plan_due(now)
+
+	sent = 0
+	buckets = ScheduledPushBucket.objects.filter(
+		scheduled_push__status=ScheduledPush.RUNNING,
+		release_at__lte=now,
+		next_slice__lt=F("slices"),
+	).order_by("release_at")
+	for bucket_id in buckets.values_list("pk", flat=True):
+		# sent outside of the lock: a slice is claimed before it is sent, and
+		# never sent twice, even if sending it fails
+		bucket, indexes = _claim_slices(bucket_id, now)
+		for index in indexes:
+			_send_slice(bucket, index)
+			sent += 1
+
+	unfinished = ScheduledPushBucket.objects.filter(next_slice__lt=F("slices"))
+	ScheduledPush.objects.filter(status=ScheduledPush.RUNNING).exclude(
+		pk__in=unfinished.values("scheduled_push")
+	).update(status=ScheduledPush.DONE)
+	return sent
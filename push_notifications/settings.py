@@ -51,3 +51,62 @@ PUSH_NOTIFICATIONS_SETTINGS.setdefault("UNIQUE_REG_ID", False)
 
 # API endpoint settings
 PUSH_NOTIFICATIONS_SETTINGS.setdefault("UPDATE_ON_DUPLICATE_REG_ID", False)
+
+# Adaptive concurrency limits for bulk sends, per platform. e.g.:
+# {"APNS": {"INITIAL_LIMIT": 100, "MIN_LIMIT": 1, "MAX_LIMIT": 1000}}
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("CONCURRENCY", {})
+
+# Metrics / tracing backend, see push_notifications.metrics
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("METRICS_BACKEND", None)
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("METRICS_OPTIONS", {})
+
+# Delivery transport replacing the provider requests, see push_notifications.transports
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("TRANSPORT", None)
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("TRANSPORT_OPTIONS", {})
+
+# Seconds between checks for applications changed by other processes, see
+# push_notifications.conf.AppModelConfig
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("APP_MODEL_REFRESH_INTERVAL", 5)
+
+# Defer loading the configuration manager and reading credential files to
+# their first use, for faster startup
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("LAZY_LOADING", False)
+
+# Scheduled delivery, see push_notifications.scheduling. The device lookup
+# (e.g. "user__profile__utc_offset") giving the UTC offset of a device in
+# minutes, for ScheduledPush.local_time; None sends to all devices as UTC.
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("SCHEDULE_UTC_OFFSET_FIELD", None)
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("SCHEDULE_SLICE_SECONDS", 60)
+
+# Seconds without progress after which a SendJob is marked failed, see
+# push_notifications.jobs
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("SEND_JOB_TIMEOUT", 10 * 60)
+
+# Seconds coalesce() holds a notification, see push_notifications.coalescing
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("COALESCE_WINDOW", 2)
+
+# Sends with an idempotency_key, see push_notifications.idempotency
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("IDEMPOTENCY_CACHE", "default")
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("IDEMPOTENCY_TTL", 24 * 60 * 60)
+
+# Decoded WebPush subscriber keys kept in memory, see push_notifications.webpush
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("WP_KEY_CACHE_SIZE", 10000)
+
+# WebPush bulk sends over HTTP/2 with httpx, and the connections per push
+# service origin, see push_notifications.webpush_async
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("WP_HTTP2", False)
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("WP_HTTP2_MAX_CONNECTIONS", 4)
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("WP_HTTP2_ORIGIN_MAX_CONNECTIONS", {})
+
+# Device admin changelists for tables of millions of rows, see
+# push_notifications.changelist
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("ADMIN_LARGE_TABLES", False)
+
+# Multi-tenant bulk sends: the relative share of each application id, and the
+# registration ids per APNs chunk, see push_notifications.concurrency.fair_map
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("TENANT_WEIGHTS", {})
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("TENANT_CHUNK_SIZE", 1000)
+
+# Truncate the alert or body text of oversized payloads instead of raising
+# PayloadTooLarge, see push_notifications.payload
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("PAYLOAD_TRUNCATE", False)
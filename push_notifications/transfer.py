@@ -0,0 +1,274 @@
+"""
+Streaming export and import of devices, used by the push_devices command.
+
+Devices are written as NDJSON (one JSON object per line) or CSV, optionally
+gzipped, and read back in batches: export walks the table with
+DeviceQuerySet.iter_batches() and import validates and saves IMPORT_BATCH_SIZE
+rows at a time, so memory stays constant whatever the number of devices.
+Imported devices are matched to the existing ones on their registration id.
+"""
+
+import csv
+import gzip
+import io
+import json
+import sys
+import uuid
+from typing import (
+	Any, Callable, Dict, IO, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+)
+
+from django.db import connections, router, transaction
+
+from .fields import UNSIGNED_64BIT_INT_MAX_VALUE, HexIntegerField, hex_re
+from .models import APNSDevice, GCMDevice, WebPushDevice, WNSDevice
+
+
+IMPORT_BATCH_SIZE = 1000
+
+DEVICE_MODELS = {
+	"APNS": APNSDevice, "FCM": GCMDevice, "WNS": WNSDevice, "WP": WebPushDevice
+}
+
+FORMATS = ("ndjson", "csv")
+
+COMMON_FIELDS = ("registration_id", "name", "active", "user", "application_id")
+
+PLATFORM_FIELDS = {
+	"APNS": ("device_id",),
+	"FCM": ("device_id", "cloud_message_type"),
+	"WNS": ("device_id",),
+	"WP": ("p256dh", "auth", "browser"),
+}
+
+
+class ImportResult(NamedTuple):
+	created: int
+	updated: int
+	errors: List[Tuple[int, str]]
+
+
+def device_fields(platform: str) -> Tuple[str, ...]:
+	return COMMON_FIELDS + PLATFORM_FIELDS[platform]
+
+
+def guess_format(path: str) -> str:
+	"""The format of a file from its name, e.g. "devices.csv.gz" is "csv"."""
+	name = path[:-3] if path.endswith(".gz") else path
+	return "csv" if name.endswith(".csv") else "ndjson"
+
+
+def open_file(path: str, mode: str, compress: Optional[bool] = None) -> IO[str]:
+	"""
+	Opens path as text, gzipped if compress is True or, by default, if its
+	name ends with .gz. "-" is the standard input or output.
+	"""
+	if compress is None:
+		compress = path.endswith(".gz")
+	if path == "-":
+		stream = sys.stdin.buffer if mode == "r" else sys.stdout.buffer
+		if compress:
+			stream = gzip.GzipFile(fileobj=stream, mode=mode + "b")
+		return io.TextIOWrapper(stream, encoding="utf-8", newline="")
+	if compress:
+		return gzip.open(path, mode + "t", encoding="utf-8", newline="")
+	return open(path, mode, encoding="utf-8", newline="")
+
+
+def _dump_value(field: str, value: Any, model: Any) -> Any:
+	if value is None:
+		return None
+	if field == "device_id":
+		if isinstance(model._meta.get_field("device_id"), HexIntegerField):
+			return hex(value)
+		return str(value)
+	return value
+
+
+def export_devices(
+	queryset: Any,
+	platform: str,
+	stream: IO[str],
+	format: str = "ndjson",
+	batch_size: int = IMPORT_BATCH_SIZE,
+	on_batch: Optional[Callable[[List[Any]], None]] = None,
+) -> int:
+	"""
+	Writes the devices of queryset to stream.
+
+	:param on_batch: Called with each batch of rows once it is written.
+	:return: The number of devices written.
+	"""
+	fields = device_fields(platform)
+	attnames = ["user_id" if field == "user" else field for field in fields]
+	writer = None
+	if format == "csv":
+		writer = csv.writer(stream)
+		writer.writerow(fields)
+
+	count = 0
+	for batch in queryset.iter_batches(batch_size, fields=attnames):
+		for row in batch:
+			values = [
+				_dump_value(field, getattr(row, attname), queryset.model)
+				for field, attname in zip(fields, attnames)
+			]
+			if writer is None:
+				stream.write(json.dumps(dict(zip(fields, values)), separators=(",", ":")) + "\n")
+			else:
+				writer.writerow(["" if value is None else value for value in values])
+		if on_batch is not None:
+			on_batch(batch)
+		count += len(batch)
+	return count
+
+
+def read_rows(stream: IO[str], format: str = "ndjson") -> Iterator[Dict[str, Any]]:
+	if format == "csv":
+		for row in csv.DictReader(stream):
+			yield {key: (None if value == "" else value) for key, value in row.items()}
+		return
+	for line in stream:
+		if line.strip():
+			yield json.loads(line)
+
+
+def _parse_bool(value: Any) -> bool:
+	if isinstance(value, str):
+		return value.strip().lower() in ("1", "true", "yes")
+	return bool(value)
+
+
+def clean_row(platform: str, row: Dict[str, Any]) -> Dict[str, Any]:
+	"""
+	Validates an imported row with the rules of the REST API serializers and
+	returns the model field values.
+
+	:raises ValueError: If the row is invalid.
+	"""
+	registration_id = row.get("registration_id")
+	if not registration_id:
+		raise ValueError("registration_id is required")
+	values = {"registration_id": registration_id}
+	for field in device_fields(platform)[1:]:
+		if row.get(field) is not None:
+			values[field] = row[field]
+	values["active"] = _parse_bool(values.get("active", True))
+	if values.get("user") is not None:
+		values["user_id"] = int(values.pop("user"))
+	else:
+		values.pop("user", None)
+
+	if platform == "APNS" and hex_re.match(registration_id) is None:
+		raise ValueError("Registration ID (device token) is invalid")
+	device_id = values.get("device_id")
+	if device_id is not None:
+		if platform == "FCM":
+			if isinstance(device_id, str):
+				if hex_re.match(device_id) is None:
+					raise ValueError("Device ID is not a valid hex number")
+				device_id = int(device_id, 16)
+			if not 0 <= device_id <= UNSIGNED_64BIT_INT_MAX_VALUE:
+				raise ValueError("Device ID is out of range")
+			values["device_id"] = device_id
+		else:
+			values["device_id"] = uuid.UUID(str(device_id))
+	if platform == "WP":
+		from .webpush import decode_subscriber_keys
+
+		decode_subscriber_keys(values.get("p256dh") or "", values.get("auth") or "")
+	return values
+
+
+def _save_batch(
+	model: Any, fields: Sequence[str], rows: List[Dict[str, Any]]
+) -> Tuple[int, int]:
+	"""Creates or updates the devices of rows, by registration id."""
+	# the last row wins among duplicate registration ids
+	rows = list({row["registration_id"]: row for row in rows}.values())
+	using = router.db_for_write(model)
+	user_model = model._meta.get_field("user").related_model
+	user_ids = {row["user_id"] for row in rows if "user_id" in row}
+	if user_ids:
+		# users that do not exist in this database are dropped
+		users = user_model._default_manager.using(using).filter(pk__in=user_ids)
+		existing_users = set(users.values_list("pk", flat=True))
+		for row in rows:
+			if row.get("user_id") not in existing_users:
+				row.pop("user_id", None)
+
+	# only the fields present in a row are updated: those missing from the file,
+	# or whose user was dropped, keep the values of the existing device
+	attnames = [
+		"user_id" if field == "user" else field
+		for field in fields if field != "registration_id"
+	]
+	groups: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+	for row in rows:
+		update_fields = tuple(attname for attname in attnames if attname in row)
+		groups.setdefault(update_fields, []).append(row)
+
+	features = connections[using].features
+	unique = model._meta.get_field("registration_id").unique
+	if unique and getattr(features, "supports_update_conflicts_with_target", False):
+		existing = set(model.objects.using(using).filter(
+			registration_id__in=[row["registration_id"] for row in rows]
+		).values_list("registration_id", flat=True))
+		with transaction.atomic(using=using):
+			for update_fields, group in groups.items():
+				model.objects.using(using).bulk_create(
+					[model(**row) for row in group],
+					update_conflicts=True, unique_fields=["registration_id"], update_fields=update_fields,
+				)
+		return len(rows) - len(existing), len(existing)
+
+	pks: Dict[str, List[Any]] = {}
+	for pk, registration_id in model.objects.using(using).filter(
+		registration_id__in=[row["registration_id"] for row in rows]
+	).values_list("pk", "registration_id"):
+		pks.setdefault(registration_id, []).append(pk)
+	new = [model(**row) for row in rows if row["registration_id"] not in pks]
+	with transaction.atomic(using=using):
+		model.objects.using(using).bulk_create(new)
+		for update_fields, group in groups.items():
+			updated = [
+				model(pk=pk, **row) for row in group for pk in pks.get(row["registration_id"], ())
+			]
+			if updated:
+				model.objects.using(using).bulk_update(updated, update_fields)
+	return len(new), len(rows) - len(new)
+
+
+def import_devices(
+	platform: str,
+	rows: Iterable[Dict[str, Any]],
+	batch_size: int = IMPORT_BATCH_SIZE,
+) -> ImportResult:
+	"""
+	Creates the devices of rows, or updates those with the same registration
+	id. Invalid rows are skipped and reported with their 1-based row number.
+	"""
+	model = DEVICE_MODELS[platform]
+	fields = device_fields(platform)
+	created = updated = 0
+	errors: List[Tuple[int, str]] = []
+	batch: List[Dict[str, Any]] = []
+
+	def save() -> None:
+		nonlocal created, updated
+		batch_created, batch_updated = _save_batch(model, fields, batch)
+		created += batch_created
+		updated += batch_updated
+		batch.clear()
+
+	for number, row in enumerate(rows, 1):
+		try:
+			batch.append(clean_row(platform, row))
+		except (ValueError, TypeError) as e:
+			errors.append((number, str(e)))
+			continue
+		if len(batch) >= batch_size:
+			save()
+	if batch:
+		save()
+	return ImportResult(created, updated, errors)
@@ -0,0 +1,199 @@
+"""
+Pluggable delivery transports, to run the send pipeline without talking to
+Apple, Google, Microsoft or the browser vendors (load tests, staging).
+
+A transport is selected with PUSH_NOTIFICATIONS_SETTINGS["TRANSPORT"], or per
+application with the "TRANSPORT" key of an APPLICATIONS entry. The value is one
+of the built-in transports ("null", "latency", "capture") or the dotted path of
+a Transport subclass; "TRANSPORT_OPTIONS" is passed to its constructor. Without
+a transport, notifications go to the provider.
+
+A transport only replaces the provider request: payloads are still built, and
+the concurrency limiter, metrics and device deactivation behave as they do
+with the provider responses the transport simulates.
+"""
+
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from django.utils.module_loading import import_string
+
+from .conf import get_manager
+
+
+# Outcomes of a delivery, besides None (delivered). Each platform maps them to
+# its own "unregistered token" and "throttled" responses.
+UNREGISTERED = "unregistered"
+THROTTLED = "throttled"
+
+BUILTIN_TRANSPORTS = {
+	"null": "push_notifications.transports.NullTransport",
+	"latency": "push_notifications.transports.LatencyTransport",
+	"capture": "push_notifications.transports.CaptureTransport",
+}
+
+
+class Transport:
+	"""
+	Base class for transports. deliver() returns None if the notification was
+	delivered, or one of UNREGISTERED / THROTTLED.
+
+	:param platform: "APNS", "FCM", "WNS" or "WP"
+	:param token: The registration id, channel uri or subscription endpoint.
+	:param payload: The platform specific payload: a messaging.Message (FCM),
+		the APNs message dict, the WNS request body or the WebPush data.
+	"""
+
+	def deliver(
+		self, platform: str, application_id: Optional[str], token: str, payload: Any
+	) -> Optional[str]:
+		return None
+
+	def deliver_many(
+		self, platform: str, application_id: Optional[str], items: Iterable[Tuple[str, Any]]
+	) -> List[Optional[str]]:
+		"""Delivers (token, payload) pairs sent as a single request, e.g. an FCM batch."""
+		return [
+			self.deliver(platform, application_id, token, payload) for token, payload in items
+		]
+
+	async def deliver_async(
+		self, platform: str, application_id: Optional[str], token: str, payload: Any
+	) -> Optional[str]:
+		return self.deliver(platform, application_id, token, payload)
+
+
+class NullTransport(Transport):
+	"""Every notification is delivered instantly."""
+
+	pass
+
+
+class LatencyTransport(Transport):
+	"""
+	Simulates the provider round trip and a mix of errors.
+
+	:param latency: Round trip time, in seconds.
+	:param jitter: The latency varies uniformly by up to this many seconds.
+	:param error_rate: Share of notifications answered as unregistered tokens.
+	:param throttle_rate: Share of notifications answered as throttled.
+	:param seed: Seed of the random generator, for repeatable runs.
+	"""
+
+	def __init__(
+		self,
+		latency: float = 0.05,
+		jitter: float = 0.0,
+		error_rate: float = 0.0,
+		throttle_rate: float = 0.0,
+		seed: Optional[int] = None,
+	) -> None:
+		self.latency = latency
+		self.jitter = jitter
+		self.error_rate = error_rate
+		self.throttle_rate = throttle_rate
+		self._random = random.Random(seed)
+		self._lock = threading.Lock()
+
+	def _delay(self) -> float:
+		with self._lock:
+			return max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+
+	def _outcome(self) -> Optional[str]:
+		with self._lock:
+			r = self._random.random()
+		if r < self.error_rate:
+			return UNREGISTERED
+		if r < self.error_rate + self.throttle_rate:
+			return THROTTLED
+		return None
+
+	def deliver(
+		self, platform: str, application_id: Optional[str], token: str, payload: Any
+	) -> Optional[str]:
+		time.sleep(self._delay())
+		return self._outcome()
+
+	def deliver_many(
+		self, platform: str, application_id: Optional[str], items: Iterable[Tuple[str, Any]]
+	) -> List[Optional[str]]:
+		# one round trip for the whole request
+		time.sleep(self._delay())
+		return [self._outcome() for _ in items]
+
+	async def deliver_async(
+		self, platform: str, application_id: Optional[str], token: str, payload: Any
+	) -> Optional[str]:
+		await asyncio.sleep(self._delay())
+		return self._outcome()
+
+
+class CapturedMessage(NamedTuple):
+	platform: str
+	application_id: Optional[str]
+	token: str
+	payload: Any
+
+
+class CaptureTransport(Transport):
+	"""
+	Delivers every notification instantly and keeps the last `size` of them.
+
+	:param size: Capacity of the ring buffer.
+	"""
+
+	def __init__(self, size: int = 1000) -> None:
+		self._messages: deque = deque(maxlen=size)
+		self.count = 0
+
+	def deliver(
+		self, platform: str, application_id: Optional[str], token: str, payload: Any
+	) -> Optional[str]:
+		self._messages.append(CapturedMessage(platform, application_id, token, payload))
+		self.count += 1
+		return None
+
+	@property
+	def messages(self) -> List[CapturedMessage]:
+		"""The captured notifications, oldest first."""
+		return list(self._messages)
+
+	def clear(self) -> None:
+		self._messages.clear()
+		self.count = 0
+
+
+_transports: Dict[Tuple[Optional[str], str], Transport] = {}
+_transports_lock = threading.Lock()
+
+
+def get_transport(application_id: Optional[str] = None) -> Optional[Transport]:
+	"""
+	Returns the transport configured for application_id, or None if
+	notifications go to the provider. Instances are shared, so a
+	CaptureTransport can be inspected after a send.
+	"""
+	manager = get_manager()
+	path = manager.get_transport(application_id)
+	if not path:
+		return None
+	key = (application_id, path)
+	transport = _transports.get(key)
+	if transport is None:
+		with _transports_lock:
+			transport = _transports.get(key)
+			if transport is None:
+				transport_class = import_string(BUILTIN_TRANSPORTS.get(path, path))
+				transport = transport_class(**manager.get_transport_options(application_id))
+				_transports[key] = transport
+	return transport
+
+
+def reset_transports() -> None:
+	"""Drops the transport instances, e.g. after the settings changed."""
+	with _transports_lock:
+		_transports.clear()
@@ -1,9 +1,140 @@
+import base64
+import functools
+import os
+import time
 import warnings
+from urllib.parse import urlparse
 
-from pywebpush import WebPushException, webpush
-from typing import Dict, Any
+from cryptography.hazmat.primitives.asymmetric import ec
+from pywebpush import Vapid, Vapid01, WebPushException, WebPusher
+from requests import Response
+from requests.exceptions import Timeout
+from typing import Dict, Any, Mapping, NamedTuple, Optional, Tuple, Union
+from . import metrics
+from .concurrency import (
+	THROTTLE_STATUS_CODES, AdaptiveLimiter, get_limiter, parse_retry_after, url_origin
+)
 from .conf import get_manager
 from .exceptions import WebPushError
+from .payload import fit_webpush_message
+from .settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
+from .transports import THROTTLED, UNREGISTERED, Transport, get_transport
+
+
+class SubscriberKeys(NamedTuple):
+	public_key: ec.EllipticCurvePublicKey
+	auth: bytes
+
+
+def _b64decode(value: str) -> bytes:
+	value = value.strip()
+	return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+
+
+@functools.lru_cache(maxsize=SETTINGS["WP_KEY_CACHE_SIZE"])
+def decode_subscriber_keys(p256dh: str, auth: str) -> SubscriberKeys:
+	"""
+	Decodes and validates the keys of a push subscription. The most recent
+	ones are kept in an LRU cache, of under 1KB per entry, so the frequent
+	recipients skip the parsing; see decode_subscriber_keys.cache_info() for
+	the hits and misses.
+
+	:raises ValueError: If a key is malformed.
+	"""
+	try:
+		point = _b64decode(p256dh)
+		secret = _b64decode(auth)
+	except (TypeError, ValueError):
+		raise ValueError("The subscription keys must be base64url encoded")
+	if len(point) != 65 or point[0] != 4:
+		raise ValueError("p256dh must be an uncompressed P-256 point")
+	if len(secret) != 16:
+		raise ValueError("auth must be 16 bytes")
+	# raises ValueError if the point is not on the curve
+	public_key = ec.EllipticCurvePublicKey.from_encoded_point(ec.SECP256R1(), point)
+	return SubscriberKeys(public_key, secret)
+
+
+class _DecodedKeysWebPusher(WebPusher):
+	def __init__(
+		self, subscription_info: Dict[str, Any], keys: SubscriberKeys, **kwargs: Any
+	) -> None:
+		super().__init__({"endpoint": subscription_info["endpoint"]}, **kwargs)
+		# http_ece accepts the public key object as well as its encoded point
+		self.receiver_key = keys.public_key
+		self.auth_key = keys.auth
+
+
+def vapid_headers(
+	endpoint: str, vapid_private_key: Optional[Any], vapid_claims: Dict[str, Any]
+) -> Dict[str, str]:
+	"""
+	The VAPID Authorization headers for endpoint. The audience and expiry
+	are added to vapid_claims if missing or expired.
+
+	:raises WebPushException: If vapid_private_key is missing.
+	"""
+	if not vapid_claims.get("aud"):
+		url = urlparse(endpoint)
+		vapid_claims["aud"] = "{}://{}".format(url.scheme, url.netloc)
+	if int(vapid_claims.get("exp") or 0) < int(time.time()):
+		vapid_claims["exp"] = int(time.time()) + 12 * 60 * 60
+	if not vapid_private_key:
+		raise WebPushException("VAPID dict missing 'private_key'")
+	if isinstance(vapid_private_key, Vapid01):
+		vapid = vapid_private_key
+	elif os.path.isfile(vapid_private_key):
+		vapid = Vapid.from_file(private_key_file=vapid_private_key)
+	else:
+		vapid = Vapid.from_string(private_key=vapid_private_key)
+	return vapid.sign(vapid_claims)
+
+
+def webpush(
+	subscription_info: Dict[str, Any],
+	data: Optional[str] = None,
+	vapid_private_key: Optional[Any] = None,
+	vapid_claims: Optional[Dict[str, Any]] = None,
+	content_encoding: str = "aes128gcm",
+	curl: bool = False,
+	timeout: Optional[float] = None,
+	ttl: int = 0,
+	verbose: bool = False,
+	headers: Optional[Dict[str, Any]] = None,
+	requests_session: Optional[Any] = None,
+) -> Union[str, Response]:
+	"""
+	pywebpush.webpush(), with the same arguments, but the subscriber keys
+	from decode_subscriber_keys().
+
+	:raises WebPushException: For malformed keys and error responses.
+	"""
+	keys = subscription_info["keys"]
+	try:
+		subscriber_keys = decode_subscriber_keys(keys["p256dh"], keys["auth"])
+	except ValueError as e:
+		raise WebPushException(str(e))
+
+	headers = dict(headers or {})
+	if vapid_claims:
+		headers.update(
+			vapid_headers(subscription_info["endpoint"], vapid_private_key, vapid_claims)
+		)
+
+	pusher = _DecodedKeysWebPusher(
+		subscription_info, subscriber_keys, requests_session=requests_session, verbose=verbose
+	)
+	response = pusher.send(
+		data, headers, ttl=ttl, content_encoding=content_encoding, curl=curl, timeout=timeout
+	)
+	if not curl and response.status_code > 202:
+		raise WebPushException(
+			"Push failed: {} {}\nResponse body:{}".format(
+				response.status_code, response.reason, response.text
+			),
+			response=response,
+		)
+	return response
 
 
 def get_subscription_info(
@@ -32,49 +163,147 @@ def get_subscription_info(
 	}
 
 
-def webpush_send_message(device: Any, message: str, **kwargs: Any) -> Dict[str, Any]:
+def _transport_webpush(
+	transport: Transport,
+	application_id: str,
+	subscription_info: Dict[str, Any],
+	message: str,
+) -> Response:
+	outcome = transport.deliver("WP", application_id, subscription_info["endpoint"], message)
+	response = Response()
+	response.status_code = {UNREGISTERED: 410, THROTTLED: 429}.get(outcome, 201)
+	if not response.ok:
+		# the same exception pywebpush raises for error responses
+		raise WebPushException(
+			"Push failed: {} {}".format(response.status_code, outcome), response=response
+		)
+	return response
+
+
+class WebPushApplication(NamedTuple):
+	"""The settings of an application, resolved once for all its subscriptions."""
+
+	application_id: Optional[str]
+	vapid_private_key: Optional[str]
+	vapid_claims: Optional[Mapping[str, Any]]
+	timeout: Optional[int]
+	limiter: AdaptiveLimiter
+	transport: Optional[Transport]
+
+
+def get_webpush_application(application_id: Optional[str]) -> WebPushApplication:
+	manager = get_manager()
+
+	vapid_private_key = None
+	if hasattr(manager, "get_wp_private_key"):
+		vapid_private_key = manager.get_wp_private_key(application_id)
+
+	vapid_claims = None
+	if hasattr(manager, "get_wp_claims"):
+		vapid_claims = manager.get_wp_claims(application_id)
+
+	timeout = None
+	if hasattr(manager, "get_wp_error_timeout"):
+		timeout = manager.get_wp_error_timeout(application_id)
+
+	return WebPushApplication(
+		application_id, vapid_private_key, vapid_claims, timeout,
+		get_limiter("WP", application_id), get_transport(application_id),
+	)
+
+
+def _webpush_send(
+	subscription: Any,
+	message: str,
+	application: Optional[WebPushApplication] = None,
+	**kwargs: Any
+) -> Tuple[Dict[str, Any], bool]:
+	"""
+	Sends a WebPush message to one subscription, without touching the database.
+
+	:param subscription: A WebPushDevice, or any record with its application_id,
+		registration_id, browser, auth and p256dh attributes.
+	:param application: The settings of the subscription's application, see
+		get_webpush_application(); resolved if not given.
+	:return: The results dict, and whether the subscription has expired.
+	"""
+	application_id = subscription.application_id
+	registration_id = subscription.registration_id
+	if application is None:
+		application = get_webpush_application(application_id)
 	subscription_info = get_subscription_info(
-		device.application_id,
-		device.registration_id,
-		device.browser,
-		device.auth,
-		device.p256dh,
+		application_id, registration_id, subscription.browser, subscription.auth,
+		subscription.p256dh
 	)
+	limiter = application.limiter
+	transport = application.transport
 	try:
-		results = {"results": [{"original_registration_id": device.registration_id}]}
-		manager = get_manager()
+		results = {"results": [{"original_registration_id": registration_id}]}
+		# pywebpush adds the audience and expiry to the claims it is given
+		vapid_claims = None
+		if application.vapid_claims is not None:
+			vapid_claims = dict(application.vapid_claims)
 
-		vapid_private_key = None
-		if hasattr(manager, "get_wp_private_key"):
-			vapid_private_key = manager.get_wp_private_key(device.application_id)
+		if metrics.enabled() and message:
+			data = message.encode() if isinstance(message, str) else message
+			metrics.observe("payload_bytes", len(data), platform="WP")
+
+		with limiter.slot(), metrics.span("request", platform="WP"):
+			start = time.monotonic()
+			try:
+				if transport is None:
+					response = webpush(
+						subscription_info=subscription_info,
+						data=message,
+						vapid_private_key=application.vapid_private_key,
+						vapid_claims=vapid_claims,
+						timeout=kwargs.pop("timeout", application.timeout),
+						**kwargs,
+					)
+				else:
+					response = _transport_webpush(
+						transport, application_id, subscription_info, message
+					)
+			except Timeout:
+				limiter.record_timeout()
+				raise
+			except WebPushException as e:
+				if e.response is not None and e.response.status_code in THROTTLE_STATUS_CODES:
+					limiter.record_throttle(
+						parse_retry_after(e.response.headers.get("Retry-After"))
+					)
+				raise
+			latency = time.monotonic() - start
+			limiter.record_success(latency, url_origin(subscription_info["endpoint"]))
+			metrics.observe("request_latency", latency, platform="WP")
 
-		vapid_claims = None
-		if hasattr(manager, "get_wp_claims"):
-			vapid_claims = manager.get_wp_claims(device.application_id).copy()
-
-		timeout = None
-		if hasattr(manager, "get_wp_error_timeout"):
-			timeout = manager.get_wp_error_timeout(device.application_id)
-
-		response = webpush(
-			subscription_info=subscription_info,
-			data=message,
-			vapid_private_key=vapid_private_key,
-			vapid_claims=vapid_claims,
-			timeout=timeout,
-			**kwargs,
-		)
 		if response.ok:
 			results["success"] = 1
+			metrics.increment("sent", platform="WP")
 		else:
 			results["failure"] = 1
 			results["results"][0]["error"] = response.content
-		return results
+			metrics.increment("failed", platform="WP", reason="HTTP %i" % response.status_code)
+		return results, False
 	except WebPushException as e:
+		status_code = e.response.status_code if e.response is not None else None
+		metrics.increment(
+			"failed", platform="WP",
+			reason="HTTP %i" % status_code if status_code else "WebPushException"
+		)
 		if e.response is not None and e.response.status_code in [404, 410]:
 			results["failure"] = 1
 			results["results"][0]["error"] = e.message
+			return results, True
+		raise WebPushError(e.message)
+
+
+def webpush_send_message(device: Any, message: str, **kwargs: Any) -> Dict[str, Any]:
+	message = fit_webpush_message(message)
+	results, expired = _webpush_send(device, message, **kwargs)
+	if expired:
+		with metrics.span("deactivate", platform="WP"):
 			device.active = False
 			device.save()
-			return results
-		raise WebPushError(e.message)
+		metrics.increment("deactivated", platform="WP")
+	return results
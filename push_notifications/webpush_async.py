@@ -0,0 +1,345 @@
+"""
+WebPush delivery over HTTP/2, used by WebPushDeviceQuerySet.send_message()
+when PUSH_NOTIFICATIONS_SETTINGS["WP_HTTP2"] is set.
+
+pywebpush posts every message with a blocking HTTP/1.1 request, while the
+subscriptions of a browser all share one push service (fcm.googleapis.com for
+Chrome, updates.push.services.mozilla.com for Firefox). A WebPushSession sends
+from an event loop instead, running in a thread of its own: one httpx client
+per push service origin multiplexes the requests as HTTP/2 streams over a few
+connections, the payloads are encrypted in a thread pool, and the VAPID
+headers are signed once per origin. get_session() returns the session of the
+process, started on first use, so every send reuses its connections.
+
+Requires httpx with HTTP/2 support: pip install httpx[http2].
+"""
+
+import asyncio
+import atexit
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import httpx
+from pywebpush import WebPushException
+
+from . import metrics
+from .concurrency import (
+	THROTTLE_STATUS_CODES, AsyncLimiterSlot, parse_retry_after, url_origin
+)
+from .exceptions import WebPushError
+from .settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
+from .transports import THROTTLED, UNREGISTERED
+from .webpush import (
+	WebPushApplication, _DecodedKeysWebPusher, decode_subscriber_keys,
+	get_subscription_info, vapid_headers
+)
+
+
+# The results dict of a subscription, and whether it has expired
+Result = Tuple[Dict[str, Any], bool]
+
+# VAPID headers are signed again this many seconds before they expire
+VAPID_REFRESH_MARGIN = 60 * 60
+
+
+def get_max_connections(origin: str) -> int:
+	"""The maximum number of HTTP/2 connections to a push service origin."""
+	return SETTINGS["WP_HTTP2_ORIGIN_MAX_CONNECTIONS"].get(
+		origin, SETTINGS["WP_HTTP2_MAX_CONNECTIONS"]
+	)
+
+
+def _create_client(origin: str) -> httpx.AsyncClient:
+	max_connections = get_max_connections(origin)
+	return httpx.AsyncClient(
+		http2=True,
+		limits=httpx.Limits(
+			max_connections=max_connections, max_keepalive_connections=max_connections
+		),
+	)
+
+
+def encrypt(
+	subscription_info: Dict[str, Any], data: bytes, content_encoding: str = "aes128gcm"
+) -> Tuple[bytes, Dict[str, str]]:
+	"""
+	Encrypts data for a subscription (aes128gcm, RFC 8291, or the legacy
+	aesgcm), and returns the body with the headers pywebpush sends with it.
+
+	:raises ValueError: If the subscription keys are malformed.
+	"""
+	keys = subscription_info["keys"]
+	subscriber_keys = decode_subscriber_keys(keys["p256dh"], keys["auth"])
+	pusher = _DecodedKeysWebPusher(subscription_info, subscriber_keys)
+	encoded = pusher.encode(data, content_encoding)
+	headers = {"Content-Encoding": content_encoding}
+	if "crypto_key" in encoded:
+		headers["Crypto-Key"] = "dh=" + encoded["crypto_key"].decode("utf8")
+	if "salt" in encoded:
+		headers["Encryption"] = "salt=" + encoded["salt"].decode("utf8")
+	return encoded["body"], headers
+
+
+class _SendOptions(NamedTuple):
+	ttl: int
+	headers: Dict[str, Any]
+	content_encoding: str
+	timeout: Optional[float]
+
+
+class WebPushSession:
+	"""
+	An event loop, with its HTTP/2 clients and encryption thread pool, running
+	in a thread of its own. send() can be called from any thread, and the
+	database is only used by the callers, outside of the event loop.
+
+		with WebPushSession() as session:
+			for batch in batches:
+				results = session.send(batch, message, application)
+	"""
+
+	def __init__(self) -> None:
+		self.pid = os.getpid()
+		self.loop = asyncio.new_event_loop()
+		self.executor = ThreadPoolExecutor()
+		# only used from the event loop
+		self.clients: Dict[str, httpx.AsyncClient] = {}
+		self.slots: Dict[Optional[str], AsyncLimiterSlot] = {}
+		self.vapid_headers: Dict[
+			Tuple[Optional[str], str], Tuple[Dict[str, str], float, Any, Any]
+		] = {}
+		self.thread = threading.Thread(
+			target=self.loop.run_forever, name="push-notifications-webpush", daemon=True
+		)
+		self.thread.start()
+
+	def __enter__(self) -> "WebPushSession":
+		return self
+
+	def __exit__(self, *exc_info: Any) -> None:
+		self.close()
+
+	def close(self) -> None:
+		try:
+			asyncio.run_coroutine_threadsafe(self._close_clients(), self.loop).result()
+		finally:
+			self.loop.call_soon_threadsafe(self.loop.stop)
+			self.thread.join()
+			self.loop.close()
+			self.executor.shutdown()
+
+	def send(
+		self,
+		subscriptions: Sequence[Any],
+		message: Union[str, bytes, None],
+		application: WebPushApplication,
+		ttl: int = 0,
+		headers: Optional[Dict[str, Any]] = None,
+		content_encoding: str = "aes128gcm",
+		timeout: Optional[float] = None,
+	) -> List[Result]:
+		"""
+		Sends message to subscriptions of the same application, concurrently
+		as far as the WP limiter of the application allows.
+
+		:param subscriptions: WebPushDevices, or any records with their
+			application_id, registration_id, browser, auth and p256dh attributes.
+		:param ttl, headers, content_encoding, timeout: As for webpush(); the
+			timeout defaults to the error timeout of the application.
+		:return: The result of each subscription, in order.
+		:raises WebPushError: For error responses other than an expired
+			subscription (404 and 410), and failed requests. Its `results`
+			attribute holds the results of the other subscriptions.
+		"""
+		options = _SendOptions(
+			ttl, dict(headers or {}), content_encoding,
+			application.timeout if timeout is None else timeout,
+		)
+		results = asyncio.run_coroutine_threadsafe(
+			self._send_all(subscriptions, message, application, options), self.loop
+		).result()
+		# like bulk_map(), every request completes before the first error is
+		# raised, with the results of the other subscriptions
+		errors = [result for result in results if isinstance(result, BaseException)]
+		if errors:
+			if isinstance(errors[0], WebPushError):
+				errors[0].results = [
+					result for result in results if not isinstance(result, BaseException)
+				]
+			raise errors[0]
+		return results
+
+	async def _close_clients(self) -> None:
+		clients = list(self.clients.values())
+		self.clients.clear()
+		await asyncio.gather(*[client.aclose() for client in clients])
+
+	async def _send_all(
+		self,
+		subscriptions: Sequence[Any],
+		message: Union[str, bytes, None],
+		application: WebPushApplication,
+		options: _SendOptions,
+	) -> List[Union[Result, BaseException]]:
+		return await asyncio.gather(*[
+			self._send(subscription, message, application, options)
+			for subscription in subscriptions
+		], return_exceptions=True)
+
+	def _client(self, origin: str) -> httpx.AsyncClient:
+		client = self.clients.get(origin)
+		if client is None:
+			client = self.clients[origin] = _create_client(origin)
+		return client
+
+	def _slot(self, application: WebPushApplication) -> AsyncLimiterSlot:
+		# created from the event loop, which asyncio.Condition binds to on Python < 3.10
+		slot = self.slots.get(application.application_id)
+		if slot is None:
+			slot = self.slots[application.application_id] = AsyncLimiterSlot(application.limiter)
+		return slot
+
+	def _vapid_headers(self, application: WebPushApplication, endpoint: str) -> Dict[str, str]:
+		key = (application.application_id, url_origin(endpoint))
+		cached = self.vapid_headers.get(key)
+		if cached is not None:
+			headers, refresh_at, private_key, claims = cached
+			# signed again before they expire, or if the application changed
+			if time.time() < refresh_at and private_key is application.vapid_private_key \
+				and claims == application.vapid_claims:
+				return headers
+		# vapid_headers() adds the audience and expiry to the claims it is given
+		claims = dict(application.vapid_claims)
+		try:
+			headers = vapid_headers(endpoint, application.vapid_private_key, claims)
+		except WebPushException as e:
+			raise WebPushError(e.message)
+		self.vapid_headers[key] = (
+			headers, int(claims["exp"]) - VAPID_REFRESH_MARGIN,
+			application.vapid_private_key, dict(application.vapid_claims),
+		)
+		return headers
+
+	async def _post(
+		self,
+		application: WebPushApplication,
+		endpoint: str,
+		body: Optional[bytes],
+		encryption_headers: Dict[str, str],
+		options: _SendOptions,
+	) -> httpx.Response:
+		# the same headers as pywebpush
+		headers = httpx.Headers(options.headers)
+		if application.vapid_claims:
+			headers.update(self._vapid_headers(application, endpoint))
+		for name, value in encryption_headers.items():
+			if name == "Crypto-Key" and headers.get(name):
+				value = headers[name] + ";" + value
+			headers[name] = value
+		if "TTL" not in headers or options.ttl:
+			headers["TTL"] = str(options.ttl or 0)
+		return await self._client(url_origin(endpoint)).post(
+			endpoint, content=body, headers=headers,
+			timeout=httpx.Timeout(options.timeout, pool=None),
+		)
+
+	async def _send(
+		self,
+		subscription: Any,
+		message: Union[str, bytes, None],
+		application: WebPushApplication,
+		options: _SendOptions,
+	) -> Result:
+		application_id = subscription.application_id
+		registration_id = subscription.registration_id
+		subscription_info = get_subscription_info(
+			application_id, registration_id, subscription.browser, subscription.auth,
+			subscription.p256dh
+		)
+		results = {"results": [{"original_registration_id": registration_id}]}
+		data = message.encode() if isinstance(message, str) else message
+		if metrics.enabled() and data:
+			metrics.observe("payload_bytes", len(data), platform="WP")
+		body, encryption_headers = None, {}
+		if data and application.transport is None:
+			# encrypted before taking a slot, so the CPU work does not hold back requests
+			try:
+				body, encryption_headers = await self.loop.run_in_executor(
+					self.executor, encrypt, subscription_info, data, options.content_encoding
+				)
+			except ValueError as e:
+				raise WebPushError(str(e))
+
+		async with self._slot(application) as limiter:
+			with metrics.span("request", platform="WP"):
+				start = time.monotonic()
+				try:
+					if application.transport is None:
+						response = await self._post(
+							application, subscription_info["endpoint"], body, encryption_headers, options
+						)
+						status_code, retry_after = response.status_code, response.headers.get("Retry-After")
+					else:
+						outcome = await application.transport.deliver_async(
+							"WP", application_id, subscription_info["endpoint"], message
+						)
+						status_code, retry_after = {UNREGISTERED: 410, THROTTLED: 429}.get(outcome, 201), None
+				except httpx.HTTPError as e:
+					if isinstance(e, httpx.TimeoutException):
+						limiter.record_timeout()
+					metrics.increment("failed", platform="WP", reason=type(e).__name__)
+					raise WebPushError("Push failed: {!r}".format(e))
+				latency = time.monotonic() - start
+				if status_code in THROTTLE_STATUS_CODES:
+					limiter.record_throttle(parse_retry_after(retry_after))
+				else:
+					limiter.record_success(latency, url_origin(subscription_info["endpoint"]))
+					metrics.observe("request_latency", latency, platform="WP")
+
+		if status_code <= 202:
+			results["success"] = 1
+			metrics.increment("sent", platform="WP")
+			return results, False
+		metrics.increment("failed", platform="WP", reason="HTTP %i" % status_code)
+		error = "Push failed: {}".format(status_code)
+		if application.transport is None:
+			error = "Push failed: {} {}\nResponse body:{}".format(
+				status_code, response.reason_phrase, response.text
+			)
+		if status_code in [404, 410]:
+			results["failure"] = 1
+			results["results"][0]["error"] = error
+			return results, True
+		raise WebPushError(error)
+
+
+_session: Optional[WebPushSession] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> WebPushSession:
+	"""
+	The WebPushSession of this process, started on first use and closed at
+	exit, so the sends of every thread share its HTTP/2 connections.
+	"""
+	global _session
+	with _session_lock:
+		if _session is None or _session.pid != os.getpid():
+			# a forked process does not inherit the event loop thread
+			_session = WebPushSession()
+	return _session
+
+
+def close_session() -> None:
+	"""Closes the WebPushSession of this process, if started."""
+	global _session
+	with _session_lock:
+		session, _session = _session, None
+	if session is not None and session.pid == os.getpid():
+		session.close()
+
+
+atexit.register(close_session)
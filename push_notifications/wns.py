@@ -6,13 +6,21 @@ https://msdn.microsoft.com/en-us/windows/uwp/controls-and-patterns/tiles-and-not
 """
 
 import json
+import socket
+import time
 import xml.etree.ElementTree as ET
+from io import BytesIO
 
 from django.core.exceptions import ImproperlyConfigured
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
+from . import metrics, payload
 from .compat import HTTPError, Request, urlencode, urlopen
+from .concurrency import (
+	THROTTLE_STATUS_CODES, bulk_map, get_limiter, parse_retry_after, url_origin
+)
 from .conf import get_manager
 from .exceptions import NotificationError
+from .transports import THROTTLED, UNREGISTERED, Transport, get_transport
 from .settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
 
 
@@ -86,20 +94,32 @@ def _wns_authenticate(
 	return access_token
 
 
+def _wns_access_token(application_id: Optional[str] = None) -> str:
+	"""An access token for the application, or "" when sending through a transport."""
+	if get_transport(application_id) is not None:
+		return ""
+	with metrics.span("connect", platform="WNS"):
+		return _wns_authenticate(application_id=application_id)
+
+
 def _wns_send(
 	uri: str,
 	data: bytes,
 	wns_type: str = "wns/toast",
 	application_id: Optional[str] = None,
+	access_token: Optional[str] = None,
 ) -> Any:
 	"""
 	Sends a notification data and authentication to WNS.
 
 	:param uri: str: The device's unique notification URI
 	:param data: dict: The notification data to be sent.
+	:param access_token: str: A token from _wns_access_token(), requested if not given.
 	:return:
 	"""
-	access_token = _wns_authenticate(application_id=application_id)
+	transport = get_transport(application_id)
+	if access_token is None:
+		access_token = _wns_access_token(application_id)
 
 	content_type = "text/xml"
 	if wns_type == "wns/raw":
@@ -116,10 +136,34 @@ def _wns_send(
 		data = data.encode("utf-8")
 
 	request = Request(uri, data, headers)
+	limiter = get_limiter("WNS", application_id)
+	metrics.observe("payload_bytes", len(data), platform="WNS")
 
 	# A lot of things can happen, let them know which one.
 	try:
-		response = urlopen(request)
+		with limiter.slot(), metrics.span("request", platform="WNS"):
+			start = time.monotonic()
+			try:
+				if transport is None:
+					response = urlopen(request)
+				else:
+					response = _transport_urlopen(transport, request, application_id)
+			except socket.timeout:
+				limiter.record_timeout()
+				metrics.increment("failed", platform="WNS", reason="timeout")
+				raise
+			except HTTPError as err:
+				metrics.increment("failed", platform="WNS", reason="HTTP %i" % err.code)
+				# 406 is the WNS throttle response
+				if err.code == 406 or err.code in THROTTLE_STATUS_CODES:
+					limiter.record_throttle(
+						parse_retry_after((err.headers or {}).get("Retry-After"))
+					)
+				raise
+			latency = time.monotonic() - start
+			limiter.record_success(latency, url_origin(uri))
+			metrics.observe("request_latency", latency, platform="WNS")
+			metrics.increment("sent", platform="WNS")
 	except HTTPError as err:
 		if err.code == 400:
 			msg = "One or more headers were specified incorrectly or conflict with another header."
@@ -148,6 +192,17 @@ def _wns_send(
 	return response.read().decode("utf-8")
 
 
+def _transport_urlopen(
+	transport: Transport, request: Request, application_id: Optional[str]
+) -> Any:
+	outcome = transport.deliver("WNS", application_id, request.full_url, request.data)
+	if outcome == UNREGISTERED:
+		raise HTTPError(request.full_url, 410, "Gone", {}, None)
+	elif outcome == THROTTLED:
+		raise HTTPError(request.full_url, 406, "Not Acceptable", {}, None)
+	return BytesIO(b"")
+
+
 def _wns_prepare_toast(data: Dict[str, List[str]], **kwargs: Any) -> bytes:
 	"""
 	Creates the xml tree for a `toast` notification
@@ -178,12 +233,63 @@ def _wns_prepare_toast(data: Dict[str, List[str]], **kwargs: Any) -> bytes:
 	return ET.tostring(root)
 
 
+def _fit_toast_text(text: str, **kwargs: Any) -> str:
+	"""
+	Checks the size of a toast notification of text, and truncates text if
+	needed and enabled.
+	"""
+	return payload.fit_text(
+		"WNS", text,
+		lambda text: payload.wns_size(_wns_prepare_toast(data={"text": [text]}, **kwargs))
+	)
+
+
+def _wns_prepare(
+	message: Optional[Any] = None,
+	xml_data: Optional[Dict[str, Any]] = None,
+	raw_data: Optional[str] = None,
+	**kwargs: Any,
+) -> Tuple[str, Any]:
+	"""
+	:return: The WNS type and the data of a notification, see `wns_send_message`.
+	:raises PayloadTooLarge: If the data exceeds the WNS payload size limit.
+	"""
+	# Create a simple toast notification
+	if message:
+		wns_type = "wns/toast"
+		if isinstance(message, str):
+			message = {
+				"text": [
+					_fit_toast_text(message, **kwargs),
+				],
+			}
+		prepared_data = _wns_prepare_toast(data=message, **kwargs)
+	# Create a toast/tile/badge notification from a dictionary
+	elif xml_data:
+		xml = dict_to_xml_schema(xml_data)
+		wns_type = "wns/%s" % xml.tag
+		prepared_data = ET.tostring(xml)
+	# Create a raw notification
+	elif raw_data:
+		wns_type = "wns/raw"
+		prepared_data = raw_data
+	else:
+		raise TypeError(
+			"At least one of the following parameters must be set:"
+			"`message`, `xml_data`, `raw_data`"
+		)
+
+	payload.check_size("WNS", payload.wns_size(prepared_data))
+	return wns_type, prepared_data
+
+
 def wns_send_message(
 	uri: str,
 	message: Optional[Any] = None,
 	xml_data: Optional[Dict[str, Any]] = None,
 	raw_data: Optional[str] = None,
 	application_id: Optional[str] = None,
+	access_token: Optional[str] = None,
 	**kwargs: Any,
 ) -> str:
 	"""
@@ -219,34 +325,12 @@ def wns_send_message(
 	:param message: str|dict: The notification data to be sent.
 	:param xml_data: dict: A dictionary containing data to be converted to an xml tree.
 	:param raw_data: str: Data to be sent via a `raw` notification.
+	:param access_token: str: A WNS access token, requested if not given.
 	"""
-	# Create a simple toast notification
-	if message:
-		wns_type = "wns/toast"
-		if isinstance(message, str):
-			message = {
-				"text": [
-					message,
-				],
-			}
-		prepared_data = _wns_prepare_toast(data=message, **kwargs)
-	# Create a toast/tile/badge notification from a dictionary
-	elif xml_data:
-		xml = dict_to_xml_schema(xml_data)
-		wns_type = "wns/%s" % xml.tag
-		prepared_data = ET.tostring(xml)
-	# Create a raw notification
-	elif raw_data:
-		wns_type = "wns/raw"
-		prepared_data = raw_data
-	else:
-		raise TypeError(
-			"At least one of the following parameters must be set:"
-			"`message`, `xml_data`, `raw_data`"
-		)
-
+	wns_type, prepared_data = _wns_prepare(message, xml_data, raw_data, **kwargs)
 	return _wns_send(
-		uri=uri, data=prepared_data, wns_type=wns_type, application_id=application_id
+		uri=uri, data=prepared_data, wns_type=wns_type, application_id=application_id,
+		access_token=access_token,
 	)
 
 
@@ -259,7 +343,8 @@ def wns_send_bulk_message(
 	**kwargs: Any,
 ) -> List[str]:
 	"""
-	WNS doesn't support bulk notification, so we loop through each uri.
+	WNS doesn't support bulk notification, so we send to each uri, concurrently
+	as far as the adaptive WNS limiter allows.
 
 	:param uri_list: list: A list of uris the notification will be sent to.
 	:param message: str: The notification data to be sent.
@@ -268,16 +353,22 @@ def wns_send_bulk_message(
 	"""
 	res = []
 	if uri_list:
-		for uri in uri_list:
-			r = wns_send_message(
-				uri=uri,
-				message=message,
-				xml_data=xml_data,
-				raw_data=raw_data,
-				application_id=application_id,
-				**kwargs,
+		# the notification is the same for every uri, prepare and check it once
+		wns_type, prepared_data = _wns_prepare(message, xml_data, raw_data, **kwargs)
+		# one access token for every uri, instead of a token request per uri
+		access_token = _wns_access_token(application_id)
+		with metrics.timed("batch", "batch_latency", platform="WNS"):
+			res = bulk_map(
+				get_limiter("WNS", application_id),
+				lambda uri: _wns_send(
+					uri=uri,
+					data=prepared_data,
+					wns_type=wns_type,
+					application_id=application_id,
+					access_token=access_token,
+				),
+				uri_list,
 			)
-			res.append(r)
 	return res
 
 
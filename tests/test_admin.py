@@ -3,131 +3,139 @@ from unittest import mock
 
 
 from django.contrib.admin import AdminSite
-from django.contrib import messages
 from django.http import HttpRequest
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
 
 from firebase_admin.messaging import Message, BatchResponse, SendResponse, UnregisteredError
 
 from push_notifications.admin import GCMDeviceAdmin
-from push_notifications.models import GCMDevice
+from push_notifications.changelist import (
+	EstimatedCountPaginator, estimate_count, exact_device_search
+)
+from push_notifications.jobs import run_send_job
+from push_notifications.models import GCMDevice, SendJob, WebPushDevice
+from push_notifications.settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
 from tests import responses
 
+from .test_jobs import ADMIN_SETTINGS
 
-class GCMDeviceAdminTestCase(TestCase):
-	def test_send_bulk_messages_action(self):
-		request = HttpRequest()
 
+@override_settings(**ADMIN_SETTINGS)
+class GCMDeviceAdminTestCase(TestCase):
+	def send_action(self, action, response):
+		"""Runs the send job started by an admin action, and returns the message sent."""
 		GCMDevice.objects.create(registration_id="abc", cloud_message_type="FCM")
 		queryset = GCMDevice.objects.all()
 		admin = GCMDeviceAdmin(GCMDevice, AdminSite())
-		admin.message_user = mock.Mock()
-
-		with mock.patch(
-			"firebase_admin.messaging.send_each", return_value=responses.FCM_SUCCESS
-		) as p:
-			admin.send_messages(request, queryset, bulk=True)
-
-			# one call
-			self.assertEqual(len(p.mock_calls), 1)
-
-			call = p.call_args
-			kwargs = call[1]
-
-			self.assertTrue("dry_run" in kwargs)
-			self.assertFalse(kwargs["dry_run"])
-			self.assertTrue("app" in kwargs)
-			self.assertIsNone(kwargs["app"])
-
-			# only one message
-			call_messages = call[0][0]
-			self.assertEqual(len(call_messages), 1)
 
-			message = call_messages[0]
-			self.assertIsInstance(message, Message)
-			self.assertEqual(message.token, "abc")
-			self.assertEqual(message.android.notification.body, "Test bulk notification")
+		with self.captureOnCommitCallbacks():
+			getattr(admin, action)(HttpRequest(), queryset)
+		job = SendJob.objects.get()
+		with mock.patch("firebase_admin.messaging.send_each", return_value=response) as p:
+			run_send_job(job, queryset)
 
-			admin.message_user.assert_called_once_with(
-				request, "All messages were sent.", level=messages.SUCCESS
-			)
-
-	def test_send_single_message_action(self):
-		request = HttpRequest()
+		# one call
+		self.assertEqual(len(p.mock_calls), 1)
 
-		GCMDevice.objects.create(registration_id="abc", cloud_message_type="FCM")
-		queryset = GCMDevice.objects.all()
-		admin = GCMDeviceAdmin(GCMDevice, AdminSite())
-		admin.message_user = mock.Mock()
+		call = p.call_args
+		kwargs = call[1]
 
-		with mock.patch(
-			"firebase_admin.messaging.send_each", return_value=responses.FCM_SUCCESS
-		) as p:
-			admin.send_messages(request, queryset, bulk=False)
+		self.assertTrue("dry_run" in kwargs)
+		self.assertFalse(kwargs["dry_run"])
+		self.assertTrue("app" in kwargs)
+		self.assertIsNone(kwargs["app"])
 
-			# one call
-			self.assertEqual(len(p.mock_calls), 1)
+		# only one message
+		call_messages = call[0][0]
+		self.assertEqual(len(call_messages), 1)
 
-			call = p.call_args
-			kwargs = call[1]
+		message = call_messages[0]
+		self.assertIsInstance(message, Message)
+		self.assertEqual(message.token, "abc")
+		return message
 
-			self.assertTrue("dry_run" in kwargs)
-			self.assertFalse(kwargs["dry_run"])
-			self.assertTrue("app" in kwargs)
-			self.assertIsNone(kwargs["app"])
+	def test_send_bulk_messages_action(self):
+		message = self.send_action("send_bulk_message", responses.FCM_SUCCESS)
+		self.assertEqual(message.android.notification.body, "Test bulk notification")
 
-			# only one message
-			call_messages = call[0][0]
-			self.assertEqual(len(call_messages), 1)
+		job = SendJob.objects.get()
+		self.assertEqual(job.status, SendJob.DONE)
+		self.assertEqual((job.sent, job.failed, job.deactivated), (1, 0, 0))
+		self.assertEqual(job.get_errors(), [])
 
-			message = call_messages[0]
-			self.assertIsInstance(message, Message)
-			self.assertEqual(message.token, "abc")
-			self.assertEqual(message.android.notification.body, "Test single notification")
+	def test_send_single_message_action(self):
+		message = self.send_action("send_message", responses.FCM_SUCCESS)
+		self.assertEqual(message.android.notification.body, "Test single notification")
 
-			admin.message_user.assert_called_once_with(
-				request, "All messages were sent.", level=messages.SUCCESS
-			)
+		job = SendJob.objects.get()
+		self.assertFalse(job.bulk)
+		self.assertEqual((job.sent, job.failed, job.deactivated), (1, 0, 0))
 
 	def test_send_bulk_messages_action_fail(self):
-		request = HttpRequest()
-
-		GCMDevice.objects.create(registration_id="abc", cloud_message_type="FCM")
-		queryset = GCMDevice.objects.all()
-		admin = GCMDeviceAdmin(GCMDevice, AdminSite())
-		admin.message_user = mock.Mock()
-
 		response = BatchResponse(
 			[SendResponse(resp={"name": "..."}, exception=UnregisteredError("error"),)]
 		)
+		message = self.send_action("send_bulk_message", response)
+		self.assertEqual(message.android.notification.body, "Test bulk notification")
+
+		job = SendJob.objects.get()
+		self.assertEqual((job.sent, job.failed, job.deactivated), (0, 1, 1))
+		self.assertEqual(job.get_errors(), ["UnregisteredError('error')"])
+
+
+@override_settings(**ADMIN_SETTINGS)
+class LargeTableAdminTestCase(TestCase):
+	def setUp(self):
+		patcher = mock.patch.dict(SETTINGS, {"ADMIN_LARGE_TABLES": True})
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		self.client.force_login(
+			User.objects.create_superuser("admin", "admin@example.com", "pass")
+		)
 
-		with mock.patch(
-			"firebase_admin.messaging.send_each", return_value=response
-		) as p:
-			admin.send_messages(request, queryset, bulk=True)
-
-			# one call
-			self.assertEqual(len(p.mock_calls), 1)
-
-			call = p.call_args
-			kwargs = call[1]
-
-			self.assertTrue("dry_run" in kwargs)
-			self.assertFalse(kwargs["dry_run"])
-			self.assertTrue("app" in kwargs)
-			self.assertIsNone(kwargs["app"])
-
-			# only one message
-			call_messages = call[0][0]
-			self.assertEqual(len(call_messages), 1)
-
-			message = call_messages[0]
-			self.assertIsInstance(message, Message)
-			self.assertEqual(message.token, "abc")
-			self.assertEqual(message.android.notification.body, "Test bulk notification")
-
-			error_message = "Some messages could not be processed: UnregisteredError('error')"
+	def test_keyset_pages(self):
+		GCMDevice.objects.bulk_create([
+			GCMDevice(registration_id="token%d" % i, device_id=i + 1) for i in range(5)
+		])
+		last_pk = max(GCMDevice.objects.values_list("pk", flat=True))
+		with mock.patch.object(GCMDeviceAdmin, "list_per_page", 3):
+			response = self.client.get("/admin/push_notifications/gcmdevice/")
+			cl = response.context["cl"]
+			self.assertEqual(
+				[d.pk for d in cl.result_list], [last_pk, last_pk - 1, last_pk - 2]
+			)
+			self.assertEqual(cl.next_page_query_string, "?id__lt=%d" % (last_pk - 2))
+			self.assertContains(response, "About 5 ")
 
-			admin.message_user.assert_called_once_with(
-				request, error_message, level=messages.ERROR
+			response = self.client.get(
+				"/admin/push_notifications/gcmdevice/?id__lt=%d" % (last_pk - 2)
 			)
+			cl = response.context["cl"]
+			self.assertEqual([d.pk for d in cl.result_list], [last_pk - 3, last_pk - 4])
+			self.assertIsNone(cl.next_page_query_string)
+
+	def test_exact_search(self):
+		GCMDevice.objects.create(registration_id="abcdef", device_id=0xff)
+		GCMDevice.objects.create(registration_id="abc")
+
+		queryset, _ = exact_device_search(GCMDevice.objects.all(), "abc")
+		self.assertEqual([d.registration_id for d in queryset], ["abc"])
+		queryset, _ = exact_device_search(GCMDevice.objects.all(), "0xff")
+		self.assertEqual([d.registration_id for d in queryset], ["abcdef"])
+		queryset, _ = exact_device_search(WebPushDevice.objects.all(), "0xff")
+		self.assertEqual(list(queryset), [])
+
+		response = self.client.get("/admin/push_notifications/gcmdevice/?q=abc")
+		self.assertEqual(
+			[d.registration_id for d in response.context["cl"].result_list], ["abc"]
+		)
+
+	def test_estimated_count(self):
+		queryset = GCMDevice.objects.order_by("-pk")
+		with mock.patch("push_notifications.changelist.estimate_count", return_value=2000000):
+			self.assertEqual(EstimatedCountPaginator(queryset, 100).count, 2000000)
+		with mock.patch("push_notifications.changelist.estimate_count", return_value=None):
+			self.assertEqual(EstimatedCountPaginator(queryset, 100).count, 0)
+		# only PostgreSQL has planner estimates
+		self.assertIsNone(estimate_count(queryset))
@@ -195,3 +195,55 @@ class APNSModelTestCase(TestCase):
 		self.assertIsNone(reg_2.time_to_live, "No time to live should be specified")
 		self.assertIsNone(reg_2.priority, "No priority should be specified")
 		self.assertIsNone(reg_2.collapse_key, "No collapse key should be specified")
+
+	def test_apns_send_message_interleaves_applications(self):
+		for i in range(5):
+			APNSDevice.objects.create(registration_id="aa%d" % i, application_id="big")
+		APNSDevice.objects.create(registration_id="bb", application_id="small")
+
+		def send(registration_ids, **kwargs):
+			if "aa2" in registration_ids:
+				error = APNSError("Unregistered")
+				error.results = {token: "Unregistered" for token in registration_ids}
+				raise error
+			return {token: "Success" for token in registration_ids}
+
+		with mock.patch.dict(
+			settings.PUSH_NOTIFICATIONS_SETTINGS, {"TENANT_CHUNK_SIZE": 2}
+		), mock.patch(
+			"push_notifications.apns_async.apns_send_bulk_message", side_effect=send,
+		) as send_bulk_message:
+			with self.assertRaises(APNSError) as ae:
+				APNSDevice.objects.all().send_message("Hello world")
+
+		self.assertEqual(
+			sorted(
+				(c[1]["application_id"], len(c[1]["registration_ids"]))
+				for c in send_bulk_message.call_args_list
+			),
+			[("big", 1), ("big", 2), ("big", 2), ("small", 1)],
+		)
+		# the results of the failed chunk are kept, and its devices deactivated
+		results = {token: result for r in ae.exception.results for token, result in r.items()}
+		self.assertEqual(len(results), 6)
+		inactive = APNSDevice.objects.filter(active=False)
+		self.assertEqual(
+			sorted(inactive.values_list("registration_id", flat=True)), ["aa2", "aa3"]
+		)
+
+	@override_settings()
+	@mock.patch("push_notifications.apns_async.APNs", autospec=True)
+	def test_apns_send_message_reuses_a_client_per_application(self, mock_apns):
+		settings.PUSH_NOTIFICATIONS_SETTINGS.update({
+			"APNS_CERTIFICATE": "/path/to/apns/certificate.pem", "TENANT_CHUNK_SIZE": 2,
+		})
+		self._create_devices(["abc", "def", "ghi", "jkl", "mno"])
+		mock_apns.return_value.send_notification.side_effect = lambda request: NotificationResult(
+			notification_id=request.notification_id, status="200"
+		)
+
+		results = APNSDevice.objects.all().send_message("Hello world")
+
+		self.assertEqual(len(results), 3)
+		self.assertEqual(mock_apns.call_count, 1)
+		self.assertEqual(mock_apns.return_value.send_notification.call_count, 5)
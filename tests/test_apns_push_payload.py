@@ -6,7 +6,7 @@ from django.test import TestCase
 
 try:
 	from apns2.client import NotificationPriority
-	from push_notifications.apns import _apns_send
+	from push_notifications.apns import APNSSession, _apns_send
 	from push_notifications.exceptions import APNSUnsupportedPriority
 except (AttributeError, ModuleNotFoundError):
 	# skipping because apns2 is not supported on python 3.10
@@ -113,3 +113,29 @@ class APNSPushPayloadTest(TestCase):
 				with mock.patch("apns2.client.APNsClient.send_notification") as s:
 					self.assertRaises(APNSUnsupportedPriority, _apns_send, "123", "_" * 2049, priority=24)
 				s.assert_has_calls([])
+
+	def test_batch_with_notification_options(self):
+		with mock.patch("apns2.credentials.init_context"):
+			with mock.patch("apns2.client.APNsClient.connect"):
+				with mock.patch("apns2.client.APNsClient.send_notification_batch") as s:
+					_apns_send(
+						["123", "456"], "sample", batch=True, badge=lambda token: len(token),
+						expiration=30, priority=5, collapse_id="456789"
+					)
+					args, kargs = s.call_args
+					self.assertEqual([n.token for n in args[0]], ["123", "456"])
+					self.assertEqual(args[0][0].payload.alert, "sample")
+					self.assertEqual(args[0][0].payload.badge, 3)
+					self.assertEqual(kargs["expiration"], 30)
+					self.assertEqual(kargs["priority"], NotificationPriority.Delayed)
+					self.assertEqual(kargs["collapse_id"], "456789")
+
+	def test_session_reuses_the_client(self):
+		with mock.patch("apns2.credentials.init_context"):
+			with mock.patch("apns2.client.APNsClient.connect") as connect:
+				with mock.patch("apns2.client.APNsClient.send_notification_batch") as s:
+					with APNSSession() as session:
+						_apns_send(["123"], "sample", batch=True, session=session)
+						_apns_send(["456"], "sample", batch=True, session=session)
+					self.assertEqual(connect.call_count, 1)
+					self.assertEqual(s.call_count, 2)
@@ -1,4 +1,5 @@
 import os
+from unittest import mock
 
 from django.core.exceptions import ImproperlyConfigured
 from django.test import TestCase
@@ -245,3 +246,136 @@ class AppConfigTestCase(TestCase):
 		app_config = manager._settings["APPLICATIONS"]["my_wns_app"]
 
 		assert app_config["WNS_ACCESS_URL"] == "https://login.live.com/accesstoken.srf"
+
+	def test_get_application(self):
+		"""
+		Applications are compiled into immutable per-platform settings objects.
+		"""
+
+		PUSH_SETTINGS = {
+			"APPLICATIONS": {
+				"my_fcm_app": {
+					"PLATFORM": "FCM",
+					"MAX_RECIPIENTS": 500,
+				},
+				"my_wp_app": {
+					"PLATFORM": "WP",
+					"PRIVATE_KEY": "...",
+					"CLAIMS": {"sub": "mailto:jazzband@example.com"},
+				},
+			}
+		}
+		manager = AppConfig(PUSH_SETTINGS)
+
+		application = manager.get_application("my_fcm_app")
+		assert application.platform == "FCM"
+		assert application.max_recipients == 500
+		assert manager.get_max_recipients("my_fcm_app") == 500
+		with self.assertRaises(AttributeError):
+			application.max_recipients = 1000
+
+		claims = manager.get_wp_claims("my_wp_app")
+		assert claims == {"sub": "mailto:jazzband@example.com"}
+		with self.assertRaises(TypeError):
+			claims["sub"] = "mailto:other@example.com"
+
+		with self.assertRaises(ImproperlyConfigured):
+			manager.get_application("unknown_app")
+		with self.assertRaises(ImproperlyConfigured):
+			manager.get_wp_private_key("my_fcm_app")
+		assert sorted(manager.get_applications()) == ["my_fcm_app", "my_wp_app"]
+
+	def test_has_auth_token_creds_per_application(self):
+		"""
+		Certificate and token credentials are tracked per application.
+		"""
+
+		path = os.path.join(os.path.dirname(__file__), "test_data", "good_revoked.pem")
+		PUSH_SETTINGS = {
+			"APPLICATIONS": {
+				"token_app": {
+					"PLATFORM": "APNS",
+					"AUTH_KEY_PATH": path,
+					"AUTH_KEY_ID": "123456",
+					"TEAM_ID": "123456",
+				},
+				"cert_app": {
+					"PLATFORM": "APNS",
+					"CERTIFICATE": path,
+				},
+			}
+		}
+		manager = AppConfig(PUSH_SETTINGS)
+
+		assert manager.has_auth_token_creds("token_app")
+		assert not manager.has_auth_token_creds("cert_app")
+		assert manager.get_apns_certificate("cert_app") == path
+		with self.assertRaises(ImproperlyConfigured):
+			manager.get_apns_certificate("token_app")
+
+	@mock.patch.dict("push_notifications.conf.app._firebase_apps")
+	@mock.patch("firebase_admin.initialize_app")
+	@mock.patch("firebase_admin.credentials.Certificate")
+	def test_firebase_app_from_credentials(self, mock_certificate, mock_initialize_app):
+		"""
+		Firebase apps configured with CREDENTIALS are initialised on first use,
+		then reused.
+		"""
+
+		credentials = {"type": "service_account", "project_id": "my-project"}
+		PUSH_SETTINGS = {
+			"APPLICATIONS": {
+				"my_fcm_app": {
+					"PLATFORM": "FCM",
+					"CREDENTIALS": credentials,
+					"FIREBASE_OPTIONS": {"httpTimeout": 5},
+				}
+			}
+		}
+		manager = AppConfig(PUSH_SETTINGS)
+		mock_initialize_app.assert_not_called()
+
+		app = manager.get_firebase_app("my_fcm_app")
+		self.assertIs(app, mock_initialize_app.return_value)
+		self.assertIs(manager.get_firebase_app("my_fcm_app"), app)
+		mock_certificate.assert_called_once_with(credentials)
+		mock_initialize_app.assert_called_once_with(
+			mock_certificate.return_value,
+			{"httpTimeout": 5},
+			name="push_notifications:my_fcm_app",
+		)
+
+	def test_firebase_app_and_credentials(self):
+		"""FIREBASE_APP and CREDENTIALS are mutually exclusive."""
+
+		PUSH_SETTINGS = {
+			"APPLICATIONS": {
+				"my_fcm_app": {
+					"PLATFORM": "FCM",
+					"FIREBASE_APP": object(),
+					"CREDENTIALS": "/path/to/credentials.json",
+				}
+			}
+		}
+		with self.assertRaises(ImproperlyConfigured):
+			AppConfig(PUSH_SETTINGS)
+
+	def test_lazy_loading(self):
+		"""
+		With LAZY_LOADING, APNs credential files are validated on first use.
+		"""
+
+		PUSH_SETTINGS = {
+			"LAZY_LOADING": True,
+			"APPLICATIONS": {
+				"my_ios_app": {
+					"PLATFORM": "APNS",
+					"CERTIFICATE": "/does/not/exist.pem",
+				}
+			},
+		}
+		manager = AppConfig(PUSH_SETTINGS)
+
+		assert manager.get_apns_topic("my_ios_app") is None
+		with self.assertRaises(ImproperlyConfigured):
+			manager.get_apns_certificate("my_ios_app")
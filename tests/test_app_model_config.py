@@ -0,0 +1,116 @@
+import json
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.test import TestCase
+
+from push_notifications.conf import AppModelConfig
+from push_notifications.conf.appmodel import GENERATION_CACHE_KEY
+from push_notifications.models import Application
+
+
+class AppModelConfigTestCase(TestCase):
+	def setUp(self):
+		cache.delete(GENERATION_CACHE_KEY)
+		Application.objects.create(
+			application_id="fcm_app", platform="FCM",
+			settings=json.dumps({"MAX_RECIPIENTS": 500}),
+		)
+		Application.objects.create(
+			application_id="wns_app", platform="WNS",
+			settings=json.dumps({"PACKAGE_SECURITY_ID": "sid", "SECRET_KEY": "secret"}),
+		)
+
+	def test_getters(self):
+		manager = AppModelConfig()
+		self.assertEqual(sorted(manager.get_applications()), ["fcm_app", "wns_app"])
+		self.assertEqual(manager.get_max_recipients("fcm_app"), 500)
+		self.assertIsNone(manager.get_firebase_app("fcm_app"))
+		self.assertEqual(manager.get_wns_secret_key("wns_app"), "secret")
+		with self.assertRaises(ImproperlyConfigured):
+			manager.get_wns_secret_key("fcm_app")
+		with self.assertRaises(ImproperlyConfigured):
+			manager.get_max_recipients("unknown_app")
+
+	@mock.patch.dict("push_notifications.conf.app._firebase_apps")
+	@mock.patch("firebase_admin.initialize_app")
+	@mock.patch("firebase_admin.credentials.Certificate")
+	def test_firebase_apps_are_preloaded(self, mock_certificate, mock_initialize_app):
+		credentials = {"type": "service_account", "project_id": "my-project"}
+		Application.objects.create(
+			application_id="credentials_app", platform="FCM",
+			settings=json.dumps({"CREDENTIALS": credentials}),
+		)
+		manager = AppModelConfig()
+		mock_initialize_app.assert_not_called()
+
+		self.assertIn("credentials_app", manager.get_applications())
+		mock_certificate.assert_called_once_with(credentials)
+		mock_initialize_app.assert_called_once()
+		self.assertIs(
+			manager.get_firebase_app("credentials_app"), mock_initialize_app.return_value
+		)
+		mock_initialize_app.assert_called_once()
+
+	@mock.patch.dict("push_notifications.conf.app._firebase_apps")
+	def test_invalid_credentials_are_skipped(self):
+		Application.objects.create(
+			application_id="credentials_app", platform="FCM",
+			settings=json.dumps({"CREDENTIALS": "/nonexistent/credentials.json"}),
+		)
+		with self.assertLogs("push_notifications.conf.appmodel", "ERROR"):
+			self.assertEqual(sorted(AppModelConfig().get_applications()), ["fcm_app", "wns_app"])
+
+	def test_cached(self):
+		manager = AppModelConfig()
+		with self.assertNumQueries(1):
+			manager.get_max_recipients("fcm_app")
+			manager.get_max_recipients("fcm_app")
+			manager.get_wns_secret_key("wns_app")
+
+	def test_invalidated_on_save(self):
+		manager = AppModelConfig()
+		self.assertEqual(manager.get_max_recipients("fcm_app"), 500)
+
+		application = Application.objects.get(application_id="fcm_app")
+		application.settings = json.dumps({"MAX_RECIPIENTS": 100})
+		application.save()
+		self.assertEqual(manager.get_max_recipients("fcm_app"), 100)
+
+		application.delete()
+		with self.assertRaises(ImproperlyConfigured):
+			manager.get_max_recipients("fcm_app")
+
+	def test_invalidated_by_other_process(self):
+		manager = AppModelConfig()
+		self.assertEqual(manager.get_max_recipients("fcm_app"), 500)
+
+		Application.objects.filter(application_id="fcm_app").update(
+			settings=json.dumps({"MAX_RECIPIENTS": 100})
+		)
+		# another process saved the application and bumped the shared generation
+		cache.set(GENERATION_CACHE_KEY, 1)
+		self.assertEqual(manager.get_max_recipients("fcm_app"), 500)
+		manager._next_check = 0
+		self.assertEqual(manager.get_max_recipients("fcm_app"), 100)
+
+	def test_shared_generation_bumped_on_commit(self):
+		with self.captureOnCommitCallbacks(execute=True):
+			Application.objects.create(application_id="wp_app", platform="WP")
+		self.assertEqual(cache.get(GENERATION_CACHE_KEY), 1)
+
+	def test_invalid_application_skipped(self):
+		Application.objects.create(application_id="bad_app", platform="WNS")
+		Application.objects.create(application_id="inactive_app", platform="FCM", active=False)
+		manager = AppModelConfig()
+		self.assertEqual(sorted(manager.get_applications()), ["fcm_app", "wns_app"])
+
+	def test_clean(self):
+		Application(application_id="ok", platform="FCM", settings="{}").clean()
+		with self.assertRaises(ValidationError):
+			Application(application_id="bad", platform="WNS", settings="{}").clean()
+		with self.assertRaises(ValidationError):
+			Application(application_id="bad", platform="FCM", settings="[1]").clean()
+		with self.assertRaises(ValidationError):
+			Application(application_id="bad", platform="FCM", settings="{").clean()
@@ -0,0 +1,58 @@
+import io
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from push_notifications.broadcast import BroadcastSummary, broadcast, pk_ranges
+from push_notifications.models import GCMDevice
+
+from .test_transports import TransportSettingsMixin
+
+
+class BroadcastTestCase(TransportSettingsMixin, TestCase):
+	def setUp(self):
+		self.devices = GCMDevice.objects.bulk_create([
+			GCMDevice(registration_id="token%d" % i) for i in range(10)
+		])
+		self.pks = sorted(GCMDevice.objects.values_list("pk", flat=True))
+
+	def test_pk_ranges(self):
+		first, last = self.pks[0], self.pks[-1]
+		ranges = pk_ranges(GCMDevice.objects.all(), 3)
+		self.assertEqual(ranges, [
+			(first, first + 4), (first + 4, first + 7), (first + 7, last + 1)
+		])
+		self.assertEqual(pk_ranges(GCMDevice.objects.all(), 2, shard=(1, 2)), [
+			(first + 5, first + 8), (first + 8, last + 1)
+		])
+		self.assertEqual(pk_ranges(GCMDevice.objects.none(), 3), [])
+		self.assertEqual(len(pk_ranges(GCMDevice.objects.filter(pk=first), 3)), 1)
+
+	def test_broadcast(self):
+		self.use_transport("capture")
+		with mock.patch(
+			"push_notifications.transports.CaptureTransport.deliver_many",
+			side_effect=lambda platform, app, items: [
+				"unregistered" if token == "token3" else None for token, payload in items
+			],
+		):
+			summary = broadcast(GCMDevice.objects.all(), "Hello", batch_size=4)
+		self.assertEqual(summary.sent, 9)
+		self.assertEqual(summary.failed, 1)
+		self.assertEqual(summary.deactivated, [self.pks[3]])
+
+	def test_shard_command(self):
+		transport = self.use_transport("capture")
+		stdout = io.StringIO()
+		call_command(
+			"push_broadcast", "FCM", "Hello", "--workers", "1", "--shard", "0/2", stdout=stdout
+		)
+		self.assertEqual(
+			sorted(m.token for m in transport.messages), ["token%d" % i for i in range(5)]
+		)
+		self.assertIn("Sent 5, failed 0, deactivated 0 devices", stdout.getvalue())
+
+	def test_merge(self):
+		summary = BroadcastSummary(1, 2, [1], ["a"]).merge(BroadcastSummary(3, 4, [2], ["b"]))
+		self.assertEqual(summary, BroadcastSummary(4, 6, [1, 2], ["a", "b"]))
@@ -0,0 +1,87 @@
+import threading
+from unittest import mock
+
+from django.test import TestCase
+
+from push_notifications.coalescing import Coalescer
+from push_notifications.models import APNSDevice, GCMDevice, WNSDevice
+
+
+class CoalescerTestCase(TestCase):
+	def setUp(self):
+		self.apns = APNSDevice.objects.create(registration_id="abc")
+		self.fcm = GCMDevice.objects.create(registration_id="def")
+
+	def test_latest_wins(self):
+		coalescer = Coalescer(window=60)
+		with mock.patch.object(APNSDevice, "send_message") as send_message:
+			coalescer.add(self.apns, "1 like", "likes")
+			coalescer.add(self.apns, "2 likes", "likes", sound="chime")
+			coalescer.add(self.apns, "New message", "chat")
+			self.assertEqual(len(coalescer), 2)
+			send_message.assert_not_called()
+
+			coalescer.flush()
+
+		self.assertEqual(len(coalescer), 0)
+		self.assertEqual(sorted(send_message.call_args_list), sorted([
+			mock.call("2 likes", collapse_id="likes", sound="chime"),
+			mock.call("New message", collapse_id="chat"),
+		]))
+
+	def test_merge(self):
+		coalescer = Coalescer(window=60, merge=lambda held, new: held + new)
+		with mock.patch.object(GCMDevice, "send_message") as send_message:
+			for _ in range(3):
+				coalescer.add(self.fcm, 1, "likes")
+			coalescer.flush()
+
+		send_message.assert_called_once_with(3, collapse_key="likes")
+
+	def test_queryset(self):
+		devices = WNSDevice.objects.all()
+		coalescer = Coalescer(window=60)
+		with self.assertRaises(ValueError):
+			coalescer.add(devices, "Hello", "chat")
+
+		coalescer.add(devices, "Hello", "chat", recipient=("user", 1))
+		coalescer.add(devices, "Hello again", "chat", recipient=("user", 1))
+		with mock.patch(
+			"push_notifications.models.WNSDeviceQuerySet.send_message"
+		) as send_message:
+			coalescer.flush()
+
+		# WNS has no collapse argument
+		send_message.assert_called_once_with("Hello again")
+
+	def test_window(self):
+		coalescer = Coalescer(window=0.01)
+		sent = threading.Event()
+		with mock.patch.object(
+			APNSDevice, "send_message", side_effect=lambda *args, **kwargs: sent.set()
+		) as send_message:
+			coalescer.add(self.apns, "Hello", "chat")
+			self.assertTrue(sent.wait(5))
+
+		send_message.assert_called_once_with("Hello", collapse_id="chat")
+		self.assertEqual(len(coalescer), 0)
+
+	def test_one_thread_for_every_key(self):
+		threads = threading.active_count()
+		coalescer = Coalescer(window=60)
+		for i in range(10):
+			coalescer.add(self.apns, "Hello", "chat", recipient=i)
+		self.assertEqual(threading.active_count(), threads + 1)
+		self.assertEqual(len(coalescer), 10)
+
+	def test_flushed_key_is_held_again_for_a_full_window(self):
+		coalescer = Coalescer(window=60)
+		with mock.patch.object(APNSDevice, "send_message") as send_message:
+			coalescer.add(self.apns, "Hello", "chat")
+			coalescer.flush()
+			coalescer.add(self.apns, "Hello again", "chat")
+			# the deadline of the first notification is stale
+			[(deadline, _, key)] = coalescer._deadlines[:1]
+			coalescer._flush_key(key, deadline)
+		send_message.assert_called_once_with("Hello", collapse_id="chat")
+		self.assertEqual(len(coalescer), 1)
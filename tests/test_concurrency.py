@@ -0,0 +1,162 @@
+import asyncio
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from push_notifications import concurrency
+from push_notifications.concurrency import (
+	AdaptiveLimiter, AsyncLimiterSlot, bulk_map, fair_map, fair_order, get_limiter,
+	parse_retry_after
+)
+from push_notifications.exceptions import NotificationError
+
+
+class AdaptiveLimiterTestCase(SimpleTestCase):
+	def test_additive_increase(self):
+		limiter = AdaptiveLimiter(initial_limit=2, max_limit=10)
+		for _ in range(10):
+			limiter.record_success(0.1)
+		self.assertGreater(limiter.limit, 2)
+		self.assertLessEqual(limiter.limit, 10)
+		self.assertAlmostEqual(limiter.latency, 0.1)
+
+	def test_max_limit(self):
+		limiter = AdaptiveLimiter(initial_limit=2, max_limit=3)
+		for _ in range(100):
+			limiter.record_success(0.1)
+		self.assertEqual(limiter.limit, 3)
+
+	def test_multiplicative_decrease_on_throttle(self):
+		limiter = AdaptiveLimiter(initial_limit=16, min_limit=2)
+		limiter.record_throttle()
+		self.assertEqual(limiter.limit, 8)
+
+	def test_decrease_once_per_window(self):
+		limiter = AdaptiveLimiter(initial_limit=16)
+		limiter.record_success(10)
+		limiter.record_throttle()
+		limiter.record_timeout()
+		self.assertEqual(limiter.limit, 8)
+
+	def test_min_limit(self):
+		limiter = AdaptiveLimiter(initial_limit=4, min_limit=3)
+		limiter.record_timeout()
+		self.assertEqual(limiter.limit, 3)
+
+	def test_slow_responses_decrease(self):
+		limiter = AdaptiveLimiter(initial_limit=16, smoothing=1.0)
+		limiter.record_success(0.01)
+		limiter.record_success(1.0)
+		self.assertEqual(limiter.limit, 8)
+
+	def test_baseline_recovers_from_fast_outlier(self):
+		limiter = AdaptiveLimiter(initial_limit=16, max_limit=64)
+		limiter.record_success(0.001)
+		for _ in range(200):
+			limiter.record_success(0.1)
+		limit = limiter.limit
+		for _ in range(100):
+			limiter.record_success(0.1)
+		self.assertGreater(limiter.limit, limit)
+
+	def test_latency_keys_are_compared_separately(self):
+		limiter = AdaptiveLimiter(initial_limit=16, smoothing=1.0)
+		limiter.record_success(0.01, key=concurrency.size_class(1))
+		limiter.record_success(1.0, key=concurrency.size_class(500))
+		self.assertGreaterEqual(limiter.limit, 16)
+		limiter.record_success(1.0, key=concurrency.size_class(1))
+		self.assertEqual(limiter.limit, 8)
+
+	def test_url_origin(self):
+		self.assertEqual(
+			concurrency.url_origin("https://fcm.googleapis.com/fcm/send/abc"),
+			"https://fcm.googleapis.com"
+		)
+
+	def test_retry_after_blocks_acquire(self):
+		limiter = AdaptiveLimiter(initial_limit=4)
+		limiter.record_throttle(retry_after=60)
+		self.assertGreater(limiter.retry_delay(), 50)
+		self.assertFalse(limiter.try_acquire())
+
+	def test_slot(self):
+		limiter = AdaptiveLimiter(initial_limit=1)
+		with limiter.slot():
+			self.assertEqual(limiter.in_flight, 1)
+			self.assertFalse(limiter.try_acquire())
+		self.assertEqual(limiter.in_flight, 0)
+
+	def test_async_slot(self):
+		limiter = AdaptiveLimiter(initial_limit=2)
+		peak = []
+
+		async def work(slot):
+			async with slot:
+				peak.append(limiter.in_flight)
+				await asyncio.sleep(0.01)
+
+		async def run():
+			slot = AsyncLimiterSlot(limiter)
+			await asyncio.gather(*[work(slot) for _ in range(6)])
+
+		asyncio.run(run())
+		self.assertEqual(len(peak), 6)
+		self.assertLessEqual(max(peak), 2)
+		self.assertEqual(limiter.in_flight, 0)
+
+
+class ConcurrencyHelpersTestCase(SimpleTestCase):
+	def test_parse_retry_after(self):
+		self.assertEqual(parse_retry_after("120"), 120.0)
+		self.assertIsNone(parse_retry_after(None))
+		self.assertIsNone(parse_retry_after("soon"))
+		self.assertEqual(parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT"), 0.0)
+
+	def test_get_limiter_is_shared(self):
+		self.assertIs(get_limiter("WNS", "app"), get_limiter("WNS", "app"))
+		self.assertIsNot(get_limiter("WNS", "app"), get_limiter("WP", "app"))
+		self.assertIn("WNS:app", concurrency.get_limiter_stats())
+
+	def test_get_limiter_settings(self):
+		with mock.patch.dict(concurrency.SETTINGS, {"CONCURRENCY": {"FCM": {"MAX_LIMIT": 3}}}):
+			limiter = get_limiter("FCM", "test_get_limiter_settings")
+		self.assertEqual(limiter.max_limit, 3)
+		self.assertEqual(limiter.limit, 2)
+
+	def test_bulk_map_attaches_results_to_errors(self):
+		def fn(x):
+			if x == 2:
+				raise NotificationError("error")
+			return x
+
+		with self.assertRaises(NotificationError) as cm:
+			bulk_map(AdaptiveLimiter(max_limit=4), fn, range(5))
+		self.assertEqual(cm.exception.results, [0, 1, 3, 4])
+
+	def test_bulk_map_keeps_order(self):
+		limiter = AdaptiveLimiter(initial_limit=2, max_limit=4)
+		self.assertEqual(bulk_map(limiter, lambda x: x * 2, range(10)), list(range(0, 20, 2)))
+
+	def test_fair_order(self):
+		queues = {"big": [1, 2, 3, 4, 5], "small": ["a"], "weighted": ["x", "y", "z"]}
+		self.assertEqual(list(fair_order(queues, {"weighted": 2})), [
+			("big", 1), ("small", "a"), ("weighted", "x"), ("weighted", "y"),
+			("big", 2), ("weighted", "z"),
+			("big", 3), ("big", 4), ("big", 5),
+		])
+		self.assertEqual(list(fair_order({})), [])
+
+	def test_fair_map(self):
+		limiters = {"a": AdaptiveLimiter(max_limit=2), "b": AdaptiveLimiter(max_limit=2)}
+		started = []
+
+		def fn(key, item):
+			with limiters[key].slot():
+				started.append(key)
+				return key + str(item)
+
+		results = fair_map(fn, {"a": list(range(100)), "b": [0, 1]}, limiters)
+		self.assertEqual(results["a"], ["a%d" % i for i in range(100)])
+		self.assertEqual(results["b"], ["b0", "b1"])
+		# the small queue is not held back by the large one
+		self.assertLess(max(i for i, key in enumerate(started) if key == "b"), 10)
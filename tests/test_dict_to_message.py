@@ -96,7 +96,7 @@ class DictToMessageTest(TestCase):
 		}
 
 		message = dict_to_fcm_message(payload)
-		assert message.topic == "/topic/..."
+		assert message.topic == "..."
 		assert message.token is None
 
 	def test_receiver_mapping_token(self):
@@ -0,0 +1,110 @@
+from unittest import mock
+
+from django.test import TestCase
+from firebase_admin import messaging
+
+from push_notifications.concurrency import get_limiter
+from push_notifications.gcm import dict_to_fcm_message, send_message, send_to_topic
+from push_notifications.models import GCMDevice, TopicSubscription
+
+
+def topic_response(count, errors=()):
+	return messaging.TopicManagementResponse({
+		"results": [{"error": "NOT_FOUND"} if i in errors else {} for i in range(count)]
+	})
+
+
+class FCMTopicTestCase(TestCase):
+	def test_send_to_topic(self):
+		message = dict_to_fcm_message({"message": "Hello members"})
+		with mock.patch("firebase_admin.messaging.send", return_value="msg-1") as send:
+			self.assertEqual(send_to_topic(message, topic="/topics/news"), "msg-1")
+
+		sent = send.call_args[0][0]
+		self.assertEqual(sent.topic, "news")
+		self.assertIsNone(sent.token)
+		self.assertEqual(sent.android.notification.body, "Hello members")
+		# the caller's message is left untouched
+		self.assertIsNone(message.topic)
+
+	def test_send_to_condition(self):
+		message = dict_to_fcm_message({"message": "Hello"})
+		with mock.patch("firebase_admin.messaging.send", return_value="msg-1") as send:
+			send_to_topic(message, condition="'news' in topics || 'sports' in topics")
+
+		sent = send.call_args[0][0]
+		self.assertIsNone(sent.topic)
+		self.assertEqual(sent.condition, "'news' in topics || 'sports' in topics")
+
+	def test_send_to_nothing(self):
+		with self.assertRaises(ValueError):
+			send_to_topic(dict_to_fcm_message({"message": "Hello"}))
+
+	def test_send_message_to_topic(self):
+		message = dict_to_fcm_message({"message": "Hello"})
+		with mock.patch("firebase_admin.messaging.send", return_value="msg-1") as send:
+			response = send_message(None, message, to="/topics/news")
+
+		self.assertEqual(send.call_args[0][0].topic, "news")
+		self.assertEqual(response.success_count, 1)
+		self.assertEqual(response.responses[0].message_id, "msg-1")
+
+	def test_send_message_to_legacy_topic(self):
+		message = dict_to_fcm_message({"message": "Hello", "to": "/topic/news"})
+		self.assertEqual(message.topic, "news")
+		with mock.patch("firebase_admin.messaging.send", return_value="msg-1") as send:
+			send_message(None, dict_to_fcm_message({"message": "Hello"}), to="/topic/news")
+		self.assertEqual(send.call_args[0][0].topic, "news")
+
+	def test_send_to_topic_records_throttles(self):
+		limiter = get_limiter("FCM")
+		error = messaging.QuotaExceededError("Sending limit exceeded")
+		with mock.patch("firebase_admin.messaging.send", side_effect=error), mock.patch.object(
+			limiter, "record_throttle"
+		) as record_throttle, mock.patch.object(limiter, "record_success") as record_success:
+			with self.assertRaises(messaging.QuotaExceededError):
+				send_to_topic(dict_to_fcm_message({"message": "Hello"}), topic="news")
+		record_throttle.assert_called_once_with(None)
+		record_success.assert_not_called()
+
+	def test_subscribe_in_batches(self):
+		GCMDevice.objects.bulk_create([
+			GCMDevice(registration_id="token%d" % i) for i in range(1500)
+		])
+		GCMDevice.objects.create(registration_id="inactive", active=False)
+
+		with mock.patch(
+			"firebase_admin.messaging.subscribe_to_topic",
+			side_effect=lambda tokens, topic, app: topic_response(len(tokens), errors={0}),
+		) as subscribe:
+			responses = GCMDevice.objects.all().subscribe_to_topic("/topics/news")
+
+		self.assertEqual(
+			sorted(len(c[0][0]) for c in subscribe.call_args_list), [500, 1000]
+		)
+		self.assertEqual(sum(response.success_count for response in responses), 1498)
+		self.assertEqual(sum(response.failure_count for response in responses), 2)
+		self.assertEqual(TopicSubscription.objects.filter(topic="news").count(), 1498)
+
+		# subscribing again is harmless
+		with mock.patch(
+			"firebase_admin.messaging.subscribe_to_topic",
+			side_effect=lambda tokens, topic, app: topic_response(len(tokens)),
+		):
+			GCMDevice.objects.all().subscribe_to_topic("news")
+		self.assertEqual(
+			GCMDevice.objects.filter(topic_subscriptions__topic="news").count(), 1500
+		)
+
+	def test_unsubscribe(self):
+		device = GCMDevice.objects.create(registration_id="abc")
+		TopicSubscription.objects.create(device=device, topic="news")
+
+		with mock.patch(
+			"firebase_admin.messaging.unsubscribe_from_topic", return_value=topic_response(1)
+		) as unsubscribe:
+			response = device.unsubscribe_from_topic("news")
+
+		unsubscribe.assert_called_once_with(["abc"], "news", app=None)
+		self.assertEqual(response.success_count, 1)
+		self.assertFalse(TopicSubscription.objects.exists())
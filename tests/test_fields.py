@@ -1,7 +1,11 @@
+from unittest import mock
+
 from django.core.exceptions import ValidationError
-from django.test import SimpleTestCase
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
 
-from push_notifications.fields import HexadecimalField
+from push_notifications.fields import HexadecimalField, hex_integers_to_db_values
+from push_notifications.models import GCMDevice
 
 
 class HexadecimalFieldTestCase(SimpleTestCase):
@@ -38,3 +42,36 @@ class HexadecimalFieldTestCase(SimpleTestCase):
 		f = HexadecimalField()
 		for valid, expected in self._VALID_HEX_VALUES.items():
 			self.assertEqual(expected, f.clean(valid))
+
+
+class HexIntegerFieldTestCase(TestCase):
+	def test_unsigned_values(self):
+		for device_id in ("0", "7fffffffffffffff", "8000000000000000", "ffffffffffffffff"):
+			GCMDevice.objects.create(registration_id=device_id, device_id=device_id)
+		for device_id in ("0", "7fffffffffffffff", "8000000000000000", "ffffffffffffffff"):
+			device = GCMDevice.objects.get(device_id=device_id)
+			self.assertEqual(device.registration_id, device_id)
+			self.assertEqual(device.device_id, int(device_id, 16))
+
+		self.assertEqual(
+			sorted(GCMDevice.objects.filter(
+				device_id__in=["ffffffffffffffff", 0x8000000000000000, "0x1"]
+			).values_list("device_id", flat=True)),
+			[0x8000000000000000, 0xffffffffffffffff],
+		)
+
+	def test_storage(self):
+		self.assertEqual(
+			hex_integers_to_db_values(["ffffffffffffffff", 1, None], connection),
+			[-1, 1, None],
+		)
+		unsigned_connection = mock.Mock(vendor="mysql", ops=connection.ops)
+		self.assertEqual(
+			hex_integers_to_db_values(["ffffffffffffffff", 1], unsigned_connection),
+			[0xffffffffffffffff, 1],
+		)
+		field = GCMDevice._meta.get_field("device_id")
+		self.assertEqual(field.get_db_converters(unsigned_connection), [])
+		self.assertEqual(field.get_db_prep_value("ff", unsigned_connection), 0xff)
+		with self.assertRaises(ValueError):
+			field.get_db_prep_value(2**64, connection)
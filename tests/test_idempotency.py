@@ -0,0 +1,57 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from push_notifications.exceptions import WebPushError
+from push_notifications.models import GCMDevice, WebPushDevice
+
+from .responses import FCM_SUCCESS
+
+
+class IdempotencyTestCase(TestCase):
+	def setUp(self):
+		cache.clear()
+		self.device = GCMDevice.objects.create(registration_id="abc")
+		GCMDevice.objects.create(registration_id="def")
+
+	def test_queryset_repeated_key_skipped(self):
+		with mock.patch("firebase_admin.messaging.send_each", return_value=FCM_SUCCESS) as p:
+			GCMDevice.objects.all().send_message("Hello", idempotency_key="task-1")
+			self.assertIsNone(
+				GCMDevice.objects.all().send_message("Hello", idempotency_key="task-1")
+			)
+			GCMDevice.objects.all().send_message("Hello", idempotency_key="task-2")
+			GCMDevice.objects.all().send_message("Hello")
+
+		self.assertEqual(p.call_count, 3)
+
+	def test_single_lookup_per_bulk_send(self):
+		with mock.patch("firebase_admin.messaging.send_each", return_value=FCM_SUCCESS), \
+			mock.patch.object(cache, "add", wraps=cache.add) as add:
+			GCMDevice.objects.all().send_message("Hello", idempotency_key="task-1")
+
+		add.assert_called_once()
+
+	def test_device_scope(self):
+		other = GCMDevice.objects.get(registration_id="def")
+		with mock.patch("firebase_admin.messaging.send_each", return_value=FCM_SUCCESS) as p:
+			self.device.send_message("Hello", idempotency_key="task-1")
+			other.send_message("Hello", idempotency_key="task-1")
+			self.device.send_message("Hello", idempotency_key="task-1")
+
+		self.assertEqual(p.call_count, 2)
+
+	def test_released_on_error(self):
+		device = WebPushDevice.objects.create(
+			registration_id="https://example.com/1", p256dh="key", auth="auth"
+		)
+		with mock.patch(
+			"push_notifications.webpush.webpush_send_message", side_effect=WebPushError("error")
+		):
+			with self.assertRaises(WebPushError):
+				device.send_message("Hello", idempotency_key="task-1")
+		with mock.patch("push_notifications.webpush.webpush_send_message") as send:
+			device.send_message("Hello", idempotency_key="task-1")
+
+		send.assert_called_once()
@@ -0,0 +1,180 @@
+import datetime
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from firebase_admin.messaging import BatchResponse, SendResponse, UnregisteredError
+
+from push_notifications.jobs import (
+	count_results, fail_stale_jobs, run_send_job, start_send_job
+)
+from push_notifications.models import GCMDevice, SendJob, WNSDevice
+from push_notifications.wns import WNSNotificationResponseError
+
+from .test_transports import TransportSettingsMixin
+
+
+class CountResultsTestCase(TestCase):
+	def test_formats(self):
+		fcm = BatchResponse([
+			SendResponse({"name": "1"}, None),
+			SendResponse(None, UnregisteredError("gone")),
+		])
+		self.assertEqual(count_results(fcm), (1, 1, ["UnregisteredError('gone')"]))
+		self.assertEqual(
+			count_results([{"abc": "Success", "def": "BadDeviceToken"}]), (1, 1, ["BadDeviceToken"])
+		)
+		self.assertEqual(
+			count_results([{"results": [{}]}, {"results": [{"error": "410"}]}]), (1, 1, ["410"])
+		)
+		self.assertEqual(count_results(["<response/>", "<response/>"]), (2, 0, []))
+		self.assertEqual(count_results(None), (0, 0, []))
+
+
+class SendJobTestCase(TransportSettingsMixin, TestCase):
+	def setUp(self):
+		GCMDevice.objects.bulk_create([
+			GCMDevice(registration_id="token%d" % i) for i in range(5)
+		])
+		GCMDevice.objects.create(registration_id="inactive", active=False)
+
+	def test_bulk(self):
+		transport = self.use_transport("capture")
+		with self.captureOnCommitCallbacks() as callbacks:
+			job = start_send_job(GCMDevice.objects.all(), "Hello")
+		self.assertEqual(len(callbacks), 1)
+		self.assertEqual(job.total, 5)
+
+		run_send_job(job, GCMDevice.objects.all())
+
+		job.refresh_from_db()
+		self.assertEqual(job.status, SendJob.DONE)
+		self.assertEqual((job.sent, job.failed, job.deactivated), (5, 0, 0))
+		self.assertEqual(len(transport.messages), 5)
+
+	def test_single_with_errors(self):
+		self.use_transport("latency", latency=0, error_rate=1)
+		with self.captureOnCommitCallbacks():
+			job = start_send_job(GCMDevice.objects.all(), "Hello", bulk=False)
+
+		run_send_job(job, GCMDevice.objects.all())
+
+		job.refresh_from_db()
+		self.assertEqual((job.sent, job.failed, job.deactivated), (0, 5, 5))
+		self.assertEqual(len(job.get_errors()), 5)
+
+	@mock.patch("push_notifications.wns._wns_authenticate", return_value="token")
+	@mock.patch("push_notifications.wns._wns_send")
+	def test_bulk_error_counts_the_other_devices(self, mock_send, _):
+		for uri in ("a", "b", "c"):
+			WNSDevice.objects.create(registration_id=uri)
+
+		def send(uri, **kwargs):
+			if uri == "b":
+				raise WNSNotificationResponseError("The channel expired.")
+			return "<response/>"
+
+		mock_send.side_effect = send
+		with self.captureOnCommitCallbacks():
+			job = start_send_job(WNSDevice.objects.all(), "Hello")
+
+		run_send_job(job, WNSDevice.objects.all())
+
+		job.refresh_from_db()
+		self.assertEqual(job.status, SendJob.DONE)
+		self.assertEqual((job.sent, job.failed), (2, 1))
+		self.assertEqual(job.get_errors(), ["The channel expired."])
+
+	def test_stale_jobs(self):
+		now = timezone.now()
+		with self.captureOnCommitCallbacks():
+			running = start_send_job(GCMDevice.objects.all(), "Hello")
+			pending = start_send_job(GCMDevice.objects.all(), "Hello")
+		SendJob.objects.filter(pk=running.pk).update(status=SendJob.RUNNING, date_heartbeat=now)
+
+		self.assertEqual(fail_stale_jobs(now + datetime.timedelta(minutes=5)), 0)
+		self.assertEqual(fail_stale_jobs(now + datetime.timedelta(minutes=11)), 2)
+		self.assertEqual(
+			set(SendJob.objects.filter(
+				pk__in=[running.pk, pending.pk]
+			).values_list("status", flat=True)),
+			{SendJob.FAILED},
+		)
+
+	def test_job_marked_failed_stops(self):
+		self.use_transport("capture")
+		with self.captureOnCommitCallbacks():
+			job = start_send_job(GCMDevice.objects.all(), "Hello")
+
+		with mock.patch("push_notifications.jobs.JOB_BATCH_SIZE", 2), mock.patch(
+			"push_notifications.jobs._send_batch",
+			side_effect=lambda devices, message, bulk: SendJob.objects.filter(pk=job.pk).update(
+				status=SendJob.FAILED
+			) and (2, 0, []),
+		) as send_batch:
+			run_send_job(job, GCMDevice.objects.all())
+
+		send_batch.assert_called_once()
+		job.refresh_from_db()
+		self.assertEqual((job.status, job.sent), (SendJob.FAILED, 0))
+
+
+ADMIN_SETTINGS = dict(
+	ROOT_URLCONF="tests.urls",
+	MIDDLEWARE=[
+		"django.contrib.sessions.middleware.SessionMiddleware",
+		"django.contrib.auth.middleware.AuthenticationMiddleware",
+		"django.contrib.messages.middleware.MessageMiddleware",
+	],
+	TEMPLATES=[{
+		"BACKEND": "django.template.backends.django.DjangoTemplates",
+		"APP_DIRS": True,
+		"OPTIONS": {"context_processors": [
+			"django.template.context_processors.request",
+			"django.contrib.auth.context_processors.auth",
+			"django.contrib.messages.context_processors.messages",
+		]},
+	}],
+)
+
+
+@override_settings(**ADMIN_SETTINGS)
+class SendJobAdminTestCase(TransportSettingsMixin, TestCase):
+	def setUp(self):
+		self.use_transport("capture")
+		GCMDevice.objects.create(registration_id="abc")
+		self.client.force_login(
+			User.objects.create_superuser("admin", "admin@example.com", "pass")
+		)
+
+	def test_action_starts_job(self):
+		with self.captureOnCommitCallbacks() as callbacks:
+			response = self.client.post("/admin/push_notifications/gcmdevice/", {
+				"action": "send_bulk_message",
+				"_selected_action": list(GCMDevice.objects.values_list("pk", flat=True)),
+			})
+		job = SendJob.objects.get()
+		self.assertRedirects(
+			response, "/admin/push_notifications/gcmdevice/send-job/%d/" % job.pk,
+			fetch_redirect_response=False,
+		)
+		self.assertEqual(len(callbacks), 1)
+
+		response = self.client.get("/admin/push_notifications/gcmdevice/send-job/%d/" % job.pk)
+		self.assertContains(response, "send-job-progress")
+
+		run_send_job(job, GCMDevice.objects.all())
+		response = self.client.get(
+			"/admin/push_notifications/gcmdevice/send-job/%d/" % job.pk, {"format": "json"}
+		)
+		self.assertEqual(response.json(), {
+			"status": "done", "total": 1, "sent": 1, "failed": 0, "deactivated": 0, "errors": [],
+		})
+
+	def test_other_model_job(self):
+		job = SendJob.objects.create(
+			device_model="push_notifications.APNSDevice", message="Hello"
+		)
+		response = self.client.get("/admin/push_notifications/gcmdevice/send-job/%d/" % job.pk)
+		self.assertEqual(response.status_code, 404)
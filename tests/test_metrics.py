@@ -0,0 +1,114 @@
+from contextlib import contextmanager
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+from firebase_admin.messaging import BatchResponse, SendResponse, UnregisteredError
+
+from push_notifications import metrics
+from push_notifications.concurrency import AdaptiveLimiter
+from push_notifications.models import GCMDevice
+from push_notifications.wns import wns_send_bulk_message
+
+
+class RecordingBackend(metrics.MetricsBackend):
+	def __init__(self, prefix="push_notifications"):
+		super().__init__(prefix)
+		self.counters = {}
+		self.observations = []
+		self.spans = []
+
+	def increment(self, name, value=1, tags=None):
+		key = (name,) + tuple(sorted((tags or {}).items()))
+		self.counters[key] = self.counters.get(key, 0) + value
+
+	def observe(self, name, value, tags=None):
+		self.observations.append(name)
+
+	@contextmanager
+	def span(self, name, tags=None):
+		self.spans.append(name)
+		yield
+
+
+class MetricsTestCase(SimpleTestCase):
+	def tearDown(self):
+		metrics.set_backend(None)
+
+	def test_no_backend(self):
+		metrics.set_backend(None)
+		self.assertFalse(metrics.enabled())
+		with metrics.span("request", platform="FCM"):
+			pass
+		with metrics.timed("batch", "batch_latency", platform="FCM"):
+			pass
+		metrics.increment("sent", platform="FCM")
+
+	def test_backend_from_settings(self):
+		with mock.patch.dict(metrics.SETTINGS, {
+			"METRICS_BACKEND": "tests.test_metrics.RecordingBackend",
+			"METRICS_OPTIONS": {"prefix": "push"},
+		}):
+			backend = metrics.get_backend(reload=True)
+		self.assertIsInstance(backend, RecordingBackend)
+		self.assertEqual(backend.metric_name("sent"), "push.sent")
+
+	def test_limiter_gauges_are_tagged_with_application_id(self):
+		backend = mock.Mock(spec=metrics.MetricsBackend)
+		metrics.set_backend(backend)
+		AdaptiveLimiter(platform="FCM", application_id="app").record_success(0.1)
+		AdaptiveLimiter(platform="FCM").record_success(0.1)
+		tags = [
+			call[0][2] for call in backend.gauge.call_args_list
+			if call[0][0] == "concurrency_limit"
+		]
+		self.assertEqual(tags, [
+			{"platform": "FCM", "application_id": "app"},
+			{"platform": "FCM", "application_id": "default"},
+		])
+
+	def test_timed(self):
+		backend = RecordingBackend()
+		metrics.set_backend(backend)
+		with metrics.timed("batch", "batch_latency", platform="FCM"):
+			pass
+		self.assertEqual(backend.spans, ["batch"])
+		self.assertEqual(backend.observations, ["batch_latency"])
+
+	@mock.patch("push_notifications.wns._wns_authenticate", return_value="token")
+	@mock.patch("push_notifications.wns._wns_send", return_value="ok")
+	def test_wns_bulk(self, mock_send, _):
+		backend = RecordingBackend()
+		metrics.set_backend(backend)
+		wns_send_bulk_message(uri_list=["one", "two"], message="test message")
+		self.assertIn("batch_latency", backend.observations)
+
+
+class GCMMetricsTestCase(TestCase):
+	def tearDown(self):
+		metrics.set_backend(None)
+
+	def test_fcm_send_counts(self):
+		backend = RecordingBackend()
+		metrics.set_backend(backend)
+		GCMDevice.objects.create(registration_id="abc", cloud_message_type="FCM")
+		GCMDevice.objects.create(registration_id="def", cloud_message_type="FCM")
+		response = BatchResponse([
+			SendResponse(resp={"name": "abc"}, exception=None),
+			SendResponse(resp={"name": "..."}, exception=UnregisteredError("error")),
+		])
+
+		with mock.patch("firebase_admin.messaging.send_each", return_value=response):
+			GCMDevice.objects.all().send_message("Hello world")
+
+		self.assertEqual(backend.counters[("sent", ("platform", "FCM"))], 1)
+		self.assertEqual(
+			backend.counters[
+				("failed", ("platform", "FCM"), ("reason", "UnregisteredError"))
+			], 1
+		)
+		self.assertEqual(backend.counters[("deactivated", ("platform", "FCM"))], 1)
+		self.assertIn("request_latency", backend.observations)
+		self.assertIn("batch_latency", backend.observations)
+		self.assertEqual(
+			backend.spans, ["batch", "build_payload", "request", "deactivate"]
+		)
@@ -7,7 +7,7 @@ from firebase_admin.exceptions import InvalidArgumentError
 from firebase_admin.messaging import BatchResponse, Message, SendResponse
 
 from push_notifications.gcm import dict_to_fcm_message, send_bulk_message
-from push_notifications.models import APNSDevice, GCMDevice
+from push_notifications.models import APNSDevice, GCMDevice, WNSDevice
 
 from . import responses
 
@@ -35,6 +35,14 @@ class GCMModelTestCase(TestCase):
 		assert device.date_created is not None
 		assert device.date_created.date() == timezone.now().date()
 
+	def test_fcm_queryset_forwards_kwargs(self):
+		self._create_fcm_devices(["abc"])
+		with mock.patch(
+			"push_notifications.gcm.send_application_messages", return_value=BatchResponse([])
+		) as p:
+			GCMDevice.objects.all().send_message("Hello world", dry_run=True, time_to_live=60)
+		self.assertEqual(p.call_args[1], {"dry_run": True, "time_to_live": 60})
+
 	def test_fcm_send_message(self):
 		device = GCMDevice.objects.create(registration_id="abc", cloud_message_type="FCM")
 		with mock.patch(
@@ -463,8 +471,78 @@ class GCMModelTestCase(TestCase):
 			send_bulk_message(reg_ids, message)
 			p.assert_called_once()
 
+	def test_fcm_send_message_deduplicates_tokens(self):
+		self._create_fcm_devices(["abc", "abc", "def"])
+
+		def send_each(messages, **kwargs):
+			return BatchResponse([
+				SendResponse(None, messaging.UnregisteredError("gone")) if m.token == "abc"
+				else SendResponse({"name": m.token}, None)
+				for m in messages
+			])
+
+		with mock.patch("firebase_admin.messaging.send_each", side_effect=send_each) as p:
+			response = GCMDevice.objects.order_by("-pk").send_message("Hello World")
+			self.assertEqual(sorted(m.token for m in p.call_args[0][0]), ["abc", "def"])
+
+		# one response per row, the duplicate rows sharing the response of their token
+		self.assertEqual(
+			[r.success for r in response.responses], [False, False, True]
+		)
+		self.assertEqual(response.failure_count, 2)
+
+		self.assertEqual(
+			sorted(GCMDevice.objects.values_list("registration_id", "active")),
+			[("abc", False), ("abc", False), ("def", True)],
+		)
+
+	def test_wns_send_message_deduplicates_tokens(self):
+		uris = [
+			"https://wns.example.com/1", "https://wns.example.com/2", "https://wns.example.com/1"
+		]
+		for uri in uris:
+			WNSDevice.objects.create(registration_id=uri)
+
+		with mock.patch(
+			"push_notifications.wns.wns_send_bulk_message",
+			side_effect=lambda uri_list, **kwargs: uri_list,
+		) as p:
+			results = WNSDevice.objects.all().send_message("Hello World")
+		self.assertEqual(
+			p.call_args[1]["uri_list"], ["https://wns.example.com/1", "https://wns.example.com/2"]
+		)
+		self.assertEqual(results, uris)
+
 	def test_can_save_wsn_device(self):
 		device = GCMDevice.objects.create(registration_id="a valid registration id")
 		self.assertIsNotNone(device.pk)
 		self.assertIsNotNone(device.date_created)
 		self.assertEqual(device.date_created.date(), timezone.now().date())
+
+
+class IterBatchesTestCase(TestCase):
+	def setUp(self):
+		WNSDevice.objects.bulk_create([
+			WNSDevice(registration_id="https://wns.example.com/%d" % i, active=i % 3 != 0)
+			for i in range(10)
+		])
+
+	def test_iter_batches(self):
+		with self.assertNumQueries(3):
+			batches = list(WNSDevice.objects.iter_batches(4))
+		self.assertEqual([len(batch) for batch in batches], [4, 4, 2])
+		rows = [row for batch in batches for row in batch]
+		self.assertEqual([row.pk for row in rows], sorted(row.pk for row in rows))
+		self.assertEqual(rows[0].registration_id, "https://wns.example.com/0")
+
+	def test_fields_and_filter(self):
+		batches = list(
+			WNSDevice.objects.filter(active=True).iter_batches(3, fields=("pk", "active", "name"))
+		)
+		self.assertEqual([len(batch) for batch in batches], [3, 3])
+		self.assertEqual(batches[0][0]._fields, ("pk", "active", "name"))
+		self.assertTrue(all(row.active for batch in batches for row in batch))
+
+	def test_empty(self):
+		devices = WNSDevice.objects.filter(registration_id="missing")
+		self.assertEqual(list(devices.iter_batches()), [])
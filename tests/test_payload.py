@@ -0,0 +1,132 @@
+import json
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+from firebase_admin import messaging
+
+from push_notifications import payload
+from push_notifications.apns_async import Alert, TokenCredentials, apns_send_bulk_message
+from push_notifications.exceptions import PayloadTooLarge
+from push_notifications.gcm import send_message
+from push_notifications.models import WebPushDevice
+from push_notifications.settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
+from push_notifications.wns import wns_send_bulk_message
+
+
+CREDS = TokenCredentials(key="aaa", key_id="bbb", team_id="ccc")
+
+
+class TruncateSettingsMixin:
+	def truncate(self):
+		patcher = mock.patch.dict(SETTINGS, {"PAYLOAD_TRUNCATE": True})
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+
+class PayloadTestCase(TruncateSettingsMixin, SimpleTestCase):
+	def test_truncate_text_keeps_characters_whole(self):
+		text = "é" * 10
+		truncated = payload.truncate_text(text, 10)
+		self.assertEqual(truncated, "é" * 3 + payload.ELLIPSIS)
+		self.assertLessEqual(len(truncated.encode()), 10)
+		self.assertEqual(payload.truncate_text(text, 20), text)
+
+	def test_fit_text_raises(self):
+		with self.assertRaises(PayloadTooLarge) as cm:
+			payload.fit_text("APNS", "a" * 5000, lambda text: len(text.encode()))
+		self.assertEqual(cm.exception.platform, "APNS")
+		self.assertEqual(cm.exception.size, 5000)
+		self.assertEqual(cm.exception.limit, 4096)
+
+	def test_fit_text_truncates(self):
+		self.truncate()
+		text = payload.fit_text("APNS", "日本" * 2000, lambda text: len(text.encode()) + 100)
+		self.assertLessEqual(len(text.encode()) + 100, 4096)
+		self.assertGreater(len(text.encode()) + 100, 4090)
+		self.assertTrue(text.endswith(payload.ELLIPSIS))
+
+	def test_fit_text_raises_when_the_rest_is_too_large(self):
+		self.truncate()
+		with self.assertRaises(PayloadTooLarge):
+			payload.fit_text("APNS", "short", lambda text: len(text.encode()) + 5000)
+
+	def test_fit_webpush_json_body(self):
+		self.truncate()
+		message = json.dumps({"title": "Hello", "body": "a" * 5000})
+		fitted = payload.fit_webpush_message(message)
+		self.assertLessEqual(payload.webpush_size(fitted), 4096)
+		self.assertEqual(json.loads(fitted)["title"], "Hello")
+		self.assertTrue(json.loads(fitted)["body"].endswith(payload.ELLIPSIS))
+
+	def test_fit_webpush_bytes(self):
+		self.truncate()
+		self.assertEqual(payload.fit_webpush_message(b"data"), b"data")
+		with self.assertRaises(PayloadTooLarge):
+			payload.fit_webpush_message(b"a" * 4096)
+
+
+class PayloadSendTestCase(TruncateSettingsMixin, TestCase):
+	@mock.patch("push_notifications.apns_async.APNs", autospec=True)
+	def test_apns_raises_before_connecting(self, mock_apns):
+		with self.assertRaises(PayloadTooLarge):
+			apns_send_bulk_message(["123", "456"], "a" * 5000, creds=CREDS)
+		mock_apns.assert_not_called()
+
+	@mock.patch("push_notifications.apns_async.APNs", autospec=True)
+	def test_apns_truncates_alert_body(self, mock_apns):
+		self.truncate()
+		alert = Alert(title="Title", body="a" * 5000)
+		apns_send_bulk_message(["123"], alert, creds=CREDS, extra={"custom": "data"})
+		request = mock_apns.return_value.send_notification.call_args[0][0]
+		self.assertLessEqual(payload.apns_size(request.message), 4096)
+		self.assertEqual(request.message["aps"]["alert"]["title"], "Title")
+		self.assertTrue(request.message["aps"]["alert"]["body"].endswith(payload.ELLIPSIS))
+		self.assertEqual(len(alert.body), 5000)
+
+	@mock.patch("firebase_admin.messaging.send_each")
+	def test_fcm_raises_before_sending(self, mock_send_each):
+		message = messaging.Message(notification=messaging.Notification(body="a" * 5000))
+		with self.assertRaises(PayloadTooLarge):
+			send_message(["abc", "def"], message)
+		mock_send_each.assert_not_called()
+
+	@mock.patch("firebase_admin.messaging.send_each")
+	def test_fcm_truncates_body(self, mock_send_each):
+		self.truncate()
+		mock_send_each.return_value = messaging.BatchResponse([
+			messaging.SendResponse({"name": "1"}, None),
+		])
+		message = messaging.Message(
+			notification=messaging.Notification(title="Title", body="a" * 5000),
+			android=messaging.AndroidConfig(
+				notification=messaging.AndroidNotification(body="a" * 5000)
+			),
+		)
+		send_message(["abc"], message)
+		sent = mock_send_each.call_args[0][0][0]
+		self.assertEqual(sent.token, "abc")
+		self.assertLessEqual(payload.fcm_size(sent), 4096)
+		self.assertTrue(sent.notification.body.endswith(payload.ELLIPSIS))
+		self.assertEqual(sent.android.notification.body, sent.notification.body)
+		self.assertEqual(len(message.notification.body), 5000)
+
+	@mock.patch("push_notifications.wns._wns_send")
+	def test_wns_raises_before_sending(self, mock_send):
+		with self.assertRaises(PayloadTooLarge):
+			wns_send_bulk_message(["one", "two"], raw_data="a" * 6000)
+		mock_send.assert_not_called()
+
+	@mock.patch("push_notifications.wns._wns_authenticate", return_value="token")
+	@mock.patch("push_notifications.wns._wns_send")
+	def test_wns_truncates_toast_text(self, mock_send, _):
+		self.truncate()
+		wns_send_bulk_message(["one"], message="a" * 6000)
+		data = mock_send.call_args[1]["data"]
+		self.assertLessEqual(len(data), 5120)
+		self.assertIn(payload.ELLIPSIS.encode("ascii", "xmlcharrefreplace"), data)
+
+	@mock.patch("push_notifications.models.WebPushDeviceQuerySet.iter_batches")
+	def test_webpush_raises_before_loading_devices(self, mock_iter_batches):
+		with self.assertRaises(PayloadTooLarge):
+			WebPushDevice.objects.all().send_message("a" * 4096)
+		mock_iter_batches.assert_not_called()
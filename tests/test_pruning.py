@@ -0,0 +1,113 @@
+import datetime
+import io
+import os
+import tempfile
+from unittest import mock
+
+import django
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from push_notifications.models import APNSDevice, GCMDevice
+from push_notifications.pruning import (
+	duplicate_devices, prune_devices, stale_devices, validate_fcm_devices
+)
+from push_notifications.transfer import read_rows
+
+from .test_transports import TransportSettingsMixin
+
+
+class PruningTestCase(TransportSettingsMixin, TestCase):
+	def test_duplicates(self):
+		old = GCMDevice.objects.create(registration_id="abc")
+		new = GCMDevice.objects.create(registration_id="abc")
+		other_app = GCMDevice.objects.create(registration_id="abc", application_id="app")
+		unique = GCMDevice.objects.create(registration_id="def")
+
+		self.assertEqual(list(duplicate_devices(GCMDevice)), [old])
+		self.assertEqual(prune_devices(duplicate_devices(GCMDevice), "FCM", batch_size=1), 1)
+		self.assertEqual(
+			sorted(GCMDevice.objects.values_list("pk", flat=True)),
+			sorted([new.pk, other_app.pk, unique.pk]),
+		)
+
+	def test_duplicates_keep_an_active_device(self):
+		active = GCMDevice.objects.create(registration_id="abc")
+		inactive = GCMDevice.objects.create(registration_id="abc", active=False)
+		self.assertEqual(list(duplicate_devices(GCMDevice)), [inactive])
+		self.assertEqual(active.pk, GCMDevice.objects.exclude(pk=inactive.pk).get().pk)
+
+	def test_duplicates_are_not_loaded(self):
+		for i in range(4):
+			GCMDevice.objects.create(registration_id="abc")
+		with self.assertNumQueries(0):
+			duplicates = duplicate_devices(GCMDevice)
+		with CaptureQueriesContext(connection) as queries:
+			self.assertEqual(prune_devices(duplicates, "FCM", batch_size=2), 3)
+		ranked = [query["sql"] for query in queries if "ROW_NUMBER" in query["sql"]]
+		self.assertTrue(ranked)
+		self.assertTrue(all("IN (SELECT" in sql for sql in ranked))
+		self.assertEqual(GCMDevice.objects.count(), 1)
+
+	def test_duplicates_without_window_filters(self):
+		old = GCMDevice.objects.create(registration_id="abc")
+		GCMDevice.objects.create(registration_id="abc")
+		inactive = GCMDevice.objects.create(registration_id="abc", active=False)
+		GCMDevice.objects.create(registration_id="abc", application_id="app")
+		old_app = GCMDevice.objects.create(registration_id="def", application_id="app")
+		GCMDevice.objects.create(registration_id="def", application_id="app")
+		with mock.patch.object(django, "VERSION", (4, 1)):
+			duplicates = duplicate_devices(GCMDevice)
+			self.assertEqual(
+				sorted(duplicates.values_list("pk", flat=True)), [old.pk, inactive.pk, old_app.pk]
+			)
+
+	def test_stale(self):
+		now = timezone.now()
+		APNSDevice.objects.create(registration_id="ab", active=False)
+		APNSDevice.objects.create(registration_id="cd", active=True)
+		stale = stale_devices(APNSDevice, 30, now + datetime.timedelta(days=31))
+		self.assertEqual([d.registration_id for d in stale], ["ab"])
+		self.assertEqual(stale_devices(APNSDevice, 30, now).count(), 0)
+
+		archive = io.StringIO()
+		self.assertEqual(prune_devices(stale, "APNS", archive), 1)
+		archive.seek(0)
+		self.assertEqual([row["registration_id"] for row in read_rows(archive)], ["ab"])
+		self.assertEqual([d.registration_id for d in APNSDevice.objects.all()], ["cd"])
+
+	def test_validate_fcm(self):
+		GCMDevice.objects.create(registration_id="alive")
+		GCMDevice.objects.create(registration_id="dead")
+		self.use_transport("null")
+		with mock.patch(
+			"push_notifications.transports.NullTransport.deliver_many",
+			side_effect=lambda platform, app, messages: [
+				"unregistered" if token == "dead" else None for token, message in messages
+			],
+		) as deliver_many:
+			self.assertEqual(validate_fcm_devices(), 1)
+		deliver_many.assert_called_once()
+		self.assertEqual(
+			sorted(GCMDevice.objects.values_list("registration_id", "active")),
+			[("alive", True), ("dead", False)],
+		)
+
+	def test_command(self):
+		GCMDevice.objects.create(registration_id="abc")
+		GCMDevice.objects.create(registration_id="abc")
+		stdout = io.StringIO()
+		call_command("push_prune", "--duplicates", "--dry-run", stdout=stdout)
+		self.assertIn("FCM: 1 duplicates devices would be deleted", stdout.getvalue())
+		self.assertEqual(GCMDevice.objects.count(), 2)
+
+		with tempfile.TemporaryDirectory() as directory:
+			call_command(
+				"push_prune", "--duplicates", "--platform", "FCM", "--archive", directory,
+				stdout=stdout,
+			)
+			self.assertEqual(len(os.listdir(directory)), 1)
+		self.assertEqual(GCMDevice.objects.count(), 1)
@@ -1,9 +1,13 @@
+from unittest import mock
+
 from django.test import TestCase
 
 from push_notifications.api.rest_framework import (
-	APNSDeviceSerializer, GCMDeviceSerializer, ValidationError
+	APNSDeviceSerializer, GCMDeviceSerializer, ValidationError, WebPushDeviceSerializer
 )
 
+from .test_webpush import generate_subscriber_keys
+
 
 GCM_DRF_INVALID_HEX_ERROR = {"device_id": ["Device ID is not a valid hex number"]}
 GCM_DRF_OUT_OF_RANGE_ERROR = {"device_id": ["Device ID is out of range"]}
@@ -146,3 +150,22 @@ class GCMDeviceSerializerTestCase(TestCase):
 			"application_id": "XXXXXXXXXXXXXXXXXXXX",
 		})
 		self.assertTrue(serializer.is_valid())
+
+
+class WebPushDeviceSerializerTestCase(TestCase):
+	def test_keys_validation(self):
+		p256dh, auth = generate_subscriber_keys()
+		data = {"registration_id": "https://example.com/1", "browser": "CHROME"}
+
+		serializer = WebPushDeviceSerializer(data=dict(data, p256dh=p256dh, auth=auth))
+		self.assertTrue(serializer.is_valid(), serializer.errors)
+
+		serializer = WebPushDeviceSerializer(data=dict(data, p256dh=p256dh[:-4], auth=auth))
+		self.assertFalse(serializer.is_valid())
+		self.assertIn("non_field_errors", serializer.errors)
+
+	def test_keys_without_webpush_extra(self):
+		data = {"registration_id": "https://example.com/1", "browser": "CHROME"}
+		with mock.patch.dict("sys.modules", {"push_notifications.webpush": None}):
+			serializer = WebPushDeviceSerializer(data=dict(data, p256dh="x", auth="y"))
+			self.assertTrue(serializer.is_valid(), serializer.errors)
@@ -0,0 +1,146 @@
+import datetime
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+
+from push_notifications.exceptions import NotificationError
+from push_notifications.models import GCMDevice, ScheduledPush
+from push_notifications.scheduling import dispatch_scheduled
+from push_notifications.settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
+
+from .test_transports import TransportSettingsMixin
+
+
+SEND_AT = datetime.datetime(2024, 1, 1, 9, 0, tzinfo=datetime.timezone.utc)
+
+
+class ScheduledPushTestCase(TransportSettingsMixin, TestCase):
+	def setUp(self):
+		self.transport = self.use_transport("capture")
+
+	def tokens(self):
+		return sorted(m.token for m in self.transport.messages)
+
+	def test_send_at(self):
+		GCMDevice.objects.create(registration_id="abc")
+		GCMDevice.objects.create(registration_id="def", active=False)
+		push = ScheduledPush.objects.create(platform="FCM", message="Hello", send_at=SEND_AT)
+
+		self.assertEqual(dispatch_scheduled(SEND_AT - datetime.timedelta(seconds=1)), 0)
+		self.assertEqual(self.tokens(), [])
+
+		self.assertEqual(dispatch_scheduled(SEND_AT), 1)
+		self.assertEqual(self.tokens(), ["abc"])
+		push.refresh_from_db()
+		self.assertEqual(push.status, ScheduledPush.DONE)
+		self.assertEqual(push.recipients, 1)
+
+		self.assertEqual(dispatch_scheduled(SEND_AT + datetime.timedelta(hours=1)), 0)
+		self.assertEqual(len(self.transport.messages), 1)
+
+	def test_options(self):
+		GCMDevice.objects.create(registration_id="abc")
+		ScheduledPush.objects.create(
+			platform="FCM", message="Hello", send_at=SEND_AT, options='{"title": "Greetings"}',
+		)
+
+		dispatch_scheduled(SEND_AT)
+		self.assertEqual(self.tokens(), ["abc"])
+		self.assertEqual(
+			self.transport.messages[0].payload.android.notification.title, "Greetings"
+		)
+
+	def test_local_time(self):
+		# the user id stands in for a UTC offset field of the user profile
+		patcher = mock.patch.dict(SETTINGS, {"SCHEDULE_UTC_OFFSET_FIELD": "user__id"})
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		GCMDevice.objects.create(registration_id="utc+2", user=User.objects.create(id=120))
+		GCMDevice.objects.create(registration_id="unknown")
+		push = ScheduledPush.objects.create(
+			platform="FCM", message="Hello", send_at=SEND_AT, local_time=True
+		)
+
+		dispatch_scheduled(SEND_AT - datetime.timedelta(hours=3))
+		self.assertEqual(push.buckets.count(), 2)
+		self.assertEqual(self.tokens(), [])
+
+		dispatch_scheduled(SEND_AT - datetime.timedelta(hours=2))
+		self.assertEqual(self.tokens(), ["utc+2"])
+
+		dispatch_scheduled(SEND_AT)
+		self.assertEqual(self.tokens(), ["unknown", "utc+2"])
+		push.refresh_from_db()
+		self.assertEqual(push.status, ScheduledPush.DONE)
+
+	def test_window(self):
+		for i in range(10):
+			GCMDevice.objects.create(registration_id="token%d" % i)
+		push = ScheduledPush.objects.create(
+			platform="FCM", message="Hello", send_at=SEND_AT, window=120
+		)
+
+		self.assertEqual(dispatch_scheduled(SEND_AT), 1)
+		self.assertEqual(len(self.transport.messages), 5)
+		push.refresh_from_db()
+		self.assertEqual(push.status, ScheduledPush.RUNNING)
+
+		self.assertEqual(dispatch_scheduled(SEND_AT + datetime.timedelta(seconds=60)), 1)
+		self.assertEqual(len(self.transport.messages), 10)
+		self.assertEqual(len(set(self.tokens())), 10)
+		push.refresh_from_db()
+		self.assertEqual(push.status, ScheduledPush.DONE)
+		self.assertEqual(push.recipients, 10)
+
+	def test_jitter(self):
+		GCMDevice.objects.create(registration_id="abc")
+		ScheduledPush.objects.create(platform="FCM", message="Hello", send_at=SEND_AT, jitter=30)
+
+		dispatch_scheduled(SEND_AT + datetime.timedelta(seconds=30))
+		self.assertEqual(self.tokens(), ["abc"])
+
+	def test_cancelled(self):
+		GCMDevice.objects.create(registration_id="abc")
+		ScheduledPush.objects.create(
+			platform="FCM", message="Hello", send_at=SEND_AT, status=ScheduledPush.CANCELLED
+		)
+
+		dispatch_scheduled(SEND_AT)
+		self.assertEqual(self.tokens(), [])
+
+	def test_command(self):
+		GCMDevice.objects.create(registration_id="abc")
+		ScheduledPush.objects.create(platform="FCM", message="Hello", send_at=SEND_AT)
+
+		call_command("push_dispatch", once=True)
+		self.assertEqual(self.tokens(), ["abc"])
+
+	def test_failed_slice_is_not_sent_again(self):
+		GCMDevice.objects.create(registration_id="abc")
+		push = ScheduledPush.objects.create(platform="FCM", message="Hello", send_at=SEND_AT)
+
+		with mock.patch(
+			"push_notifications.models.GCMDeviceQuerySet.send_message", side_effect=OSError
+		):
+			with self.assertRaises(OSError):
+				dispatch_scheduled(SEND_AT)
+
+		self.assertEqual(dispatch_scheduled(SEND_AT), 0)
+		self.assertEqual(self.tokens(), [])
+		push.refresh_from_db()
+		self.assertEqual(push.status, ScheduledPush.DONE)
+		self.assertEqual(push.recipients, 0)
+
+	def test_recipients_count_successful_slices(self):
+		GCMDevice.objects.create(registration_id="abc")
+		push = ScheduledPush.objects.create(platform="FCM", message="Hello", send_at=SEND_AT)
+
+		with mock.patch(
+			"push_notifications.models.GCMDeviceQuerySet.send_message",
+			side_effect=NotificationError("error"),
+		):
+			self.assertEqual(dispatch_scheduled(SEND_AT), 1)
+		push.refresh_from_db()
+		self.assertEqual(push.recipients, 0)
@@ -0,0 +1,116 @@
+import subprocess
+import sys
+
+from django.test import SimpleTestCase
+
+
+# Provider SDKs that must only load once a notification is sent
+PROVIDER_SDKS = {
+	"aiohttp", "aioapns", "apns2", "firebase_admin", "google", "h2", "httpx", "pywebpush",
+}
+
+# Microseconds the package modules may spend importing, as reported by
+# -X importtime. Generous, to not fail on slow CI machines, but far below the
+# cost of the SDKs (importing firebase_admin.messaging alone takes ~0.3s).
+IMPORT_BUDGET = 100000
+
+STARTUP_SCRIPT = """
+import socket
+import sys
+
+from django.conf import settings
+
+settings.configure(
+	INSTALLED_APPS=[
+		"django.contrib.auth", "django.contrib.contenttypes", "push_notifications"
+	],
+	DATABASES={"default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}},
+	PUSH_NOTIFICATIONS_SETTINGS={
+		"CONFIG": "push_notifications.conf.AppConfig",
+		"LAZY_LOADING": True,
+		"APPLICATIONS": dict(
+			[
+				("ios_%d" % i, {"PLATFORM": "APNS", "CERTIFICATE": "/does/not/exist.pem"})
+				for i in range(200)
+			] + [
+				("fcm_%d" % i, {"PLATFORM": "FCM", "CREDENTIALS": "/does/not/exist.json"})
+				for i in range(200)
+			]
+		),
+	},
+)
+import django
+from django.db import connection
+
+
+def no_network(*args, **kwargs):
+	raise AssertionError("network access at startup")
+
+
+socket.socket.connect = no_network
+socket.create_connection = no_network
+queries = []
+
+
+def record_query(execute, sql, params, many, context):
+	queries.append(sql)
+	return execute(sql, params, many, context)
+
+
+sys.stderr.write("-- push_notifications\\n")
+django.setup()
+with connection.execute_wrapper(record_query):
+	import push_notifications.concurrency
+	import push_notifications.conf
+	import push_notifications.metrics
+	import push_notifications.models
+	import push_notifications.transports
+
+	push_notifications.conf.get_manager().get_max_recipients("fcm_0")
+print(len(queries))
+"""
+
+
+class StartupTestCase(SimpleTestCase):
+	def test_import_time(self):
+		"""
+		Importing the package, its models and its configuration with LAZY_LOADING
+		must not load a provider SDK, read credential files, open a connection,
+		query the database or take long.
+
+		The app and its models are imported by django.setup() through
+		importlib, which -X importtime does not report, so only the modules
+		they import count towards the budget.
+		"""
+
+		proc = subprocess.run(
+			[sys.executable, "-X", "importtime", "-c", STARTUP_SCRIPT],
+			stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+		)
+		self.assertEqual(proc.returncode, 0, proc.stderr)
+
+		imported = set()
+		import_time = 0
+		# children are reported before the module importing them: walk back
+		# from each outermost package module, skipping what it imported
+		package_depth = None
+		lines = proc.stderr.split("-- push_notifications\n")[-1].splitlines()
+		for line in reversed(lines):
+			if not line.startswith("import time:") or "|" not in line:
+				continue
+			_, cumulative, name = line.split("|")
+			if not cumulative.strip().isdigit():
+				continue
+			depth = len(name) - len(name.lstrip())
+			imported.add(name.strip().split(".")[0])
+			if package_depth is not None and depth > package_depth:
+				continue
+			package_depth = None
+			if name.strip().split(".")[0] == "push_notifications":
+				import_time += int(cumulative)
+				package_depth = depth
+		self.assertEqual(imported & PROVIDER_SDKS, set())
+		self.assertGreater(import_time, 0)
+		self.assertLess(import_time, IMPORT_BUDGET)
+
+		self.assertEqual(proc.stdout.strip(), "0")
@@ -0,0 +1,95 @@
+import io
+import os
+import tempfile
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+
+from push_notifications.models import APNSDevice, GCMDevice, WebPushDevice
+from push_notifications.transfer import export_devices, import_devices, read_rows
+
+from .test_webpush import generate_subscriber_keys
+
+
+class DeviceTransferTestCase(TestCase):
+	def export(self, model, platform, format):
+		stream = io.StringIO()
+		export_devices(model.objects.all(), platform, stream, format, batch_size=2)
+		stream.seek(0)
+		return stream
+
+	def test_round_trip(self):
+		user = User.objects.create(username="user")
+		GCMDevice.objects.create(registration_id="abc", device_id="ffffffffffffffff", user=user)
+		GCMDevice.objects.create(registration_id="def", name="Phone", active=False)
+		GCMDevice.objects.create(registration_id="ghi", application_id="app")
+		expected = sorted(GCMDevice.objects.values_list(
+			"registration_id", "device_id", "user", "name", "active", "application_id"
+		))
+
+		for format in ("ndjson", "csv"):
+			stream = self.export(GCMDevice, "FCM", format)
+			GCMDevice.objects.all().delete()
+			result = import_devices("FCM", read_rows(stream, format), batch_size=2)
+			self.assertEqual((result.created, result.updated, result.errors), (3, 0, []))
+			self.assertEqual(sorted(GCMDevice.objects.values_list(
+				"registration_id", "device_id", "user", "name", "active", "application_id"
+			)), expected)
+
+	def test_update_and_errors(self):
+		APNSDevice.objects.create(registration_id="abcd", name="Old")
+		rows = [
+			{"registration_id": "abcd", "name": "New", "user": 1000},
+			{"registration_id": "not hex"},
+			{"registration_id": "ef01", "device_id": "not a uuid"},
+			{"registration_id": "ef01", "device_id": "a7b3b0b4-9c38-4a1b-8c4f-4f8b1f5d6a3e"},
+		]
+		result = import_devices("APNS", rows)
+		self.assertEqual((result.created, result.updated), (1, 1))
+		self.assertEqual([number for number, error in result.errors], [2, 3])
+		self.assertEqual(
+			sorted(APNSDevice.objects.values_list("registration_id", "name", "user")),
+			[("abcd", "New", None), ("ef01", None, None)],
+		)
+
+	def test_update_keeps_missing_fields(self):
+		user = User.objects.create(username="user")
+		GCMDevice.objects.create(
+			registration_id="abc", name="Phone", user=user, application_id="app"
+		)
+		GCMDevice.objects.create(registration_id="def", name="Tablet", user=user)
+		rows = [
+			{"registration_id": "abc", "active": False},
+			{"registration_id": "def", "name": "New", "user": 1000},
+		]
+		result = import_devices("FCM", rows)
+		self.assertEqual((result.created, result.updated), (0, 2))
+		self.assertEqual(
+			sorted(GCMDevice.objects.values_list(
+				"registration_id", "name", "user", "application_id", "active"
+			)),
+			[("abc", "Phone", user.pk, "app", False), ("def", "New", user.pk, None, True)],
+		)
+
+	def test_webpush_keys(self):
+		p256dh, auth = generate_subscriber_keys()
+		rows = [
+			{"registration_id": "https://push.example.com/1", "p256dh": p256dh, "auth": auth},
+			{"registration_id": "https://push.example.com/2", "p256dh": "bad", "auth": auth},
+		]
+		result = import_devices("WP", rows)
+		self.assertEqual(result.created, 1)
+		self.assertEqual([number for number, error in result.errors], [2])
+		self.assertEqual(WebPushDevice.objects.get().p256dh, p256dh)
+
+	def test_command(self):
+		GCMDevice.objects.create(registration_id="abc", device_id="0x1")
+		with tempfile.TemporaryDirectory() as directory:
+			path = os.path.join(directory, "devices.csv.gz")
+			call_command("push_devices", "export", "FCM", path, stderr=io.StringIO())
+			GCMDevice.objects.all().delete()
+			stderr = io.StringIO()
+			call_command("push_devices", "import", "FCM", path, stderr=stderr)
+		self.assertIn("Imported 1 new and 0 updated devices", stderr.getvalue())
+		self.assertEqual(GCMDevice.objects.get().device_id, 1)
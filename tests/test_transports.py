@@ -0,0 +1,144 @@
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+
+from push_notifications import transports
+from push_notifications.apns_async import apns_send_bulk_message
+from push_notifications.conf import AppConfig
+from push_notifications.exceptions import APNSError
+from push_notifications.gcm import dict_to_fcm_message
+from push_notifications.models import GCMDevice, WebPushDevice
+from push_notifications.settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
+from push_notifications.transports import (
+	CaptureTransport, LatencyTransport, NullTransport, get_transport
+)
+from push_notifications.wns import WNSNotificationResponseError, wns_send_message
+
+
+class TransportSettingsMixin:
+	def use_transport(self, transport, **options):
+		patcher = mock.patch.dict(
+			SETTINGS, {"TRANSPORT": transport, "TRANSPORT_OPTIONS": options}
+		)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		transports.reset_transports()
+		self.addCleanup(transports.reset_transports)
+		return get_transport()
+
+
+class GetTransportTestCase(TransportSettingsMixin, SimpleTestCase):
+	def test_no_transport(self):
+		transports.reset_transports()
+		self.assertIsNone(get_transport())
+
+	def test_builtin_transport(self):
+		transport = self.use_transport("latency", latency=0.5)
+		self.assertIsInstance(transport, LatencyTransport)
+		self.assertEqual(transport.latency, 0.5)
+		self.assertIs(get_transport(), transport)
+
+	def test_dotted_path(self):
+		transport = self.use_transport("push_notifications.transports.NullTransport")
+		self.assertIsInstance(transport, NullTransport)
+
+	def test_per_application(self):
+		manager = AppConfig({
+			"APPLICATIONS": {
+				"staging": {
+					"PLATFORM": "FCM",
+					"TRANSPORT": "capture",
+					"TRANSPORT_OPTIONS": {"size": 10},
+				},
+				"production": {"PLATFORM": "FCM"},
+			}
+		})
+		with mock.patch("push_notifications.transports.get_manager", return_value=manager):
+			transports.reset_transports()
+			self.addCleanup(transports.reset_transports)
+			transport = get_transport("staging")
+			self.assertIsInstance(transport, CaptureTransport)
+			self.assertEqual(transport._messages.maxlen, 10)
+			self.assertIsNone(get_transport("production"))
+
+
+class LatencyTransportTestCase(SimpleTestCase):
+	def test_error_mix(self):
+		transport = LatencyTransport(latency=0, error_rate=0.25, throttle_rate=0.25, seed=1)
+		outcomes = transport.deliver_many("FCM", None, [("token", None)] * 1000)
+		self.assertAlmostEqual(outcomes.count(transports.UNREGISTERED), 250, delta=50)
+		self.assertAlmostEqual(outcomes.count(transports.THROTTLED), 250, delta=50)
+		self.assertAlmostEqual(outcomes.count(None), 500, delta=50)
+
+	def test_capture_ring_buffer(self):
+		transport = CaptureTransport(size=2)
+		for token in ("a", "b", "c"):
+			transport.deliver("WNS", None, token, b"")
+		self.assertEqual([m.token for m in transport.messages], ["b", "c"])
+		self.assertEqual(transport.count, 3)
+		transport.clear()
+		self.assertEqual(transport.messages, [])
+
+
+class TransportSendTestCase(TransportSettingsMixin, TestCase):
+	def test_fcm_capture(self):
+		transport = self.use_transport("capture")
+		GCMDevice.objects.create(registration_id="abc", cloud_message_type="FCM")
+		GCMDevice.objects.create(registration_id="def", cloud_message_type="FCM")
+
+		with mock.patch("firebase_admin.messaging.send_each") as send_each:
+			response = GCMDevice.objects.all().send_message("Hello world")
+
+		send_each.assert_not_called()
+		self.assertEqual(response.success_count, 2)
+		self.assertEqual(sorted(m.token for m in transport.messages), ["abc", "def"])
+		self.assertEqual(
+			transport.messages[0].payload.android.notification.body, "Hello world"
+		)
+
+	def test_fcm_unregistered(self):
+		self.use_transport("latency", latency=0, error_rate=1)
+		GCMDevice.objects.create(registration_id="abc", cloud_message_type="FCM")
+
+		GCMDevice.objects.all().send_message(dict_to_fcm_message({"message": "Hello"}))
+
+		self.assertFalse(GCMDevice.objects.get().active)
+
+	def test_apns_capture(self):
+		transport = self.use_transport("capture")
+		with mock.patch("push_notifications.apns_async.APNs") as apns:
+			results = apns_send_bulk_message(["abc", "def"], alert="Hello")
+
+		apns.assert_not_called()
+		self.assertEqual(results, {"abc": "Success", "def": "Success"})
+		self.assertEqual(transport.messages[0].payload["aps"]["alert"], "Hello")
+
+	def test_apns_unregistered(self):
+		self.use_transport("latency", latency=0, error_rate=1)
+		with self.assertRaises(APNSError):
+			apns_send_bulk_message(["abc"], alert="Hello")
+
+	def test_wns(self):
+		transport = self.use_transport("capture")
+		with mock.patch("push_notifications.wns.urlopen") as urlopen:
+			wns_send_message(uri="https://wns.example.com/1", message="Hello")
+
+		urlopen.assert_not_called()
+		self.assertEqual(transport.messages[0].token, "https://wns.example.com/1")
+
+	def test_wns_unregistered(self):
+		self.use_transport("latency", latency=0, error_rate=1)
+		with self.assertRaises(WNSNotificationResponseError):
+			wns_send_message(uri="https://wns.example.com/1", message="Hello")
+
+	def test_webpush_unregistered(self):
+		self.use_transport("latency", latency=0, error_rate=1)
+		WebPushDevice.objects.create(
+			registration_id="https://example.com/1", p256dh="key", auth="auth"
+		)
+
+		with mock.patch("push_notifications.webpush.webpush") as webpush:
+			WebPushDevice.objects.all().send_message("Hello")
+
+		webpush.assert_not_called()
+		self.assertFalse(WebPushDevice.objects.get().active)
@@ -1,11 +1,15 @@
+import base64
+import os
 from unittest import mock
 
-from django.test import TestCase
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from django.test import SimpleTestCase, TestCase
 from pywebpush import WebPushException
 
 from push_notifications.exceptions import WebPushError
 from push_notifications.webpush import (
-	get_subscription_info, webpush_send_message
+	decode_subscriber_keys, get_subscription_info, webpush, webpush_send_message
 )
 
 # Mock Responses
@@ -17,6 +21,17 @@ mock_unsubscribe_response_404 = mock.MagicMock(
     status_code=404, ok=False, content="Unsubscribe")
 
 
+def generate_subscriber_keys():
+	"""The p256dh and auth keys of a new browser subscription."""
+	point = ec.generate_private_key(ec.SECP256R1()).public_key().public_bytes(
+		serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint
+	)
+	return (
+		base64.urlsafe_b64encode(point).decode().rstrip("="),
+		base64.urlsafe_b64encode(os.urandom(16)).decode().rstrip("="),
+	)
+
+
 class WebPushSendMessageTestCase(TestCase):
 	def setUp(self):
 		self.endpoint = "https://updates.push.services.mozilla.com/wpush/v2/token"
@@ -91,3 +106,115 @@ class WebPushSendMessageTestCase(TestCase):
 	def test_webpush_send_message_exception(self, webpush_mock):
 		with self.assertRaises(WebPushError):
 			webpush_send_message(self.mock_device, "message")
+
+	@mock.patch("push_notifications.webpush.webpush", return_value=mock_success_response)
+	def test_webpush_send_message_forwards_kwargs(self, webpush_mock):
+		webpush_send_message(self.mock_device, "message", verbose=True, ttl=60)
+		self.assertTrue(webpush_mock.call_args[1]["verbose"])
+		self.assertEqual(webpush_mock.call_args[1]["ttl"], 60)
+
+
+class WebPushDeviceQuerySetTestCase(TestCase):
+	@mock.patch(
+		"push_notifications.webpush.webpush",
+		side_effect=[
+			mock_success_response,
+			WebPushException("Unsubscribe", response=mock_unsubscribe_response),
+		])
+	def test_send_bulk_message_deactivates_expired(self, webpush_mock):
+		from push_notifications.models import WebPushDevice
+
+		WebPushDevice.objects.create(
+			registration_id="https://example.com/1", p256dh="key", auth="auth"
+		)
+		WebPushDevice.objects.create(
+			registration_id="https://example.com/2", p256dh="key", auth="auth"
+		)
+		with mock.patch("push_notifications.models.WebPushDevice.save") as save_mock:
+			results = WebPushDevice.objects.order_by("pk").send_message("message")
+
+		self.assertEqual(len(results), 2)
+		self.assertEqual(sum(r.get("failure", 0) for r in results), 1)
+		self.assertEqual(WebPushDevice.objects.filter(active=True).count(), 1)
+		save_mock.assert_not_called()
+
+	@mock.patch("push_notifications.webpush.webpush", return_value=mock_success_response)
+	def test_send_bulk_message_resolves_settings_once(self, webpush_mock):
+		from push_notifications.models import WebPushDevice
+		from push_notifications.webpush import get_webpush_application
+
+		WebPushDevice.objects.bulk_create([
+			WebPushDevice(registration_id="https://example.com/%d" % i, p256dh="key", auth="auth")
+			for i in range(5)
+		])
+		with mock.patch(
+			"push_notifications.webpush.get_webpush_application", wraps=get_webpush_application
+		) as resolve:
+			results = WebPushDevice.objects.all().send_message("message")
+
+		self.assertEqual(len(results), 5)
+		resolve.assert_called_once_with(None)
+		claims = [c[1]["vapid_claims"] for c in webpush_mock.call_args_list]
+		self.assertEqual(claims[0], {"sub": "mailto:jazzband@example.com"})
+		# every request gets its own copy of the claims
+		self.assertEqual(len({id(c) for c in claims}), 5)
+
+
+class SubscriberKeysTestCase(SimpleTestCase):
+	def setUp(self):
+		decode_subscriber_keys.cache_clear()
+
+	def test_cached(self):
+		p256dh, auth = generate_subscriber_keys()
+		keys = decode_subscriber_keys(p256dh, auth)
+		self.assertIs(decode_subscriber_keys(p256dh, auth), keys)
+		self.assertEqual(len(keys.auth), 16)
+		info = decode_subscriber_keys.cache_info()
+		self.assertEqual((info.hits, info.misses), (1, 1))
+
+	def test_malformed(self):
+		p256dh, auth = generate_subscriber_keys()
+		for bad_p256dh, bad_auth in (
+			("not base64!", auth),
+			(p256dh[:-4], auth),
+			("BA" + "A" * 85, auth),  # not on the curve
+			(p256dh, auth[:-4]),
+		):
+			with self.assertRaises(ValueError):
+				decode_subscriber_keys(bad_p256dh, bad_auth)
+
+	def test_webpush_encrypts_with_decoded_keys(self):
+		p256dh, auth = generate_subscriber_keys()
+		session = mock.Mock()
+		session.post.return_value = mock.Mock(status_code=201)
+		subscription_info = {
+			"endpoint": "https://example.com/1", "keys": {"p256dh": p256dh, "auth": auth}
+		}
+
+		webpush(subscription_info, "message", requests_session=session)
+		webpush(subscription_info, "message", requests_session=session)
+
+		self.assertEqual(session.post.call_count, 2)
+		self.assertEqual(session.post.call_args[0][0], "https://example.com/1")
+		self.assertEqual(session.post.call_args[1]["headers"]["content-encoding"], "aes128gcm")
+		self.assertEqual(decode_subscriber_keys.cache_info().hits, 1)
+
+	def test_webpush_curl(self):
+		p256dh, auth = generate_subscriber_keys()
+		session = mock.Mock()
+		subscription_info = {
+			"endpoint": "https://example.com/1", "keys": {"p256dh": p256dh, "auth": auth}
+		}
+
+		command = webpush(
+			subscription_info, "message", curl=True, verbose=True, requests_session=session
+		)
+
+		self.assertTrue(command.startswith("curl -vX POST https://example.com/1"))
+		session.post.assert_not_called()
+
+	def test_webpush_malformed_keys(self):
+		with self.assertRaises(WebPushException):
+			webpush(
+				{"endpoint": "https://example.com/1", "keys": {"p256dh": "x", "auth": "y"}}, "message"
+			)
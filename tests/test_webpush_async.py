@@ -0,0 +1,311 @@
+import base64
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import http_ece
+import httpx
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from django.test import SimpleTestCase, TestCase
+from py_vapid import Vapid01
+
+from push_notifications import webpush_async
+from push_notifications.concurrency import get_limiter
+from push_notifications.exceptions import WebPushError
+from push_notifications.models import WebPushDevice
+from push_notifications.settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
+from push_notifications.webpush import WebPushApplication
+from push_notifications.webpush_async import WebPushSession, get_max_connections
+
+from .test_transports import TransportSettingsMixin
+
+
+FCM_ENDPOINT = "https://fcm.googleapis.com/fcm/send/"
+MOZILLA_ENDPOINT = "https://updates.push.services.mozilla.com/wpush/v2/"
+
+
+def b64encode(data):
+	return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+class Subscription:
+	"""A browser subscription, with the private key to decrypt its messages."""
+
+	def __init__(self, endpoint, application_id=None):
+		self.private_key = ec.generate_private_key(ec.SECP256R1())
+		self.auth_secret = os.urandom(16)
+		self.application_id = application_id
+		self.registration_id = endpoint
+		self.browser = "CHROME"
+		self.p256dh = b64encode(self.private_key.public_key().public_bytes(
+			serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint
+		))
+		self.auth = b64encode(self.auth_secret)
+
+	def decrypt(self, body):
+		return http_ece.decrypt(
+			body, private_key=self.private_key, auth_secret=self.auth_secret, version="aes128gcm"
+		)
+
+
+def application(vapid_claims=None, vapid_private_key=None):
+	return WebPushApplication(
+		None, vapid_private_key, vapid_claims, 1, get_limiter("WP"), None
+	)
+
+
+class WebPushSessionTestCase(SimpleTestCase):
+	def setUp(self):
+		self.requests = []
+		self.statuses = {}
+		self.origins = []
+
+		def handler(request):
+			self.requests.append(request)
+			return httpx.Response(self.statuses.get(str(request.url), 201))
+
+		def create_client(origin):
+			self.origins.append(origin)
+			return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+		patcher = mock.patch(
+			"push_notifications.webpush_async._create_client", side_effect=create_client
+		)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def test_send_encrypts_for_each_subscription(self):
+		subscriptions = [Subscription(FCM_ENDPOINT + "a"), Subscription(MOZILLA_ENDPOINT + "b")]
+		with WebPushSession() as session:
+			results = session.send(subscriptions, "Hello", application())
+
+		self.assertEqual([result for result, expired in results], [
+			{"results": [{"original_registration_id": FCM_ENDPOINT + "a"}], "success": 1},
+			{"results": [{"original_registration_id": MOZILLA_ENDPOINT + "b"}], "success": 1},
+		])
+		requests = {str(request.url): request for request in self.requests}
+		for subscription in subscriptions:
+			request = requests[subscription.registration_id]
+			self.assertEqual(request.headers["Content-Encoding"], "aes128gcm")
+			self.assertEqual(request.headers["TTL"], "0")
+			self.assertEqual(subscription.decrypt(request.content), b"Hello")
+
+	def test_send_options(self):
+		subscription = Subscription(FCM_ENDPOINT + "a")
+		with WebPushSession() as session:
+			session.send(
+				[subscription], "Hello", application(), ttl=3600, headers={"Urgency": "high"}
+			)
+		[request] = self.requests
+		self.assertEqual(request.headers["TTL"], "3600")
+		self.assertEqual(request.headers["Urgency"], "high")
+
+	def test_aesgcm_content_encoding(self):
+		subscription = Subscription(FCM_ENDPOINT + "a")
+		with WebPushSession() as session:
+			session.send([subscription], "Hello", application(), content_encoding="aesgcm")
+		[request] = self.requests
+		self.assertEqual(request.headers["Content-Encoding"], "aesgcm")
+		self.assertTrue(request.headers["Crypto-Key"].startswith("dh="))
+		self.assertTrue(request.headers["Encryption"].startswith("salt="))
+
+	def test_clients_are_shared_per_origin(self):
+		subscriptions = [Subscription(FCM_ENDPOINT + str(i)) for i in range(3)]
+		subscriptions.append(Subscription(MOZILLA_ENDPOINT + "a"))
+		with WebPushSession() as session:
+			session.send(subscriptions[:2], "Hello", application())
+			session.send(subscriptions[2:], "Hello", application())
+		self.assertEqual(
+			sorted(self.origins),
+			["https://fcm.googleapis.com", "https://updates.push.services.mozilla.com"],
+		)
+		self.assertEqual(len(self.requests), 4)
+
+	def test_vapid_headers_are_signed_once_per_origin(self):
+		vapid = Vapid01()
+		vapid.generate_keys()
+		subscriptions = [Subscription(FCM_ENDPOINT + str(i)) for i in range(3)]
+		with mock.patch.object(vapid, "sign", wraps=vapid.sign) as sign, \
+			WebPushSession() as session:
+			session.send(subscriptions, "Hello", application({"sub": "mailto:a@example.com"}, vapid))
+		self.assertEqual(sign.call_count, 1)
+		self.assertEqual(sign.call_args[0][0]["aud"], "https://fcm.googleapis.com")
+		self.assertTrue(all("Authorization" in request.headers for request in self.requests))
+
+	def test_missing_vapid_private_key(self):
+		with WebPushSession() as session:
+			with self.assertRaises(WebPushError):
+				session.send(
+					[Subscription(FCM_ENDPOINT + "a")], "Hello",
+					application({"sub": "mailto:a@example.com"}),
+				)
+		self.assertEqual(self.requests, [])
+
+	def test_expired_subscription(self):
+		subscription = Subscription(FCM_ENDPOINT + "gone")
+		self.statuses[subscription.registration_id] = 410
+		with WebPushSession() as session:
+			[(result, expired)] = session.send([subscription], "Hello", application())
+		self.assertTrue(expired)
+		self.assertEqual(result["failure"], 1)
+
+	def test_error_is_raised_after_every_request(self):
+		subscriptions = [Subscription(FCM_ENDPOINT + "error"), Subscription(FCM_ENDPOINT + "ok")]
+		self.statuses[subscriptions[0].registration_id] = 400
+		with WebPushSession() as session:
+			with self.assertRaises(WebPushError):
+				session.send(subscriptions, "Hello", application())
+		self.assertEqual(len(self.requests), 2)
+
+	def test_invalid_keys(self):
+		subscription = Subscription(FCM_ENDPOINT + "a")
+		subscription.auth = "invalid"
+		with WebPushSession() as session:
+			with self.assertRaises(WebPushError):
+				session.send([subscription], "Hello", application())
+		self.assertEqual(self.requests, [])
+
+	def test_connection_errors_are_wrapped(self):
+		def create_client(origin):
+			def handler(request):
+				raise httpx.ConnectError("refused", request=request)
+			return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+		with mock.patch.object(webpush_async, "_create_client", side_effect=create_client):
+			with WebPushSession() as session:
+				with self.assertRaises(WebPushError) as cm:
+					session.send([Subscription(FCM_ENDPOINT + "a")], "Hello", application())
+		self.assertIn("ConnectError", cm.exception.message)
+
+	def test_vapid_headers_are_signed_again_before_expiry(self):
+		vapid = Vapid01()
+		vapid.generate_keys()
+		subscription = Subscription(FCM_ENDPOINT + "a")
+		with mock.patch.object(vapid, "sign", wraps=vapid.sign) as sign, \
+			WebPushSession() as session:
+			app = application({"sub": "mailto:a@example.com"}, vapid)
+			session.send([subscription], "Hello", app)
+			with mock.patch("time.time", return_value=time.time() + 12 * 60 * 60):
+				session.send([subscription], "Hello", app)
+		self.assertEqual(sign.call_count, 2)
+
+	def test_send_from_several_threads(self):
+		subscriptions = [Subscription(FCM_ENDPOINT + str(i)) for i in range(4)]
+		with WebPushSession() as session, ThreadPoolExecutor(4) as executor:
+			results = list(executor.map(
+				lambda subscription: session.send([subscription], "Hello", application()), subscriptions
+			))
+		self.assertEqual([result[0][0]["success"] for result in results], [1] * 4)
+		self.assertEqual(self.origins, ["https://fcm.googleapis.com"])
+
+	def test_max_connections(self):
+		with mock.patch.dict(SETTINGS, {
+			"WP_HTTP2_MAX_CONNECTIONS": 2,
+			"WP_HTTP2_ORIGIN_MAX_CONNECTIONS": {"https://fcm.googleapis.com": 8},
+		}):
+			self.assertEqual(get_max_connections("https://fcm.googleapis.com"), 8)
+			self.assertEqual(get_max_connections("https://updates.push.services.mozilla.com"), 2)
+
+
+class WebPushHTTP2QuerySetTestCase(TransportSettingsMixin, TestCase):
+	def setUp(self):
+		patcher = mock.patch.dict(SETTINGS, {"WP_HTTP2": True, "WP_CLAIMS": None})
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		webpush_async.close_session()
+		self.addCleanup(webpush_async.close_session)
+
+	def create_devices(self, count):
+		for i in range(count):
+			subscription = Subscription(FCM_ENDPOINT + str(i))
+			WebPushDevice.objects.create(
+				registration_id=subscription.registration_id,
+				p256dh=subscription.p256dh,
+				auth=subscription.auth,
+			)
+
+	def test_send_message_through_transport(self):
+		transport = self.use_transport("capture")
+		self.create_devices(3)
+		results = WebPushDevice.objects.all().send_message("Hello")
+		self.assertEqual(len(results), 3)
+		self.assertEqual(
+			sorted(message.token for message in transport.messages),
+			[FCM_ENDPOINT + str(i) for i in range(3)],
+		)
+
+	def test_send_message_deactivates_expired_devices(self):
+		self.create_devices(2)
+
+		def handler(request):
+			return httpx.Response(410 if str(request.url).endswith("1") else 201)
+
+		with mock.patch.object(
+			webpush_async, "_create_client",
+			side_effect=lambda origin: httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+		):
+			WebPushDevice.objects.all().send_message("Hello")
+		self.assertEqual(
+			list(WebPushDevice.objects.filter(active=True).values_list(
+				"registration_id", flat=True
+			)),
+			[FCM_ENDPOINT + "0"],
+		)
+
+	def test_session_is_started_on_first_send(self):
+		WebPushDevice.objects.all().send_message("Hello")
+		self.assertIsNone(webpush_async._session)
+
+		self.create_devices(2)
+		origins = []
+
+		def create_client(origin):
+			origins.append(origin)
+			return httpx.AsyncClient(
+				transport=httpx.MockTransport(lambda request: httpx.Response(201))
+			)
+
+		with mock.patch.object(webpush_async, "_create_client", side_effect=create_client):
+			WebPushDevice.objects.all().send_message("Hello")
+			session = webpush_async.get_session()
+			WebPushDevice.objects.all().send_message("Hello")
+		self.assertIs(webpush_async.get_session(), session)
+		self.assertEqual(origins, ["https://fcm.googleapis.com"])
+
+	def test_send_message_forwards_options(self):
+		self.create_devices(1)
+		requests = []
+
+		def handler(request):
+			requests.append(request)
+			return httpx.Response(201)
+
+		with mock.patch.object(
+			webpush_async, "_create_client",
+			side_effect=lambda origin: httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+		):
+			WebPushDevice.objects.all().send_message("Hello", ttl=60)
+		self.assertEqual(requests[0].headers["TTL"], "60")
+
+	def test_send_message_continues_after_an_error(self):
+		self.create_devices(3)
+
+		def handler(request):
+			url = str(request.url)
+			return httpx.Response(500 if url.endswith("0") else 410 if url.endswith("1") else 201)
+
+		with mock.patch.object(
+			webpush_async, "_create_client",
+			side_effect=lambda origin: httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+		):
+			with self.assertRaises(WebPushError) as cm:
+				WebPushDevice.objects.all().send_message("Hello")
+		self.assertEqual(len(cm.exception.results), 2)
+		self.assertEqual(
+			sorted(WebPushDevice.objects.filter(active=True).values_list(
+				"registration_id", flat=True
+			)),
+			[FCM_ENDPOINT + "0", FCM_ENDPOINT + "2"],
+		)
@@ -17,7 +17,8 @@ class WNSSendMessageTestCase(TestCase):
 	def test_send_message_calls_wns_send_with_toast(self, mock_method, _):
 		wns_send_message(uri="one", message="test message")
 		mock_method.assert_called_with(
-			application_id=None, uri="one", data="this is expected", wns_type="wns/toast"
+			application_id=None, uri="one", data="this is expected", wns_type="wns/toast",
+			access_token=None,
 		)
 
 	@mock.patch("push_notifications.wns._wns_prepare_toast", return_value="this is expected")
@@ -25,7 +26,8 @@ class WNSSendMessageTestCase(TestCase):
 	def test_send_message_calls_wns_send_with_application_id(self, mock_method, _):
 		wns_send_message(uri="one", message="test message", application_id="123456")
 		mock_method.assert_called_with(
-			application_id="123456", uri="one", data="this is expected", wns_type="wns/toast"
+			application_id="123456", uri="one", data="this is expected", wns_type="wns/toast",
+			access_token=None,
 		)
 
 	@mock.patch("push_notifications.wns.dict_to_xml_schema", return_value=ET.Element("toast"))
@@ -33,7 +35,8 @@ class WNSSendMessageTestCase(TestCase):
 	def test_send_message_calls_wns_send_with_xml(self, mock_method, _):
 		wns_send_message(uri="one", xml_data={"key": "value"})
 		mock_method.assert_called_with(
-			application_id=None, uri="one", data=b"<toast />", wns_type="wns/toast"
+			application_id=None, uri="one", data=b"<toast />", wns_type="wns/toast",
+			access_token=None,
 		)
 
 	def test_send_message_raises_TypeError_if_one_of_the_data_params_arent_filled(self):
@@ -45,17 +48,35 @@ class WNSSendBulkMessageTestCase(TestCase):
 	def setUp(self):
 		pass
 
-	@mock.patch("push_notifications.wns.wns_send_message")
+	@mock.patch("push_notifications.wns._wns_send")
 	def test_send_bulk_message_doesnt_call_send_message_with_empty_list(self, mock_method):
 		wns_send_bulk_message(uri_list=[], message="test message")
 		mock_method.assert_not_called()
 
-	@mock.patch("push_notifications.wns.wns_send_message")
-	def test_send_bulk_message_calls_send_message(self, mock_method):
-		wns_send_bulk_message(uri_list=["one", ], message="test message")
+	@mock.patch("push_notifications.wns._wns_authenticate", return_value="token")
+	@mock.patch("push_notifications.wns._wns_prepare_toast", return_value="this is expected")
+	@mock.patch("push_notifications.wns._wns_send")
+	def test_send_bulk_message_prepares_once(self, mock_method, mock_prepare, _):
+		wns_send_bulk_message(uri_list=["one", "two"], message="test message")
+		self.assertEqual(mock_method.call_count, 2)
 		mock_method.assert_called_with(
-			application_id=None, message="test message", raw_data=None, uri="one", xml_data=None
+			application_id=None, uri="two", data="this is expected", wns_type="wns/toast",
+			access_token="token",
+		)
+		# once to check the size, and once to build the notification
+		self.assertEqual(mock_prepare.call_count, 2)
+
+	@mock.patch("push_notifications.wns._wns_authenticate", return_value="token")
+	@mock.patch("push_notifications.wns.urlopen")
+	def test_send_bulk_message_authenticates_once(self, mock_urlopen, mock_authenticate):
+		mock_urlopen.return_value.headers = {}
+		wns_send_bulk_message(
+			uri_list=["https://wns.example.com/%d" % i for i in range(3)], message="test message"
 		)
+		mock_authenticate.assert_called_once_with(application_id=None)
+		self.assertEqual(mock_urlopen.call_count, 3)
+		for call in mock_urlopen.call_args_list:
+			self.assertEqual(call[0][0].headers["Authorization"], "Bearer token")
 
 
 class WNSDictToXmlSchemaTestCase(TestCase):